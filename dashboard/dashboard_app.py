@@ -9,7 +9,7 @@ import uuid
 import asyncio
 import websockets
 import time
-from scripts.websocket_server import GLOBAL_EXTENSION_READY_KEY # Import GLOBAL_EXTENSION_READY_KEY
+from redis_keys import GLOBAL_EXTENSION_READY_KEY
 
 DATA_DIR = os.path.join("/app", "data") # Define DATA_DIR here
 
@@ -48,6 +48,9 @@ redis_client = redis.Redis(host='redis', port=6379, db=0, decode_responses=True)
 # WebSocket server URL
 WEBSOCKET_SERVER_URL = "ws://websocket_server:8765" # Use service name for Docker Compose # Ensure this matches your websocket_server.py
 
+# Retrieval service (src/retrieval_service.py), which keeps the index and model resident
+RAG_SERVICE_URL = os.environ.get("RAG_SERVICE_URL", "http://rag_service:5002")
+
 # --- Redis Keys ---
 AGENT_TASKS_LIST = 'agent_tasks'             # Tasks for the agent to perform (e.g., generate script)
 PUPPETEER_TASKS_LIST = 'puppeteer_general_tasks_list' # Tasks for the Puppeteer worker
@@ -478,6 +481,47 @@ def get_last_received_dom():
     else:
         return jsonify({"error": "No DOM content available."}), 404
 
+def forward_to_rag_service(method, path, timeout, **kwargs):
+    """
+    Sends the request to the RAG retrieval service and relays its JSON reply with its status code.
+    An unreachable service gives 503; a reply that is not JSON (e.g. a proxy's 502 HTML page) gives
+    502 with the upstream status, instead of an exception inside the view.
+    """
+    try:
+        response = httpx.request(method, f"{RAG_SERVICE_URL}{path}", timeout=timeout, **kwargs)
+    except httpx.HTTPError as e:
+        print(f"Dashboard: RAG service request failed: {e}", flush=True, file=sys.stderr)
+        return jsonify({"error": "RAG service unavailable"}), 503
+    try:
+        return jsonify(response.json()), response.status_code
+    except (ValueError, httpx.HTTPError) as e:
+        print(f"Dashboard: RAG service returned an unreadable {response.status_code} response for {path}: {e}", flush=True, file=sys.stderr)
+        return jsonify({"error": "Invalid response from the RAG service", "upstream_status": response.status_code}), 502
+
+@app.route('/api/rag/retrieve', methods=['POST'])
+def api_rag_retrieve():
+    """
+    Forwards a retrieval query ({"query", "k", "mode"}) to the RAG retrieval service.
+    """
+    data = request.get_json(silent=True) or {}
+    if not data.get('query'):
+        return jsonify({"error": "query is required"}), 400
+    return forward_to_rag_service('POST', "/api/retrieve", 30.0, json=data)
+
+@app.route('/api/rag/related/<original_id>', methods=['GET'])
+def api_rag_related(original_id):
+    """
+    Forwards a "similar questions" lookup (precomputed, see src/related_questions.py) to the RAG retrieval service.
+    """
+    return forward_to_rag_service('GET', f"/api/related/{original_id}", 10.0, params=request.args)
+
+@app.route('/api/rag/sample', methods=['POST'])
+def api_rag_sample():
+    """
+    Forwards a diverse question sampling request ({"m", "filters", "seed", "central"}) to the RAG retrieval service.
+    """
+    return forward_to_rag_service('POST', "/api/sample", 10.0, json=request.get_json(silent=True) or {})
+
 @app.route('/api/worker_status', methods=['GET'])
 def get_worker_status():
     """Checks the status of the agent worker."""
@@ -9,6 +9,7 @@ import logging
 import time
 
 import uuid
+from redis_keys import GLOBAL_EXTENSION_READY_KEY # Shared with the dashboard
 
 # Configure detailed logging
 
@@ -28,9 +29,6 @@ AGENT_COMMANDS_LIST = 'agent_commands_list'
 EXTENSION_RESPONSES_LIST = 'extension_responses_list'
 EXTENSION_STATUS_KEY = 'extension_connection_status'
 
-# New Redis Key for global extension ready status
-GLOBAL_EXTENSION_READY_KEY = 'global_extension_ready_status'
-
 # Health Check related global variables
 last_extension_pong_time = 0 # Timestamp of the last PONG received from an extension
 dashboard_backend_websockets = set() # To store all WebSocket connections from Dashboard backends for health checks
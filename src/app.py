@@ -1,4 +1,7 @@
 from munjero_rag_system.app import app
+from embedding_model import warm_up_in_background
 
 if __name__ == "__main__":
+    # Serve immediately; the model loads in the background instead of blocking startup
+    warm_up_in_background()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,106 @@
+import os
+import numpy as np
+
+# CSV columns that retrieve(..., filters=...) can restrict on
+FILTER_ATTRIBUTES = ('subject', 'year', 'exam_type', 'difficulty')
+
+def question_attributes(row):
+    """
+    The filter attributes present in a CSV row, as strings ({} for rows without any).
+    """
+    attributes = {}
+    for attribute in FILTER_ATTRIBUTES:
+        value = row.get(attribute)
+        if value is not None and str(value).strip():
+            attributes[attribute] = str(value).strip()
+    return attributes
+
+def normalize_filters(filters):
+    """
+    Canonical, hashable form of a filters dict: ((attribute, (value, ...)), ...) sorted.
+    A value may be a single value or a list of accepted values (OR); attributes are ANDed.
+    """
+    if not filters:
+        return ()
+    normalized = []
+    for attribute, values in filters.items():
+        if attribute not in FILTER_ATTRIBUTES:
+            raise ValueError(f"Unknown filter attribute '{attribute}', expected one of {FILTER_ATTRIBUTES}")
+        if not isinstance(values, (list, tuple, set)):
+            values = [values]
+        normalized.append((attribute, tuple(sorted({str(value).strip() for value in values}))))
+    return tuple(sorted(normalized))
+
+def build_attribute_index(entries, output_path):
+    """
+    Builds the per-attribute id sets from an iterable of (chunk_faiss_ids, {attribute: value}) and
+    writes them to output_path (.npz, replaced atomically). For every attribute:
+
+      <attribute>.values   sorted distinct values
+      <attribute>.offsets  ids of values[i] are ids[offsets[i]:offsets[i+1]]
+      <attribute>.ids      FAISS ids, ascending within each value
+
+    Returns {attribute: {value: number of chunks}}.
+    """
+    ids_by_value = {attribute: {} for attribute in FILTER_ATTRIBUTES}
+    for chunk_ids, attributes in entries:
+        for attribute, value in attributes.items():
+            if attribute in ids_by_value:
+                ids_by_value[attribute].setdefault(value, []).append(np.asarray(chunk_ids, dtype='int64'))
+
+    arrays = {}
+    stats = {}
+    for attribute, by_value in ids_by_value.items():
+        values = sorted(by_value)
+        id_arrays = [np.sort(np.concatenate(by_value[value])) for value in values]
+        offsets = np.zeros(len(values) + 1, dtype='int64')
+        np.cumsum([len(ids) for ids in id_arrays], out=offsets[1:])
+        arrays[f"{attribute}.values"] = np.array(values, dtype=str)
+        arrays[f"{attribute}.offsets"] = offsets
+        arrays[f"{attribute}.ids"] = np.concatenate(id_arrays) if id_arrays else np.zeros(0, dtype='int64')
+        stats[attribute] = {value: len(ids) for value, ids in zip(values, id_arrays)}
+
+    tmp_path = output_path + ".tmp.npz" # np.savez appends .npz to names without it
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, output_path)
+    return stats
+
+class AttributeIndex:
+    """
+    Read side of the attribute id sets. ids_for(filters) resolves a filter to the sorted FAISS ids
+    it admits with a few array slices and sorted-array intersections, no per-row work.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._sets = {}
+        with np.load(path) as data:
+            for attribute in FILTER_ATTRIBUTES:
+                if f"{attribute}.values" in data:
+                    self._sets[attribute] = (
+                        {str(value): i for i, value in enumerate(data[f"{attribute}.values"])},
+                        data[f"{attribute}.offsets"],
+                        data[f"{attribute}.ids"]
+                    )
+
+    def values(self, attribute):
+        """
+        {value: number of chunks} for one attribute.
+        """
+        positions, offsets, _ = self._sets.get(attribute, ({}, None, None))
+        return {value: int(offsets[i + 1] - offsets[i]) for value, i in positions.items()}
+
+    def ids_for(self, normalized_filters):
+        """
+        Sorted FAISS ids matching normalize_filters() output.
+        """
+        selected = None
+        for attribute, values in normalized_filters:
+            positions, offsets, ids = self._sets.get(attribute, ({}, None, None))
+            parts = [ids[offsets[positions[value]]:offsets[positions[value] + 1]] for value in values if value in positions]
+            # A question has one value per attribute, so the parts are disjoint
+            attribute_ids = np.sort(np.concatenate(parts)) if len(parts) > 1 else (parts[0] if parts else np.zeros(0, dtype='int64'))
+            selected = attribute_ids if selected is None else np.intersect1d(selected, attribute_ids, assume_unique=True)
+            if not len(selected):
+                break
+        return selected if selected is not None else np.zeros(0, dtype='int64')
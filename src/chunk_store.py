@@ -0,0 +1,412 @@
+import os
+import sqlite3
+import threading
+import numpy as np
+
+# Stay well below SQLite's bound-parameter limit
+SQL_BATCH = 500
+
+
+class ChunkStore:
+    """
+    Chunk metadata for a FAISS index, stored in SQLite next to it (faiss_index.bin.map.db).
+
+    Replaces the JSON .map list: opening is O(1) and lookups only read the rows for the ids a
+    search returned, so neither startup time nor resident memory grows with the corpus.
+
+    Tables:
+      chunks(faiss_id, original_id, chunk_index, chunk_text)
+      questions(original_id, content_hash, num_chunks)  -- used by index_updater.py
+      question_attributes(original_id, attribute, value)  -- filter attributes, see attribute_index.py
+      chunk_duplicates(faiss_id, canonical_id)  -- near-duplicate chunks (near_duplicates.py) that have
+                                                   no vector of their own and share canonical_id's
+      passages(passage_id, problem_set_id, label, content)  -- shared passages of problem sets, and
+      question_passages(original_id, passage_id, position)  -- which questions they belong to (problem_sets.py)
+    """
+
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        self._lock = threading.Lock()
+        if readonly:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Chunk store not found at {path}")
+            self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+            # Older stores lack the chunk_duplicates and passage tables
+            tables = {name for (name,) in self._conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            self.has_duplicates = 'chunk_duplicates' in tables
+            self.has_passages = 'question_passages' in tables
+        else:
+            self.has_duplicates = self.has_passages = True
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._create_tables()
+
+    def _create_tables(self):
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                faiss_id INTEGER PRIMARY KEY,
+                original_id TEXT NOT NULL,
+                chunk_index INTEGER NOT NULL,
+                chunk_text TEXT NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS questions (
+                original_id TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                num_chunks INTEGER NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS question_attributes (
+                original_id TEXT NOT NULL,
+                attribute TEXT NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (original_id, attribute)
+            ) WITHOUT ROWID
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS chunk_duplicates (
+                faiss_id INTEGER PRIMARY KEY,
+                canonical_id INTEGER NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS chunk_duplicates_canonical ON chunk_duplicates (canonical_id)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS passages (
+                passage_id TEXT PRIMARY KEY,
+                problem_set_id TEXT NOT NULL,
+                label TEXT NOT NULL,
+                content TEXT NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS question_passages (
+                original_id TEXT NOT NULL,
+                passage_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                PRIMARY KEY (original_id, passage_id)
+            ) WITHOUT ROWID
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS question_passages_passage ON question_passages (passage_id)")
+        self._conn.commit()
+
+    def fetch(self, faiss_ids):
+        """
+        Returns {faiss_id: {'original_id', 'chunk_index', 'chunk_text'}} for the ids that exist.
+        """
+        ids = [int(faiss_id) for faiss_id in faiss_ids]
+        found = {}
+        with self._lock:
+            for start in range(0, len(ids), SQL_BATCH):
+                part = ids[start:start + SQL_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT faiss_id, original_id, chunk_index, chunk_text FROM chunks WHERE faiss_id IN ({','.join('?' * len(part))})",
+                    part
+                ).fetchall()
+                for faiss_id, original_id, chunk_index, chunk_text in rows:
+                    found[faiss_id] = {
+                        'original_id': original_id,
+                        'chunk_index': chunk_index,
+                        'chunk_text': chunk_text
+                    }
+        return found
+
+    def put_chunks(self, rows):
+        """
+        rows: iterable of (faiss_id, original_id, chunk_index, chunk_text).
+        """
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks (faiss_id, original_id, chunk_index, chunk_text) VALUES (?, ?, ?, ?)",
+                ((int(faiss_id), original_id, chunk_index, chunk_text) for faiss_id, original_id, chunk_index, chunk_text in rows)
+            )
+
+    def delete_chunks(self, faiss_ids):
+        faiss_ids = [(int(faiss_id),) for faiss_id in faiss_ids]
+        with self._lock:
+            self._conn.executemany("DELETE FROM chunks WHERE faiss_id = ?", faiss_ids)
+            self._conn.executemany("DELETE FROM chunk_duplicates WHERE faiss_id = ?", faiss_ids)
+
+    def put_duplicates(self, rows):
+        """
+        rows: iterable of (faiss_id, canonical_id) for chunks stored without a vector of their own.
+        """
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunk_duplicates (faiss_id, canonical_id) VALUES (?, ?)",
+                ((int(faiss_id), int(canonical_id)) for faiss_id, canonical_id in rows)
+            )
+
+    def duplicate_ids(self):
+        """
+        (duplicate faiss ids ascending, their canonical ids) as int64 arrays.
+        """
+        if not self.has_duplicates:
+            return np.zeros(0, dtype='int64'), np.zeros(0, dtype='int64')
+        with self._lock:
+            rows = self._conn.execute("SELECT faiss_id, canonical_id FROM chunk_duplicates ORDER BY faiss_id").fetchall()
+        pairs = np.array(rows, dtype='int64').reshape(-1, 2)
+        return pairs[:, 0], pairs[:, 1]
+
+    def canonical_ids(self, faiss_ids, duplicate_ids=None):
+        """
+        The ids whose vectors stand for faiss_ids in the index: duplicates are replaced by their canonical.
+        Pass duplicate_ids() when mapping several batches.
+        """
+        faiss_ids = np.asarray(faiss_ids, dtype='int64')
+        duplicates, canonicals = duplicate_ids if duplicate_ids is not None else self.duplicate_ids()
+        if not len(duplicates):
+            return faiss_ids
+        positions = np.minimum(np.searchsorted(duplicates, faiss_ids), len(duplicates) - 1)
+        return np.where(duplicates[positions] == faiss_ids, canonicals[positions], faiss_ids)
+
+    def duplicates_of(self, canonical_ids):
+        """
+        {canonical_id: [original_id of each question holding a near-duplicate of it]} for the given ids.
+        """
+        found = {}
+        if not self.has_duplicates:
+            return found
+        ids = [int(faiss_id) for faiss_id in canonical_ids]
+        with self._lock:
+            for start in range(0, len(ids), SQL_BATCH):
+                part = ids[start:start + SQL_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT d.canonical_id, c.original_id FROM chunk_duplicates d JOIN chunks c ON c.faiss_id = d.faiss_id "
+                    f"WHERE d.canonical_id IN ({','.join('?' * len(part))}) ORDER BY d.faiss_id",
+                    part
+                ).fetchall()
+                for canonical_id, original_id in rows:
+                    found.setdefault(canonical_id, []).append(original_id)
+        return found
+
+    def promote_duplicates(self, removed_ids):
+        """
+        Before removing chunks: every removed canonical that still has surviving duplicates hands its
+        role to the lowest surviving duplicate id, and the others are repointed to it. Returns
+        [(old canonical id, new canonical id)]; the caller must store the old vector under the new id.
+        """
+        removed = {int(faiss_id) for faiss_id in removed_ids}
+        promoted = []
+        with self._lock:
+            for canonical_id in removed:
+                survivors = [
+                    faiss_id for (faiss_id,) in self._conn.execute(
+                        "SELECT faiss_id FROM chunk_duplicates WHERE canonical_id = ? ORDER BY faiss_id", (canonical_id,)
+                    ) if faiss_id not in removed
+                ]
+                if not survivors:
+                    continue
+                self._conn.execute("DELETE FROM chunk_duplicates WHERE faiss_id = ?", (survivors[0],))
+                self._conn.execute(
+                    "UPDATE chunk_duplicates SET canonical_id = ? WHERE canonical_id = ?", (survivors[0], canonical_id)
+                )
+                promoted.append((canonical_id, survivors[0]))
+        return promoted
+
+    def put_questions(self, rows):
+        """
+        rows: iterable of (original_id, content_hash, num_chunks).
+        """
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO questions (original_id, content_hash, num_chunks) VALUES (?, ?, ?)", rows
+            )
+
+    def delete_questions(self, original_ids):
+        original_ids = list(original_ids)
+        with self._lock:
+            self._conn.executemany("DELETE FROM questions WHERE original_id = ?", ((original_id,) for original_id in original_ids))
+            self._conn.executemany("DELETE FROM question_attributes WHERE original_id = ?", ((original_id,) for original_id in original_ids))
+            self._conn.executemany("DELETE FROM question_passages WHERE original_id = ?", ((original_id,) for original_id in original_ids))
+            self._conn.executemany("DELETE FROM passages WHERE passage_id = ?", ((original_id,) for original_id in original_ids))
+
+    def put_passages(self, rows):
+        """
+        rows: iterable of (passage_id, problem_set_id, label, content).
+        """
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO passages (passage_id, problem_set_id, label, content) VALUES (?, ?, ?, ?)", rows
+            )
+
+    def put_question_passages(self, original_id, passage_ids):
+        """
+        Replaces the passages linked to one question, in reading order.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM question_passages WHERE original_id = ?", (original_id,))
+            self._conn.executemany(
+                "INSERT INTO question_passages (original_id, passage_id, position) VALUES (?, ?, ?)",
+                ((original_id, passage_id, position) for position, passage_id in enumerate(passage_ids))
+            )
+
+    def passages_for(self, original_ids):
+        """
+        {original_id: [{'passage_id', 'label', 'content'}]} in reading order, for the questions that have passages.
+        """
+        found = {}
+        if not self.has_passages:
+            return found
+        ids = list(original_ids)
+        with self._lock:
+            for start in range(0, len(ids), SQL_BATCH):
+                part = ids[start:start + SQL_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT q.original_id, p.passage_id, p.label, p.content FROM question_passages q "
+                    f"JOIN passages p ON p.passage_id = q.passage_id "
+                    f"WHERE q.original_id IN ({','.join('?' * len(part))}) ORDER BY q.original_id, q.position",
+                    part
+                ).fetchall()
+                for original_id, passage_id, label, content in rows:
+                    found.setdefault(original_id, []).append({'passage_id': passage_id, 'label': label, 'content': content})
+        return found
+
+    def passage_ids(self):
+        if not self.has_passages:
+            return set()
+        with self._lock:
+            return {passage_id for (passage_id,) in self._conn.execute("SELECT passage_id FROM passages")}
+
+    def questions_for_passages(self, passage_ids):
+        """
+        {passage_id: [original_id of every question about it]} for the given ids that are passages.
+        """
+        found = {}
+        if not self.has_passages:
+            return found
+        ids = list(passage_ids)
+        with self._lock:
+            for start in range(0, len(ids), SQL_BATCH):
+                part = ids[start:start + SQL_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT passage_id, original_id FROM question_passages WHERE passage_id IN ({','.join('?' * len(part))}) "
+                    f"ORDER BY passage_id, original_id",
+                    part
+                ).fetchall()
+                for passage_id, original_id in rows:
+                    found.setdefault(passage_id, []).append(original_id)
+        return found
+
+    def put_question_attributes(self, original_id, attributes):
+        """
+        Replaces the filter attributes ({attribute: value}) of one question.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM question_attributes WHERE original_id = ?", (original_id,))
+            self._conn.executemany(
+                "INSERT INTO question_attributes (original_id, attribute, value) VALUES (?, ?, ?)",
+                ((original_id, attribute, value) for attribute, value in attributes.items())
+            )
+
+    def iter_question_attributes(self):
+        """
+        Yields (original_id, num_chunks, {attribute: value}) for every question, in id order.
+        """
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT q.original_id, q.num_chunks, a.attribute, a.value
+                FROM questions q LEFT JOIN question_attributes a ON a.original_id = q.original_id
+                ORDER BY q.original_id
+            """).fetchall()
+        current_id, current_chunks, attributes = None, 0, {}
+        for original_id, num_chunks, attribute, value in rows:
+            if original_id != current_id:
+                if current_id is not None:
+                    yield current_id, current_chunks, attributes
+                current_id, current_chunks, attributes = original_id, num_chunks, {}
+            if attribute is not None:
+                attributes[attribute] = value
+        if current_id is not None:
+            yield current_id, current_chunks, attributes
+
+    def question_states(self):
+        """
+        {original_id: {'hash': content hash, 'chunks': chunk count}} for change detection.
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT original_id, content_hash, num_chunks FROM questions").fetchall()
+        return {original_id: {'hash': content_hash, 'chunks': num_chunks} for original_id, content_hash, num_chunks in rows}
+
+    def _indexed_chunks(self):
+        """
+        WHERE condition selecting the chunks that have a vector of their own (not near-duplicates).
+        """
+        return "faiss_id NOT IN (SELECT faiss_id FROM chunk_duplicates)" if self.has_duplicates else "1"
+
+    def iter_chunks(self, after_id=None):
+        """
+        Yields (faiss_id, chunk_text) for every chunk with a vector in the index (near-duplicates are
+        skipped), in id order; with after_id only the chunks with larger ids (resuming a scan).
+        """
+        with self._lock:
+            if after_id is None:
+                cursor = self._conn.execute(f"SELECT faiss_id, chunk_text FROM chunks WHERE {self._indexed_chunks()} ORDER BY faiss_id")
+            else:
+                cursor = self._conn.execute(
+                    f"SELECT faiss_id, chunk_text FROM chunks WHERE faiss_id > ? AND {self._indexed_chunks()} ORDER BY faiss_id",
+                    (int(after_id),)
+                )
+            rows = cursor.fetchmany(10000)
+        while rows:
+            yield from rows
+            with self._lock:
+                rows = cursor.fetchmany(10000)
+
+    def sample_chunk_texts(self, n):
+        """
+        Random chunk texts, used as realistic queries by rag_benchmark.py.
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT chunk_text FROM chunks ORDER BY RANDOM() LIMIT ?", (n,)).fetchall()
+        return [row[0] for row in rows]
+
+    def copy_to(self, path):
+        """
+        Writes a consistent snapshot of the store to path (SQLite online backup; the store may be
+        written to concurrently) and returns it opened read-write.
+        """
+        if os.path.exists(path):
+            os.remove(path)
+        copy = ChunkStore(path)
+        with self._lock:
+            self._conn.backup(copy._conn)
+        copy._create_tables() # The source may predate some tables
+        return copy
+
+    def count(self):
+        """
+        Number of chunks with a vector in the index (near-duplicates are not counted).
+        """
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM chunks WHERE {self._indexed_chunks()}").fetchone()[0]
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_chunk_store(path):
+    """
+    Opens a fresh, empty store at `path` + ".tmp" for bulk loading; call publish_chunk_store()
+    when done to move it into place atomically.
+    """
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    store = ChunkStore(tmp_path)
+    # Bulk load: durability comes from the final rename, not from the journal
+    store._conn.execute("PRAGMA journal_mode=OFF")
+    store._conn.execute("PRAGMA synchronous=OFF")
+    return store
+
+
+def publish_chunk_store(store, path):
+    store.commit()
+    store.close()
+    os.replace(store.path, path)
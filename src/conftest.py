@@ -0,0 +1,83 @@
+import hashlib
+import os
+import numpy as np
+import pytest
+
+TEST_DIM = 32
+
+
+class HashingModel:
+    """
+    Stand-in for the SentenceTransformer in tests: a normalized bag of hashed character bigrams, so
+    it is deterministic, needs no download, and texts sharing words land close together.
+    """
+
+    def __init__(self, dim=TEST_DIM):
+        self.dim = dim
+        self.encoded = 0
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, sentences, batch_size=None, **kwargs):
+        single = isinstance(sentences, str)
+        sentences = [sentences] if single else list(sentences)
+        vectors = np.zeros((len(sentences), self.dim), dtype='float32')
+        for row, sentence in enumerate(sentences):
+            for i in range(max(len(sentence) - 1, 1)):
+                digest = hashlib.blake2b(sentence[i:i + 2].encode('utf-8'), digest_size=4).digest()
+                vectors[row, int.from_bytes(digest, 'little') % self.dim] += 1.0
+        vectors /= np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+        self.encoded += len(sentences)
+        return vectors[0] if single else vectors
+
+
+@pytest.fixture(autouse=True)
+def isolated_embedding_env(monkeypatch):
+    # No shared on-disk cache, embedding server or ONNX backend leaking in from the environment
+    monkeypatch.setenv('EMBEDDING_CACHE_PATH', '')
+    monkeypatch.delenv('EMBEDDING_SERVER_SOCKET', raising=False)
+    monkeypatch.delenv('EMBEDDING_BACKEND', raising=False)
+
+
+@pytest.fixture
+def fake_model():
+    return HashingModel()
+
+
+def question_row(question_id, text, **attributes):
+    return dict(attributes, id=question_id, question_text=text)
+
+
+@pytest.fixture
+def build_index(tmp_path, fake_model):
+    """
+    Factory: embeds CSV-like rows with the fake model (data_processor.write_chunked_rows) and builds
+    an index from them; returns the index path. 'passage_stem' splits "passage\\n\\nstem" rows into
+    two chunks without needing langchain.
+    """
+    from data_processor import create_text_splitter, write_chunked_rows
+    from faiss_indexer import create_and_save_faiss_index
+
+    def build(rows, name="index", granularity='passage_stem', index_type='flat', dedup=False, **index_kwargs):
+        splitter = create_text_splitter(granularity)
+        store_dir = str(tmp_path / f"{name}-store")
+        chunked_rows = ((row['id'], row, splitter.split_text(row['question_text'])) for row in rows)
+        write_chunked_rows(fake_model, chunked_rows, store_dir, batch_size=64, dedup=dedup, granularity=granularity)
+        index_path = str(tmp_path / name / "faiss_index.bin")
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        create_and_save_faiss_index(store_dir, index_path, index_type, lexical=False, **index_kwargs)
+        return index_path
+
+    return build
+
+
+@pytest.fixture
+def resident_fake_model(monkeypatch, fake_model):
+    """
+    Makes fake_model the process-wide model for the configured model id, so retrievers over indexes
+    built by build_index embed their queries with it.
+    """
+    import embedding_model
+    monkeypatch.setattr(embedding_model, '_models', {embedding_model.embedding_model_id(): fake_model})
+    return fake_model
@@ -1,52 +1,331 @@
+import argparse
 import csv
-import json
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from sentence_transformers import SentenceTransformer
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from embedding_store import EmbeddingStore, EmbeddingStoreWriter, stored_chunk_indices
+from embedding_cache import encode_with_cache, get_default_cache, merge_cache_stats
+from embedding_model import get_model, model_id_of, uses_embedding_server
+from near_duplicates import DEFAULT_THRESHOLD, NearDuplicateDetector, format_dedup_report, merge_dedup_reports
+from problem_sets import PASSAGE_KIND, problem_set_rows
 
-def process_data_for_rag(csv_file_path, output_json_path):
+ENCODE_BATCH_SIZE = 256
+
+# Embedding granularity: 'chunk' splits text into ~200 character chunks (several vectors per question),
+# 'passage_stem' embeds the passage and the question stem separately, 'question' embeds each question whole
+GRANULARITIES = ('chunk', 'passage_stem', 'question')
+
+class WholeTextSplitter:
     """
-    Reads data from a CSV, chunks text, generates embeddings, and saves to a JSON file.
+    'question' granularity: the whole text is one chunk (the model truncates what it cannot fit).
     """
-    
-    # Load the sentence transformer model
-    model = SentenceTransformer('all-MiniLM-L6-v2')
 
-    # Initialize text splitter
-    text_splitter = RecursiveCharacterTextSplitter(
+    def split_text(self, text):
+        return [text.strip()] if text.strip() else []
+
+class PassageStemSplitter:
+    """
+    'passage_stem' granularity for CSV rows: the stem is the last paragraph, after the passage, so the
+    text is split at its last blank line into [passage, stem]. Text without one stays whole.
+    """
+
+    def split_text(self, text):
+        passage, _, stem = text.strip().rpartition("\n\n")
+        if passage.strip() and stem.strip():
+            return [passage.strip(), stem.strip()]
+        return WholeTextSplitter().split_text(text)
+
+def create_text_splitter(granularity='chunk'):
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity '{granularity}', expected one of {GRANULARITIES}")
+    if granularity == 'question':
+        return WholeTextSplitter()
+    if granularity == 'passage_stem':
+        return PassageStemSplitter()
+    from langchain.text_splitter import RecursiveCharacterTextSplitter # Slow import, only needed when chunking
+    return RecursiveCharacterTextSplitter(
         chunk_size=200,
         chunk_overlap=20,
         separators=["\n\n", "\n", " ", ""]
     )
 
-    processed_data = []
-
+def iter_chunked_rows(csv_file_path, text_splitter, shard_index=0, num_shards=1):
+    """
+    Lazily yields (question_id, row, chunks) for every CSV row.
+    With num_shards > 1 only rows whose position modulo num_shards equals shard_index are chunked.
+    """
     with open(csv_file_path, mode='r', encoding='utf-8') as csv_file:
         csv_reader = csv.DictReader(csv_file)
-        for row in csv_reader:
-            question_id = row['id']
-            question_text = row['question_text']
-            
-            # Chunk the question text
-            chunks = text_splitter.split_text(question_text)
-            
-            # Generate embeddings for each chunk
-            chunk_embeddings = model.encode(chunks).tolist() # Convert numpy array to list for JSON serialization
-
-            processed_data.append({
-                'id': question_id,
-                'original_question': row, # Store the entire original row
-                'chunks': chunks,
-                'chunk_embeddings': chunk_embeddings
-            })
-
-    with open(output_json_path, mode='w', encoding='utf-8') as json_file:
-        json.dump(processed_data, json_file, indent=4, ensure_ascii=False)
+        for position, row in enumerate(csv_reader):
+            if position % num_shards != shard_index:
+                continue
+            yield row['id'], row, text_splitter.split_text(row['question_text'])
+
+def iter_row_batches(chunked_rows, batch_size):
+    """
+    Groups consecutive rows until they hold at least `batch_size` chunks.
+    A row is never split, so a batch overshoots by at most one row's chunks.
+    """
+    pending = []
+    pending_chunks = 0
+    for item in chunked_rows:
+        pending.append(item)
+        pending_chunks += len(item[2])
+        if pending_chunks >= batch_size:
+            yield pending
+            pending = []
+            pending_chunks = 0
+    if pending:
+        yield pending
+
+def encode_row_batch(model, row_batch, batch_size, cache=None, model_id=None, detector=None):
+    """
+    Encodes the chunks of all rows in one call and yields (question_id, row, chunks, embeddings, duplicates) per row.
+    Chunks already in the embedding cache (under model_id, default the id the model encodes with) are not re-encoded.
+
+    With a NearDuplicateDetector, chunks that near-duplicate an earlier chunk are not encoded at all:
+    duplicates maps their positions to the canonical (question_id, chunk position) and embeddings
+    only holds the row's other chunks.
+    """
+    row_duplicates = []
+    flat_chunks = []
+    for question_id, _, chunks in row_batch:
+        duplicates = {}
+        for position, chunk in enumerate(chunks):
+            canonical = detector.add((question_id, position), chunk) if detector is not None else None
+            if canonical is None:
+                flat_chunks.append(chunk)
+            else:
+                duplicates[position] = canonical
+        row_duplicates.append(duplicates)
+    model_id = model_id or model_id_of(model)
+    embeddings = encode_with_cache(model, flat_chunks, model_id, cache, batch_size=batch_size) if flat_chunks else None
+    offset = 0
+    for (question_id, row, chunks), duplicates in zip(row_batch, row_duplicates):
+        num_rows = len(chunks) - len(duplicates)
+        yield question_id, row, chunks, embeddings[offset:offset + num_rows] if num_rows else [], duplicates
+        offset += num_rows
+
+def write_chunked_rows(model, chunked_rows, output_store_dir, batch_size, cache=None, dedup=False, dedup_threshold=DEFAULT_THRESHOLD,
+                       granularity='chunk'):
+    """
+    Embeds (question_id, row, chunks) items and writes them to an embedding store. Returns row/chunk
+    counts and the seconds taken, plus the embedding cache statistics when a cache is used and the
+    near-duplicate report (near_duplicates.py) under 'dedup' when dedup is on.
+    """
+    stats = {'rows': 0, 'chunks': 0, 'embedded_chunks': 0}
+    detector = NearDuplicateDetector(dedup_threshold) if dedup else None
+    started = time.perf_counter()
+    with EmbeddingStoreWriter(output_store_dir, model_name=model_id_of(model), granularity=granularity) as writer:
+        for row_batch in iter_row_batches(chunked_rows, batch_size):
+            for question_id, row, chunks, chunk_embeddings, duplicates in encode_row_batch(model, row_batch, batch_size, cache, detector=detector):
+                writer.append(question_id, row, chunks, chunk_embeddings, duplicates) # Store the entire original row
+                stats['rows'] += 1
+                stats['chunks'] += len(chunks)
+                stats['embedded_chunks'] += len(chunks) - len(duplicates)
+        dim = writer.dim
+    stats['seconds'] = time.perf_counter() - started
+    if detector is not None:
+        embed_seconds = stats['seconds'] - detector.seconds
+        seconds_per_chunk = embed_seconds / stats['embedded_chunks'] if stats['embedded_chunks'] else 0.0
+        stats['dedup'] = detector.report(seconds_per_chunk, dim * 4 if dim else 0)
+    if cache is not None:
+        stats['cache'] = cache.stats()
+    return stats
+
+def embed_rows_to_store(model, csv_file_path, output_store_dir, batch_size, shard_index=0, num_shards=1, cache=None,
+                        dedup=False, dedup_threshold=DEFAULT_THRESHOLD, granularity='chunk'):
+    """
+    Chunks, embeds and writes one shard of the CSV (all of it by default), see write_chunked_rows().
+    """
+    chunked_rows = iter_chunked_rows(csv_file_path, create_text_splitter(granularity), shard_index, num_shards)
+    return write_chunked_rows(model, chunked_rows, output_store_dir, batch_size, cache, dedup, dedup_threshold, granularity)
+
+def _embed_shard_worker(csv_file_path, shard_store_dir, batch_size, shard_index, num_shards, torch_threads, dedup, dedup_threshold,
+                        granularity):
+    """
+    Process pool entry point: loads a private model (or connects to the shared embedding server)
+    and embeds one shard of the CSV.
+    """
+    if not uses_embedding_server():
+        import torch
+        torch.set_num_threads(torch_threads) # Avoid every worker spawning one thread per core
+
+    started = time.perf_counter()
+    model = get_model()
+    load_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    cache = get_default_cache()
+    try:
+        stats = embed_rows_to_store(model, csv_file_path, shard_store_dir, batch_size, shard_index, num_shards, cache,
+                                    dedup, dedup_threshold, granularity)
+    finally:
+        if cache is not None:
+            cache.close()
+    stats.update({
+        'worker': shard_index,
+        'model_load_seconds': load_seconds,
+        'seconds': time.perf_counter() - started
+    })
+    return stats
+
+def merge_shard_stores(shard_store_dirs, output_store_dir):
+    """
+    Interleaves round-robin shards back into CSV order, so the merged store is identical
+    to a single-process run.
+    """
+    shards = [EmbeddingStore(shard_dir) for shard_dir in shard_store_dirs]
+    record_iters = [shard.iter_records() for shard in shards]
+    with EmbeddingStoreWriter(output_store_dir, model_name=shards[0].model_name, granularity=shards[0].granularity) as writer:
+        position = 0
+        while True:
+            shard_index = position % len(shards)
+            record = next(record_iters[shard_index], None)
+            if record is None:
+                break # Shard sizes differ by at most one, so the first exhausted shard ends the merge
+            offset = record['offset']
+            chunk_embeddings = shards[shard_index].embeddings[offset:offset + len(stored_chunk_indices(record))]
+            writer.append(record['id'], record['original_question'], record['chunks'], chunk_embeddings, record.get('duplicates'))
+            position += 1
+
+def process_data_for_rag(csv_file_path, output_store_dir, batch_size=ENCODE_BATCH_SIZE, num_workers=1,
+                         dedup=False, dedup_threshold=DEFAULT_THRESHOLD, granularity='chunk'):
+    """
+    Reads data from a CSV, chunks text, generates embeddings, and saves them to a binary embedding store
+    (a float32 matrix that can be memory-mapped plus a JSON Lines metadata sidecar, see embedding_store.py).
+
+    The CSV is streamed: chunks from consecutive rows are pooled into encode batches of about
+    `batch_size` and written out as soon as they are embedded, so peak memory is bounded by one
+    batch regardless of the CSV size.
+
+    With num_workers > 1 the rows are sharded round-robin over a process pool, each worker running
+    its own model, and the shard stores are merged back in CSV order. Per-worker throughput is
+    printed and returned under 'workers'.
+
+    Every chunk is looked up in the shared embedding cache (embedding_cache.py) first, so re-running
+    over a mostly unchanged CSV only encodes the new or edited text.
+
+    With dedup=True (off by default) near-identical chunks, e.g. the same passage or boilerplate
+    repeated across questions, are grouped by MinHash-LSH before embedding (near_duplicates.py):
+    only the first chunk of a group is embedded and stored, the others keep a back-reference to it,
+    and the dedup ratio plus estimated time/memory saved are returned under 'dedup'. The index then
+    holds one vector per group, so a duplicate's own id is not searchable (results name it under
+    'duplicate_ids'). With num_workers > 1 each worker dedups its own shard, so duplicates split
+    across workers are both kept.
+
+    granularity (see GRANULARITIES) trades index size against accuracy: 'chunk' keeps several small
+    vectors per question, 'passage_stem' two, 'question' one. It is recorded in the store manifest
+    and the index params, and RAGRetriever returns distinct questions whatever the granularity.
+    """
+    if num_workers <= 1:
+        model = get_model()
+        cache = get_default_cache()
+        try:
+            return embed_rows_to_store(model, csv_file_path, output_store_dir, batch_size, cache=cache,
+                                       dedup=dedup, dedup_threshold=dedup_threshold, granularity=granularity)
+        finally:
+            if cache is not None:
+                cache.close()
+
+    shard_root = output_store_dir.rstrip(os.sep) + ".shards"
+    shard_store_dirs = [os.path.join(shard_root, f"shard-{i}") for i in range(num_workers)]
+    torch_threads = max(1, (os.cpu_count() or 1) // num_workers)
+
+    started = time.perf_counter()
+    # spawn, not fork: torch does not survive being forked after initialisation
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=get_context('spawn')) as executor:
+        futures = [
+            executor.submit(_embed_shard_worker, csv_file_path, shard_store_dirs[i], batch_size, i, num_workers, torch_threads,
+                            dedup, dedup_threshold, granularity)
+            for i in range(num_workers)
+        ]
+        worker_stats = [future.result() for future in futures]
+    embed_seconds = time.perf_counter() - started
+
+    for ws in worker_stats:
+        rate = ws['chunks'] / ws['seconds'] if ws['seconds'] else 0.0
+        print(f"[worker {ws['worker']}] {ws['rows']} rows, {ws['chunks']} chunks in {ws['seconds']:.1f}s "
+              f"({rate:.1f} chunks/s, model load {ws['model_load_seconds']:.1f}s)")
+
+    merge_shard_stores(shard_store_dirs, output_store_dir)
+    shutil.rmtree(shard_root)
+
+    stats = {
+        'rows': sum(ws['rows'] for ws in worker_stats),
+        'chunks': sum(ws['chunks'] for ws in worker_stats),
+        'embedded_chunks': sum(ws['embedded_chunks'] for ws in worker_stats),
+        'seconds': embed_seconds,
+        'workers': worker_stats
+    }
+    if dedup:
+        stats['dedup'] = merge_dedup_reports(ws['dedup'] for ws in worker_stats)
+    if all('cache' in ws for ws in worker_stats):
+        # Same keys as a single-process run; the workers shared one cache file
+        cache = get_default_cache()
+        try:
+            stats['cache'] = merge_cache_stats((ws['cache'] for ws in worker_stats), cache)
+        finally:
+            if cache is not None:
+                cache.close()
+    return stats
+
+def process_problem_sets_for_rag(problem_sets, output_store_dir, source, attributes=None, batch_size=ENCODE_BATCH_SIZE,
+                                 dedup=False, dedup_threshold=DEFAULT_THRESHOLD, granularity='chunk'):
+    """
+    Structured counterpart of process_data_for_rag for the problem sets parsed by
+    scripts/text_parser.py: every passage and every question stem becomes its own record (see
+    problem_sets.py), so a passage shared by several questions is embedded once instead of once per
+    question. Questions keep the ids of their passages, which faiss_indexer.py turns into links in
+    the chunk store; retrieval then returns a question together with its passages.
+
+    With granularity 'chunk' passages and stems are split into chunks, with 'passage_stem' each is
+    one vector, and with 'question' every question is embedded as one text (its passages, stem and
+    options) while the passage records keep no vector, only the text returned with the questions.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity '{granularity}', expected one of {GRANULARITIES}")
+    rows = list(problem_set_rows(problem_sets, source, attributes))
+    passage_texts = {row['id']: row['question_text'] for row in rows if row['kind'] == PASSAGE_KIND}
+    text_splitter = create_text_splitter('chunk' if granularity == 'chunk' else 'question')
+
+    def row_chunks(row):
+        if granularity != 'question':
+            return text_splitter.split_text(row['question_text'])
+        if row['kind'] == PASSAGE_KIND:
+            return []
+        return text_splitter.split_text("\n\n".join([passage_texts[passage_id] for passage_id in row['passage_ids']] + [row['question_text']]))
+
+    chunked_rows = ((row['id'], row, row_chunks(row)) for row in rows)
+    cache = get_default_cache()
+    try:
+        stats = write_chunked_rows(get_model(), chunked_rows, output_store_dir, batch_size, cache, dedup, dedup_threshold,
+                                   granularity)
+    finally:
+        if cache is not None:
+            cache.close()
+    stats['passages'] = len(passage_texts)
+    stats['questions'] = len(rows) - stats['passages']
+    return stats
 
 if __name__ == "__main__":
-    # Define paths relative to the project root
-    csv_input_path = "/mnt/d/progress/munjero_rag_system/munjero_rag_system/data/data.csv"
-    json_output_path = "/mnt/d/progress/munjero_rag_system/munjero_rag_system/data/processed_data.json"
-    
-    print(f"Processing data from {csv_input_path} and saving to {json_output_path}...")
-    process_data_for_rag(csv_input_path, json_output_path)
-    print("Data processing complete.")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Chunk and embed the question CSV into an embedding store for faiss_indexer.py.")
+    parser.add_argument("--csv", default="/mnt/d/progress/munjero_rag_system/munjero_rag_system/data/data.csv")
+    parser.add_argument("--output", default="/mnt/d/progress/munjero_rag_system/munjero_rag_system/data/processed_data")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Embedding processes, each loading its own model (default: 1, no process pool)")
+    parser.add_argument("--dedup", action="store_true",
+                        help="Embed and index only the first of each group of near-identical chunks (see near_duplicates.py)")
+    parser.add_argument("--dedup-threshold", type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args()
+
+    print(f"Processing data from {args.csv} and saving to {args.output}...")
+    stats = process_data_for_rag(args.csv, args.output, num_workers=args.workers, dedup=args.dedup,
+                                 dedup_threshold=args.dedup_threshold)
+    print(f"Data processing complete: {stats['rows']} rows, {stats['chunks']} chunks.")
+    if 'dedup' in stats:
+        print(format_dedup_report(stats['dedup']))
+    if 'cache' in stats:
+        print(f"Embedding cache: {stats['cache']['hits']} hits, {stats['cache']['misses']} misses.")
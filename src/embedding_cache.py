@@ -0,0 +1,203 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import numpy as np
+
+# Resolved against the repository, not the working directory, so every process shares one file
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CACHE_PATH = os.path.join(REPO_ROOT, "data", "embedding_cache.sqlite")
+DEFAULT_MAX_ENTRIES = 2_000_000
+# A hit refreshes an entry's last-used stamp only when it is older than this; LRU eviction does
+# not need finer stamps, and most lookups then stay read-only
+DEFAULT_TOUCH_INTERVAL = 3600.0
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_text(text):
+    """
+    Canonical form used for cache keys: NFC, trimmed, runs of whitespace collapsed.
+    """
+    return _WHITESPACE_RE.sub(' ', unicodedata.normalize('NFC', text)).strip()
+
+
+def text_key(text):
+    return hashlib.blake2b(normalize_text(text).encode('utf-8'), digest_size=16).digest()
+
+
+class EmbeddingCache:
+    """
+    On-disk embedding cache keyed by (model name, normalized text hash).
+
+    Backed by SQLite in WAL mode so several processes (ingestion workers, the PDF app,
+    retrievers) can share one file. Entries carry a last-used timestamp and the least
+    recently used ones are evicted once the cache grows past `max_entries`. Stamps are refreshed
+    at most every `touch_interval` seconds, so lookups of recently used entries write nothing.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES, touch_interval=DEFAULT_TOUCH_INTERVAL):
+        self.path = path
+        self.max_entries = max_entries
+        self.touch_interval = touch_interval
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash BLOB NOT NULL,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            ) WITHOUT ROWID
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, model_name, keys):
+        """
+        Returns {key: float32 vector} for the keys that are cached, and counts every key (repeats
+        included) as a hit or a miss.
+        """
+        found = {}
+        unique_keys = list(set(keys))
+        now = time.time()
+        stale = []
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(unique_keys), 500):
+                part = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, dim, vector, last_used FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model_name] + part
+                ).fetchall()
+                for text_hash, dim, vector, last_used in rows:
+                    found[bytes(text_hash)] = np.frombuffer(vector, dtype='float32', count=dim)
+                    if now - last_used >= self.touch_interval:
+                        stale.append(bytes(text_hash))
+            if stale:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model_name, key) for key in stale]
+                )
+                self._conn.commit()
+            hits = sum(1 for key in keys if key in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return found
+
+    def put_many(self, model_name, keys, vectors):
+        vectors = np.asarray(vectors, dtype='float32')
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, text_hash, dim, vector, last_used) VALUES (?, ?, ?, ?, ?)",
+                [(model_name, key, vector.shape[0], vector.tobytes(), now) for key, vector in zip(keys, vectors)]
+            )
+            self._entries += max(cursor.rowcount, 0)
+            if self._entries > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # Other processes write to the same file, so recount before trimming.
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = self._entries - int(self.max_entries * 0.9) # Trim to 90% so eviction is not run on every insert
+        if excess <= 0 or self._entries <= self.max_entries:
+            return
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE (model, text_hash) IN "
+            "(SELECT model, text_hash FROM embeddings ORDER BY last_used LIMIT ?)",
+            (excess,)
+        )
+        self._entries -= excess
+        self.evictions += excess
+
+    def stats(self):
+        with self._lock:
+            hits, misses, entries, evictions = self.hits, self.misses, self._entries, self.evictions
+        lookups = hits + misses
+        return {
+            'path': self.path,
+            'entries': entries,
+            'max_entries': self.max_entries,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / lookups if lookups else 0.0,
+            'evictions': evictions
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def merge_cache_stats(reports, cache=None):
+    """
+    Combines the stats() of several processes that each opened the same cache file, e.g. the
+    ingestion workers: hits, misses and evictions add up; 'entries' is read from `cache` (an
+    EmbeddingCache on that file opened afterwards) since each worker only counted its own inserts.
+    """
+    reports = list(reports)
+    merged = dict(reports[0])
+    for name in ('hits', 'misses', 'evictions'):
+        merged[name] = sum(report[name] for report in reports)
+    lookups = merged['hits'] + merged['misses']
+    merged['hit_rate'] = merged['hits'] / lookups if lookups else 0.0
+    merged['entries'] = cache.stats()['entries'] if cache is not None else max(report['entries'] for report in reports)
+    return merged
+
+
+def encode_with_cache(model, texts, model_name, cache=None, **encode_kwargs):
+    """
+    Drop-in replacement for `model.encode(texts)` that consults `cache` first.
+    Only texts that are not cached (deduplicated) are sent to the model.
+    Always returns a float32 array of shape (len(texts), dim).
+    """
+    if cache is None:
+        return np.asarray(model.encode(texts, **encode_kwargs), dtype='float32')
+    if not texts:
+        return np.zeros((0, 0), dtype='float32')
+
+    keys = [text_key(text) for text in texts]
+    found = cache.get_many(model_name, keys)
+
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in found:
+            missing.setdefault(key, text)
+
+    if missing:
+        missing_keys = list(missing)
+        new_vectors = np.asarray(model.encode([missing[key] for key in missing_keys], **encode_kwargs), dtype='float32')
+        cache.put_many(model_name, missing_keys, new_vectors)
+        found.update(zip(missing_keys, new_vectors))
+
+    return np.stack([found[key] for key in keys])
+
+
+def get_default_cache():
+    """
+    Opens the cache configured through EMBEDDING_CACHE_PATH (default: data/embedding_cache.sqlite in
+    the repository; set it to an empty string to disable caching). Callers close what they open.
+    """
+    path = os.environ.get('EMBEDDING_CACHE_PATH', DEFAULT_CACHE_PATH)
+    if not path:
+        return None
+    max_entries = int(os.environ.get('EMBEDDING_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES))
+    return EmbeddingCache(path, max_entries=max_entries)
@@ -0,0 +1,153 @@
+import os
+import threading
+import time
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
+EMBEDDING_BACKENDS = ('torch', 'onnx')
+
+_models = {}
+_load_seconds = {}
+_lock = threading.Lock()
+
+def get_model(model_name=MODEL_NAME):
+    """
+    Returns the embedding model for model_name, created on first use.
+
+    With EMBEDDING_SERVER_SOCKET set this is an EmbeddingClient for the shared embedding server
+    (embedding_server.py), so the process never loads the transformer itself; otherwise it is the
+    local SentenceTransformer from get_local_model(). Both expose the same encode().
+    """
+    if not uses_embedding_server():
+        return get_local_model(model_name)
+    return _server_client(embedding_model_id(model_name))
+
+def _server_client(model_id):
+    """
+    The EmbeddingClient asking the shared embedding server for exactly the model_id variant
+    (model and backend), so the server cannot answer with vectors of its own configured backend.
+    """
+    socket_path = os.environ['EMBEDDING_SERVER_SOCKET']
+    key = ('server', socket_path, model_id)
+    client = _models.get(key)
+    if client is None:
+        from embedding_server import EmbeddingClient
+        with _lock:
+            client = _models.setdefault(key, EmbeddingClient(socket_path, model_id))
+    return client
+
+def embedding_backend():
+    """
+    'torch' (SentenceTransformer, the default) or 'onnx' (onnxruntime, int8 or fp32 see onnx_quantized(), onnx_embedder.py),
+    from EMBEDDING_BACKEND.
+    """
+    backend = os.environ.get('EMBEDDING_BACKEND', 'torch')
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown EMBEDDING_BACKEND '{backend}', expected one of {EMBEDDING_BACKENDS}")
+    return backend
+
+def onnx_quantized():
+    """
+    Whether the ONNX backend runs the int8 export (the default) or the fp32 one, from ONNX_QUANTIZED.
+    """
+    return os.environ.get('ONNX_QUANTIZED', '1') == '1'
+
+def embedding_model_id(model_name=MODEL_NAME, backend=None, quantized=None):
+    """
+    Name the vectors are cached under, and recorded in embedding stores and index params. Every
+    ONNX variant gets its own namespace ('+onnx-int8', '+onnx-fp32'): their vectors are close to,
+    but not identical with, the PyTorch ones and with each other.
+    """
+    backend = backend or embedding_backend()
+    if backend == 'torch':
+        return model_name
+    quantized = onnx_quantized() if quantized is None else quantized
+    return f"{model_name}+{backend}-{'int8' if quantized else 'fp32'}"
+
+def parse_model_id(model_id):
+    """
+    (model_name, backend, quantized) of an embedding_model_id(); quantized is None for 'torch'.
+    Ids recorded before the ONNX variants were split ('+onnx') were the default int8 export.
+    """
+    model_name, _, variant = model_id.rpartition('+')
+    backend, _, precision = variant.partition('-')
+    if model_name and backend in EMBEDDING_BACKENDS and backend != 'torch' and precision in ('', 'int8', 'fp32'):
+        return model_name, backend, precision != 'fp32'
+    return model_id, 'torch', None
+
+def get_model_for_id(model_id):
+    """
+    The model that produced vectors recorded under model_id, e.g. the 'model_name' in an index's
+    params, so queries are always embedded with the same model as the index they search.
+    """
+    if uses_embedding_server():
+        return _server_client(model_id)
+    return get_local_model(*parse_model_id(model_id))
+
+def model_id_of(model, model_name=MODEL_NAME):
+    """
+    The model id to record vectors from `model` under. An EmbeddingClient reports the id the server
+    says it encoded with; a local model is the configured one.
+    """
+    served_model_id = getattr(model, 'served_model_id', None)
+    return served_model_id() if served_model_id is not None else embedding_model_id(model_name)
+
+def get_local_model(model_name=MODEL_NAME, backend=None, quantized=None):
+    """
+    Returns the process-wide in-process model for model_name, the backend and, for 'onnx', the
+    int8 or fp32 export (defaults: the configured ones), loading it on first use.
+
+    Importing this module is cheap: sentence_transformers / onnxruntime (and torch behind them) are
+    only imported here, so processes that never embed anything - and web apps before their first
+    request - do not pay for them. Concurrent first calls load the model once; the others wait for it.
+    """
+    key = embedding_model_id(model_name, backend, quantized)
+    model = _models.get(key)
+    if model is not None:
+        return model
+    with _lock:
+        model = _models.get(key)
+        if model is None:
+            started = time.perf_counter()
+            _, backend, quantized = parse_model_id(key)
+            if backend == 'onnx':
+                from onnx_embedder import load_onnx_embedder
+                model = load_onnx_embedder(model_name, quantized)
+            else:
+                from sentence_transformers import SentenceTransformer
+                model = SentenceTransformer(model_name)
+            _load_seconds[key] = time.perf_counter() - started
+            _models[key] = model
+    return model
+
+def uses_embedding_server():
+    return bool(os.environ.get('EMBEDDING_SERVER_SOCKET'))
+
+def is_model_loaded(model_name=MODEL_NAME):
+    """
+    True once encodes no longer pay a model load: always when the shared embedding server is used.
+    """
+    return uses_embedding_server() or embedding_model_id(model_name) in _models
+
+def model_load_seconds(model_name=MODEL_NAME):
+    """
+    Seconds the model took to import and load, or None if it has not been loaded in this process.
+    """
+    return _load_seconds.get(embedding_model_id(model_name))
+
+def warm_up(model_name=MODEL_NAME):
+    """
+    Loads the model and runs one encode, so the first real request does not pay for lazy
+    initialization inside torch either. Returns the seconds spent.
+    """
+    started = time.perf_counter()
+    get_model(model_name).encode(["warm up"])
+    return time.perf_counter() - started
+
+def warm_up_in_background(model_name=MODEL_NAME):
+    """
+    Starts warm_up() on a daemon thread and returns the thread; the caller can start serving
+    right away (requests that need the model before it is ready simply wait in get_model()).
+    """
+    thread = threading.Thread(target=warm_up, args=(model_name,), name="model-warm-up", daemon=True)
+    thread.start()
+    return thread
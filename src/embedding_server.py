@@ -0,0 +1,251 @@
+import argparse
+import os
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import numpy as np
+from micro_batcher import MicroBatcher
+
+# Wire format (little-endian), one request/response pair at a time per connection:
+#   request:  u16 model-id length, model id (utf-8, see embedding_model.embedding_model_id), u32 text count,
+#             then per text u32 length + utf-8 bytes
+#   response: u8 status, u16 model-id length, u32 rows, u32 dim, the model id the vectors were encoded
+#             with (utf-8), then rows * dim float32 values (C order)
+#             status 1 is an error: rows is the length of the utf-8 message that follows, dim is 0
+# Vectors travel as raw float32, so there is no JSON encoding on either side.
+STATUS_OK = 0
+STATUS_ERROR = 1
+_RESPONSE_HEADER = struct.Struct('<BHII')
+
+DEFAULT_SOCKET_PATH = "/tmp/munjero_embedding.sock"
+SERVER_MAX_BATCH_SIZE = 256
+SERVER_MAX_WAIT_MS = 5.0
+
+def _recv_exact(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:], size - received)
+        if n == 0:
+            raise ConnectionError("Embedding server connection closed")
+        received += n
+    return bytes(buffer)
+
+def encode_request(model_id, texts):
+    name = model_id.encode('utf-8')
+    parts = [struct.pack('<H', len(name)), name, struct.pack('<I', len(texts))]
+    for text in texts:
+        data = text.encode('utf-8')
+        parts.append(struct.pack('<I', len(data)))
+        parts.append(data)
+    return b''.join(parts)
+
+def read_request(sock):
+    (name_length,) = struct.unpack('<H', _recv_exact(sock, 2))
+    model_id = _recv_exact(sock, name_length).decode('utf-8')
+    (count,) = struct.unpack('<I', _recv_exact(sock, 4))
+    texts = []
+    for _ in range(count):
+        (length,) = struct.unpack('<I', _recv_exact(sock, 4))
+        texts.append(_recv_exact(sock, length).decode('utf-8'))
+    return model_id, texts
+
+def encode_response(model_id, vectors):
+    served = model_id.encode('utf-8')
+    vectors = np.ascontiguousarray(vectors, dtype='<f4')
+    return _RESPONSE_HEADER.pack(STATUS_OK, len(served), vectors.shape[0], vectors.shape[1]) + served + vectors.tobytes()
+
+def encode_error(message):
+    message = message.encode('utf-8')
+    return _RESPONSE_HEADER.pack(STATUS_ERROR, 0, len(message), 0) + message
+
+def read_response(sock):
+    """
+    (model_id, vectors) of an OK response; an error response raises RuntimeError with the server's message.
+    """
+    status, id_length, rows, dim = _RESPONSE_HEADER.unpack(_recv_exact(sock, _RESPONSE_HEADER.size))
+    if status != STATUS_OK:
+        raise RuntimeError(_recv_exact(sock, rows).decode('utf-8'))
+    model_id = _recv_exact(sock, id_length).decode('utf-8')
+    return model_id, np.frombuffer(_recv_exact(sock, rows * dim * 4), dtype='<f4').reshape(rows, dim)
+
+class EmbeddingServer:
+    """
+    One resident model shared by every local process that embeds text (the PDF app, retrievers,
+    CSV ingestion), instead of one model copy per process.
+
+    Texts from all connected clients go through one MicroBatcher per model, so concurrent small
+    requests are encoded together and large requests are cut into max_batch_size encode calls.
+
+    Requests name a model id (model name and backend, see embedding_model.embedding_model_id) and
+    are encoded with exactly that variant; every response echoes the id it was encoded with, which
+    is what clients record. model_id is loaded up front; a request for another id loads that one on
+    first use, so indexes embedded with different models or backends (e.g. during a
+    reembed_migration.py cutover) can be served side by side. An id that cannot be loaded is refused.
+    """
+
+    def __init__(self, model_id, socket_path=DEFAULT_SOCKET_PATH, max_batch_size=SERVER_MAX_BATCH_SIZE,
+                 max_wait_ms=SERVER_MAX_WAIT_MS):
+        self.model_id = model_id
+        self.socket_path = socket_path
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._models = {}
+        self._lock = threading.Lock()
+        self.model, self.dim, self.batcher = self._served_model(model_id)
+        self._server = None
+
+    def _served_model(self, model_id):
+        """
+        (model, dim, batcher) for model_id, loading that model and backend on first use.
+        """
+        served = self._models.get(model_id)
+        if served is None:
+            from embedding_model import get_local_model, parse_model_id
+            with self._lock:
+                served = self._models.get(model_id)
+                if served is None:
+                    model = get_local_model(*parse_model_id(model_id))
+                    batcher = MicroBatcher(lambda texts: self._encode_batch(model, texts), self.max_batch_size,
+                                           self.max_wait_ms, name=f"embedding-batcher-{model_id}")
+                    served = (model, model.get_sentence_embedding_dimension(), batcher)
+                    self._models[model_id] = served
+        return served
+
+    def _encode_batch(self, model, texts):
+        return np.asarray(model.encode(texts, batch_size=len(texts)), dtype='float32')
+
+    def encode(self, texts, model_id=None):
+        _, dim, batcher = self._served_model(model_id or self.model_id)
+        futures = [batcher.submit(text) for text in texts]
+        if not futures:
+            return np.zeros((0, dim), dtype='float32')
+        return np.vstack([future.result() for future in futures])
+
+    def _handle_connection(self, sock):
+        while True:
+            try:
+                model_id, texts = read_request(sock)
+            except ConnectionError:
+                return # Client closed the connection between requests
+            try:
+                vectors = self.encode(texts, model_id)
+            except Exception as e:
+                sock.sendall(encode_error(f"Cannot encode with '{model_id}': {e}"))
+                continue
+            sock.sendall(encode_response(model_id, vectors))
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path) # Stale socket from a previous run
+        server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                server._handle_connection(self.request)
+
+        self._server = socketserver.ThreadingUnixStreamServer(self.socket_path, Handler)
+        self._server.daemon_threads = True
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+        for _, _, batcher in self._models.values():
+            batcher.close()
+
+class EmbeddingClient:
+    """
+    Drop-in for SentenceTransformer.encode() backed by an EmbeddingServer. Returned by
+    embedding_model.get_model() when EMBEDDING_SERVER_SOCKET is set.
+
+    Each thread keeps its own persistent connection; a broken connection is reopened once per call.
+    The server encodes with exactly model_id and echoes it; a response for any other id is rejected,
+    and served_model_id() is the echoed id callers record vectors under.
+    """
+
+    def __init__(self, socket_path, model_id, timeout=300.0):
+        self.socket_path = socket_path
+        self.model_id = model_id
+        self.timeout = timeout
+        self._local = threading.local()
+        self._dim = None
+        self._served_model_id = None
+
+    def _connection(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.socket_path)
+            except OSError as e:
+                sock.close()
+                raise ConnectionError(f"Cannot reach the embedding server at {self.socket_path}: {e}") from e
+            self._local.sock = sock
+        return sock
+
+    def _close_connection(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+    def _request(self, texts):
+        request = encode_request(self.model_id, texts)
+        for attempt in range(2):
+            sock = self._connection()
+            try:
+                sock.sendall(request)
+                served_model_id, vectors = read_response(sock)
+            except (ConnectionError, BrokenPipeError, socket.timeout):
+                self._close_connection()
+                if attempt:
+                    raise
+                continue
+            if served_model_id != self.model_id:
+                raise RuntimeError(f"Embedding server encoded with '{served_model_id}' instead of the requested '{self.model_id}'")
+            self._served_model_id = served_model_id
+            self._dim = vectors.shape[1]
+            return vectors
+
+    def encode(self, sentences, batch_size=None, show_progress_bar=None, convert_to_numpy=True, **kwargs):
+        """
+        Same call shape as SentenceTransformer.encode(); batching is decided by the server, so
+        batch_size and the other tuning arguments are accepted and ignored.
+        """
+        single = isinstance(sentences, str)
+        vectors = self._request([sentences] if single else list(sentences))
+        return vectors[0] if single else vectors
+
+    def get_sentence_embedding_dimension(self):
+        if self._dim is None:
+            self._request([])
+        return self._dim
+
+    def served_model_id(self):
+        if self._served_model_id is None:
+            self._request([])
+        return self._served_model_id
+
+if __name__ == "__main__":
+    from embedding_model import MODEL_NAME, embedding_model_id
+    parser = argparse.ArgumentParser(description="Shared embedding server for local processes (Unix socket).")
+    parser.add_argument("--socket", default=os.environ.get('EMBEDDING_SERVER_SOCKET') or DEFAULT_SOCKET_PATH)
+    parser.add_argument("--model", default=MODEL_NAME, help="Model loaded up front, with the configured EMBEDDING_BACKEND")
+    parser.add_argument("--max-batch-size", type=int, default=SERVER_MAX_BATCH_SIZE)
+    parser.add_argument("--max-wait-ms", type=float, default=SERVER_MAX_WAIT_MS)
+    args = parser.parse_args()
+
+    embedding_server = EmbeddingServer(embedding_model_id(args.model), args.socket, args.max_batch_size, args.max_wait_ms)
+    embedding_server.encode(["warm up"]) # Load lazily-initialized kernels before the socket appears
+    print(f"EmbeddingServer: serving '{embedding_server.model_id}' (dim {embedding_server.dim}) on {args.socket}", flush=True, file=sys.stderr)
+    embedding_server.serve_forever()
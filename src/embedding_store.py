@@ -0,0 +1,162 @@
+import json
+import os
+import numpy as np
+
+MANIFEST_FILE = "manifest.json"
+EMBEDDINGS_FILE = "embeddings.f32"
+RECORDS_FILE = "records.jsonl"
+
+STORE_FORMAT = "munjero-embeddings"
+STORE_VERSION = 1
+
+
+def stored_chunk_indices(record):
+    """
+    Positions of the record's chunks that have an embedding row (all but its near-duplicates),
+    in row order starting at record['offset'].
+    """
+    duplicates = record.get('duplicates') or {}
+    return [position for position in range(len(record['chunks'])) if str(position) not in duplicates]
+
+
+def record_duplicates(record):
+    """
+    (chunk position, canonical question id, canonical chunk position) for every near-duplicate chunk.
+    """
+    return [
+        (int(position), question_id, chunk)
+        for position, (question_id, chunk) in (record.get('duplicates') or {}).items()
+    ]
+
+
+class EmbeddingStoreWriter:
+    """
+    Writes chunk embeddings as one raw float32 matrix plus a JSON Lines sidecar.
+
+    Layout of the store directory:
+      embeddings.f32  row-major float32 matrix, one row per chunk
+      records.jsonl   one line per question: id, original row, chunks and the
+                      offset of its first chunk row in embeddings.f32
+                      (near-duplicate chunks have no row of their own, see
+                      record 'duplicates' and stored_chunk_indices())
+      manifest.json   dim/count/dtype, written last by close()
+
+    Rows are appended as they arrive, so the writer never holds more than the
+    batch it was given.
+    """
+
+    def __init__(self, store_dir, model_name=None, granularity=None):
+        self.store_dir = store_dir
+        self.model_name = model_name
+        self.granularity = granularity
+        self.dim = None
+        self.count = 0
+        os.makedirs(store_dir, exist_ok=True)
+        # Drop any stale manifest first so a half-written store is never opened.
+        manifest_path = os.path.join(store_dir, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        self._embeddings_file = open(os.path.join(store_dir, EMBEDDINGS_FILE), mode='wb')
+        self._records_file = open(os.path.join(store_dir, RECORDS_FILE), mode='w', encoding='utf-8')
+
+    def append(self, question_id, original_question, chunks, chunk_embeddings, duplicates=None):
+        """
+        Appends one question and the embeddings of its chunks.
+
+        duplicates maps chunk positions to the (question_id, chunk position) of the canonical chunk
+        they near-duplicate; those chunks are given no embedding, so chunk_embeddings holds the
+        remaining chunks in order.
+        """
+        chunk_embeddings = np.ascontiguousarray(chunk_embeddings, dtype='float32')
+        duplicates = {str(position): list(canonical) for position, canonical in (duplicates or {}).items()}
+        num_rows = len(chunks) - len(duplicates)
+        if num_rows != len(chunk_embeddings):
+            raise ValueError(f"Question {question_id}: {num_rows} stored chunks but {len(chunk_embeddings)} embeddings")
+        if num_rows:
+            if self.dim is None:
+                self.dim = chunk_embeddings.shape[1]
+            elif chunk_embeddings.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension changed from {self.dim} to {chunk_embeddings.shape[1]}")
+            self._embeddings_file.write(chunk_embeddings.tobytes())
+
+        record = {
+            'id': question_id,
+            'original_question': original_question,
+            'chunks': chunks,
+            'offset': self.count
+        }
+        if duplicates:
+            record['duplicates'] = duplicates
+        self._records_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.count += num_rows
+
+    def close(self):
+        self._embeddings_file.close()
+        self._records_file.close()
+        manifest = {
+            'format': STORE_FORMAT,
+            'version': STORE_VERSION,
+            'dtype': 'float32',
+            'dim': self.dim,
+            'count': self.count,
+            'model_name': self.model_name,
+            'granularity': self.granularity
+        }
+        with open(os.path.join(self.store_dir, MANIFEST_FILE), mode='w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=4)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # Leave the store without a manifest so readers reject it.
+            self._embeddings_file.close()
+            self._records_file.close()
+
+
+class EmbeddingStore:
+    """
+    Read side of an embedding store. `embeddings` is a read-only memory map,
+    so opening a store costs the same no matter how large the corpus is.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        manifest_path = os.path.join(store_dir, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            raise FileNotFoundError(f"No embedding store manifest at {manifest_path} (incomplete or missing store)")
+        with open(manifest_path, mode='r', encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('format') != STORE_FORMAT:
+            raise ValueError(f"{store_dir} is not an embedding store")
+
+        self.dim = self.manifest['dim']
+        self.count = self.manifest['count']
+        self.model_name = self.manifest.get('model_name')
+        self.granularity = self.manifest.get('granularity') or 'chunk' # Stores predating the setting were chunked
+        if self.count:
+            self.embeddings = np.memmap(
+                os.path.join(store_dir, EMBEDDINGS_FILE),
+                dtype='float32', mode='r', shape=(self.count, self.dim)
+            )
+        else:
+            self.embeddings = np.zeros((0, self.dim or 0), dtype='float32')
+
+    def iter_records(self):
+        """
+        Yields the per-question records in write order.
+        """
+        with open(os.path.join(self.store_dir, RECORDS_FILE), mode='r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def iter_batches(self, batch_size=65536):
+        """
+        Yields (start_row, contiguous float32 batch) slices of the embedding matrix.
+        """
+        for start in range(0, self.count, batch_size):
+            yield start, np.ascontiguousarray(self.embeddings[start:start + batch_size])
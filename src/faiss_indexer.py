@@ -1,49 +1,754 @@
+import argparse
+import hashlib
 import json
+import math
+import os
+import shutil
+import sys
+import time
 import numpy as np
 import faiss
+from embedding_store import EmbeddingStore, EmbeddingStoreWriter, record_duplicates, stored_chunk_indices
+from chunk_store import ChunkStore, create_chunk_store, publish_chunk_store
+from lexical_index import build_lexical_index
+from attribute_index import build_attribute_index, question_attributes
+from problem_sets import passage_entry
 
-def create_and_save_faiss_index(processed_data_path, faiss_index_path):
+INDEX_TYPES = ('flat', 'ivf', 'hnsw', 'ivfpq', 'sq8')
+
+# IVF types keep their vectors in inverted lists, which faiss memory-maps with IO_FLAG_MMAP;
+# the others store one flat code array, which needs IO_FLAG_MMAP_IFC instead.
+IVF_INDEX_TYPES = ('ivf', 'ivfpq')
+
+# Vectors are keyed by stable 63-bit ids: a 47-bit hash of the question's original_id in the
+# high bits and the chunk index in the low CHUNK_ID_BITS, so all chunks of one question form
+# one contiguous id range and survive rebuilds and incremental updates unchanged.
+CHUNK_ID_BITS = 16
+MAX_CHUNKS_PER_QUESTION = 1 << CHUNK_ID_BITS
+
+# Sharded builds: output directory layout is shard-<i>/faiss_index.bin plus this manifest
+SHARD_STRATEGIES = ('hash', 'subject')
+SHARD_MANIFEST_FILE = "shards.json"
+
+# Filtered searches admitting at most this many ids are answered exactly from reconstructed vectors
+EXACT_FILTER_MAX_IDS = 4096
+
+# Candidate values tried by the auto-tuner, cheapest first
+NPROBE_CANDIDATES = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024]
+EF_SEARCH_CANDIDATES = [16, 24, 32, 48, 64, 96, 128, 192, 256, 384, 512]
+
+def params_path_for(faiss_index_path):
+    return faiss_index_path + ".params.json"
+
+def map_path_for(faiss_index_path):
+    return faiss_index_path + ".map.db"
+
+def lexical_path_for(faiss_index_path):
+    return faiss_index_path + ".lex"
+
+def attribute_path_for(faiss_index_path):
+    return faiss_index_path + ".attrs.npz"
+
+def related_path_for(faiss_index_path):
+    return faiss_index_path + ".related"
+
+def clusters_path_for(faiss_index_path):
+    return faiss_index_path + ".clusters.npz"
+
+def question_key(original_id):
+    digest = hashlib.blake2b(str(original_id).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') >> (64 - 63 + CHUNK_ID_BITS)
+
+def check_question_keys(question_ids, key_owners=None):
     """
-    Creates a FAISS index from processed data and saves it to a file.
+    Fails loudly if two different original_ids share a question_key(): their chunks would get the
+    same FAISS ids and silently overwrite each other. key_owners (question key -> original_id of
+    questions already indexed) is not modified; returns a copy extended with question_ids.
     """
-    with open(processed_data_path, mode='r', encoding='utf-8') as f:
-        processed_data = json.load(f)
+    key_owners = dict(key_owners or {})
+    for question_id in question_ids:
+        owner = key_owners.setdefault(question_key(question_id), question_id)
+        if str(owner) != str(question_id):
+            raise ValueError(f"Question ids '{owner}' and '{question_id}' hash to the same question key "
+                             f"{question_key(question_id)}; rename one of them")
+    return key_owners
 
-    # Assuming all embeddings have the same dimension
-    embedding_dimension = len(processed_data[0]['chunk_embeddings'][0])
+def question_chunk_ids(original_id, num_chunks):
+    """
+    FAISS ids of the first num_chunks chunks of a question.
+    """
+    if num_chunks > MAX_CHUNKS_PER_QUESTION:
+        raise ValueError(f"Question {original_id} has {num_chunks} chunks, more than {MAX_CHUNKS_PER_QUESTION}")
+    return (question_key(original_id) << CHUNK_ID_BITS) + np.arange(num_chunks, dtype='int64')
 
-    # Prepare embeddings for FAISS
-    all_embeddings = []
-    # Store a mapping from FAISS index to original question ID and chunk index
-    # This will be useful for retrieval later
-    faiss_id_to_original_data = [] 
+def chunk_faiss_id(original_id, chunk_index):
+    return (question_key(original_id) << CHUNK_ID_BITS) + chunk_index
 
-    for item in processed_data:
-        for i, embedding in enumerate(item['chunk_embeddings']):
-            all_embeddings.append(embedding)
-            faiss_id_to_original_data.append({
-                'original_id': item['id'],
-                'chunk_index': i,
-                'chunk_text': item['chunks'][i]
-            })
+def question_keys_of(faiss_ids):
+    """
+    Recovers the question key from FAISS ids; chunks of the same question share it.
+    """
+    return np.asarray(faiss_ids, dtype='int64') >> CHUNK_ID_BITS
+
+def row_content_hash(row):
+    """
+    Hash of a CSV row, used to detect edited questions between updates.
+    """
+    return hashlib.blake2b(json.dumps(row, sort_keys=True, ensure_ascii=False).encode('utf-8'), digest_size=16).hexdigest()
+
+def store_faiss_ids(store):
+    """
+    The FAISS id of every row of an embedding store, in row order (near-duplicate chunks have no row).
+    Raises ValueError if two questions of the store share a question key (see check_question_keys()).
+    """
+    ids = np.empty(store.count, dtype='int64')
+    question_ids = []
+    for record in store.iter_records():
+        question_ids.append(record['id'])
+        offset = record['offset']
+        positions = stored_chunk_indices(record)
+        ids[offset:offset + len(positions)] = question_chunk_ids(record['id'], len(record['chunks']))[positions]
+    check_question_keys(question_ids)
+    return ids
+
+def store_row_lookup(store, ids=None):
+    """
+    (sorted FAISS ids, their rows) of an embedding store, for rows_for_ids().
+    """
+    ids = store_faiss_ids(store) if ids is None else ids
+    order = np.argsort(ids)
+    return ids[order], order
+
+def rows_for_ids(row_lookup, faiss_ids):
+    sorted_ids, order = row_lookup
+    return order[np.searchsorted(sorted_ids, np.asarray(faiss_ids, dtype='int64'))]
+
+def record_duplicate_ids(record):
+    """
+    (faiss_id, canonical faiss_id) of the record's near-duplicate chunks.
+    """
+    return [
+        (chunk_faiss_id(record['id'], position), chunk_faiss_id(question_id, chunk))
+        for position, question_id, chunk in record_duplicates(record)
+    ]
+
+def default_nlist(ntotal):
+    """
+    Rule of thumb of ~4*sqrt(N) inverted lists, keeping at least 39 training points per list.
+    """
+    return max(1, min(int(4 * math.sqrt(ntotal)), ntotal // 39))
+
+def sample_rows(store, sample_size, seed=0):
+    """
+    Returns a random sample of embedding rows as a contiguous float32 array (sorted row order
+    keeps reads from the memory map mostly sequential).
+    """
+    if sample_size >= store.count:
+        return np.ascontiguousarray(store.embeddings[:]), np.arange(store.count)
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(store.count, size=sample_size, replace=False))
+    return np.ascontiguousarray(store.embeddings[rows]), rows
+
+def default_pq_m(dim):
+    """
+    Number of PQ sub-quantizers: one per 8 dimensions (384 -> 48 bytes per vector), adjusted
+    down to a divisor of dim.
+    """
+    m = max(1, dim // 8)
+    while dim % m:
+        m -= 1
+    return m
+
+def resolve_index_type(index_type, ntotal, pq_nbits=8):
+    """
+    Index type to build for ntotal vectors. Training 'ivfpq' needs at least 2**pq_nbits vectors
+    (one per centroid of each sub-quantizer), so a smaller corpus falls back to 'ivf' (IVF-flat).
+    """
+    if index_type == 'ivfpq' and ntotal < 1 << pq_nbits:
+        print(f"Only {ntotal} vectors, PQ training needs at least {1 << pq_nbits}: building an 'ivf' index instead of 'ivfpq'",
+              flush=True, file=sys.stderr)
+        return 'ivf'
+    return index_type
+
+def build_empty_index(dim, index_type, ntotal, nlist=None, hnsw_m=32, ef_construction=40, pq_m=None, pq_nbits=8):
+    """
+    Index factory for the supported index types. IVF and SQ indexes still need training.
+    Raises ValueError for 'ivfpq' with fewer than 2**pq_nbits vectors (see resolve_index_type()).
+    """
+    if index_type == 'flat':
+        return faiss.IndexFlatL2(dim)
+    if index_type == 'ivf':
+        quantizer = faiss.IndexFlatL2(dim)
+        return faiss.IndexIVFFlat(quantizer, dim, nlist or default_nlist(ntotal), faiss.METRIC_L2)
+    if index_type == 'ivfpq':
+        if ntotal < 1 << pq_nbits:
+            raise ValueError(f"An 'ivfpq' index with {pq_nbits}-bit codes needs at least {1 << pq_nbits} training vectors, got {ntotal}")
+        quantizer = faiss.IndexFlatL2(dim)
+        return faiss.IndexIVFPQ(quantizer, dim, nlist or default_nlist(ntotal), pq_m or default_pq_m(dim), pq_nbits)
+    if index_type == 'sq8':
+        # 1 byte per dimension, 4x smaller than float32 with little recall loss
+        return faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2)
+    if index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(dim, hnsw_m)
+        index.hnsw.efConstruction = ef_construction
+        return index
+    raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
 
-    all_embeddings_np = np.array(all_embeddings).astype('float32')
+def wrap_with_ids(index, index_type):
+    """
+    Makes a trained index accept add_with_ids/remove_ids. IVF indexes store ids natively and only
+    need a hashtable direct map for reconstruct(); the others are wrapped in IndexIDMap2.
+    """
+    if index_type in IVF_INDEX_TYPES:
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+        return index
+    return faiss.IndexIDMap2(index)
 
-    # Create a FAISS index (using IndexFlatL2 for simplicity)
-    index = faiss.IndexFlatL2(embedding_dimension)
-    index.add(all_embeddings_np)
+def exact_knn(store, queries, k, batch_size=65536):
+    """
+    Ground-truth neighbours by brute force over the memory-mapped store, one batch at a time,
+    so no second full copy of the corpus is needed.
+    """
+    heap = faiss.ResultHeap(len(queries), k)
+    for start, batch in store.iter_batches(batch_size):
+        distances, indices = faiss.knn(queries, batch, min(k, len(batch)))
+        if distances.shape[1] < k:
+            pad = k - distances.shape[1]
+            distances = np.hstack([distances, np.full((len(queries), pad), np.inf, dtype='float32')])
+            indices = np.hstack([indices, np.full((len(queries), pad), -1, dtype='int64')])
+        heap.add_result(distances, np.where(indices >= 0, indices + start, -1))
+    heap.finalize()
+    return heap.D, heap.I
+
+def recall_at_k(ground_truth, found):
+    """
+    Mean fraction of the exact top-k that the approximate search returned.
+    """
+    hits = 0
+    for truth_row, found_row in zip(ground_truth, found):
+        truth = set(truth_row[truth_row >= 0].tolist())
+        if truth:
+            hits += len(truth.intersection(found_row.tolist())) / len(truth)
+    return hits / len(ground_truth)
 
-    # Save the FAISS index
-    faiss.write_index(index, faiss_index_path)
+def search_param_name(index_type):
+    return {'ivf': 'nprobe', 'ivfpq': 'nprobe', 'hnsw': 'efSearch'}.get(index_type)
 
-    # Save the mapping as well, as FAISS only stores vectors
-    with open(faiss_index_path + ".map", mode='w', encoding='utf-8') as f:
-        json.dump(faiss_id_to_original_data, f, indent=4, ensure_ascii=False)
+def apply_search_params(index, search_params):
+    """
+    Applies saved search-time parameters such as {'nprobe': 16} or {'efSearch': 64}.
+    """
+    if not search_params:
+        return
+    parameter_space = faiss.ParameterSpace()
+    for name, value in search_params.items():
+        parameter_space.set_index_parameter(index, name, value)
+
+def search_with_selector(index, queries, k, selector, search_params=None):
+    """
+    index.search restricted to the ids accepted by a faiss.IDSelector. The SearchParameters subclass
+    must match the underlying index, so nprobe/efSearch are carried over explicitly.
+    """
+    search_params = search_params or {}
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(inner, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=search_params.get('nprobe', inner.nprobe))
+    elif isinstance(inner, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=search_params.get('efSearch', inner.hnsw.efSearch))
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    return index.search(queries, k, params=params)
+
+def exact_subset_search(index, queries, k, ids):
+    """
+    Exact L2 search over the given ids only, from vectors reconstructed out of the index
+    (IndexIDMap2 and IVF direct maps support reconstruction by id). Rows are padded with -1.
+    """
+    ids = np.asarray(ids, dtype='int64')
+    distances = np.full((len(queries), k), np.inf, dtype='float32')
+    indices = np.full((len(queries), k), -1, dtype='int64')
+    if not len(ids):
+        return distances, indices
+    vectors = np.ascontiguousarray(index.reconstruct_batch(ids), dtype='float32')
+    found_distances, rows = faiss.knn(np.ascontiguousarray(queries, dtype='float32'), vectors, min(k, len(ids)))
+    distances[:, :rows.shape[1]] = found_distances
+    indices[:, :rows.shape[1]] = np.where(rows >= 0, ids[np.maximum(rows, 0)], -1)
+    return distances, indices
+
+def filtered_search(index, queries, k, ids, selector, search_params=None):
+    """
+    Top-k restricted to `ids` (sorted FAISS ids, with `selector` accepting exactly them), returning
+    min(k, len(ids)) hits per query whenever that many exist.
+
+    Small id sets are searched exactly. Otherwise the selector is applied inside the FAISS search;
+    a selective filter can leave IVF/HNSW short of k (the probed lists or visited graph nodes hold
+    too few matches), so short rows are searched again with every list probed / a wider efSearch,
+    and exactly as a last resort.
+    """
+    expected = min(k, len(ids))
+    if len(ids) <= EXACT_FILTER_MAX_IDS:
+        return exact_subset_search(index, queries, k, ids)
+    distances, indices = search_with_selector(index, queries, k, selector, search_params)
+    short = np.flatnonzero((indices[:, :expected] == -1).any(axis=1))
+    if not len(short):
+        return distances, indices
+
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    widened = dict(search_params or {})
+    if isinstance(inner, faiss.IndexIVF):
+        widened['nprobe'] = inner.nlist
+    elif isinstance(inner, faiss.IndexHNSW):
+        widened['efSearch'] = max(widened.get('efSearch', inner.hnsw.efSearch) * 8, 4 * k)
+    retry_distances, retry_indices = search_with_selector(index, queries[short], k, selector, widened)
+    distances[short], indices[short] = retry_distances, retry_indices
+
+    still_short = short[(retry_indices[:, :expected] == -1).any(axis=1)]
+    if len(still_short):
+        distances[still_short], indices[still_short] = exact_subset_search(index, queries[still_short], k, ids)
+    return distances, indices
+
+def tune_search_params(index, index_type, store, ids, k=10, target_recall=0.95, num_queries=500, seed=0):
+    """
+    Picks the cheapest nprobe/efSearch whose recall@k against exact search reaches target_recall.
+    Falls back to the most accurate candidate tried when the target cannot be met.
+    `ids` maps store rows to the FAISS ids the index returns.
+    Returns (search_params, tuning_report).
+    """
+    param_name = search_param_name(index_type)
+    if param_name is None:
+        return {}, []
+
+    queries, _ = sample_rows(store, min(num_queries, store.count), seed=seed + 1)
+    _, ground_truth_rows = exact_knn(store, queries, k)
+    ground_truth = np.where(ground_truth_rows >= 0, ids[ground_truth_rows], -1)
+
+    if param_name == 'nprobe':
+        nlist = faiss.extract_index_ivf(index).nlist
+        candidates = [c for c in NPROBE_CANDIDATES if c <= nlist] or [nlist]
+    else:
+        candidates = [c for c in EF_SEARCH_CANDIDATES if c >= k] or [k]
+
+    report = []
+    chosen = None
+    for value in candidates:
+        apply_search_params(index, {param_name: value})
+        started = time.perf_counter()
+        _, found = index.search(queries, k)
+        elapsed = time.perf_counter() - started
+        recall = recall_at_k(ground_truth, found)
+        report.append({param_name: value, 'recall': recall, 'ms_per_query': 1000 * elapsed / len(queries)})
+        if recall >= target_recall:
+            chosen = value
+            break
+    if chosen is None:
+        chosen = max(report, key=lambda r: r['recall'])[param_name]
+
+    search_params = {param_name: chosen}
+    apply_search_params(index, search_params)
+    return search_params, report
+
+def build_faiss_index(store, ids, index_type='flat', nlist=None, hnsw_m=32, ef_construction=40, train_sample_size=None,
+                      seed=0, pq_m=None):
+    """
+    Builds and fills an index of the requested type from an embedding store, adding each row under
+    its stable id from `ids`. IVF/PQ/SQ quantizers are trained on a random sample of the stored vectors.
+    Callers pick index_type through resolve_index_type(), as a small store cannot train 'ivfpq'.
+    """
+    index = build_empty_index(store.dim, index_type, store.count, nlist, hnsw_m, ef_construction, pq_m)
+    if not index.is_trained:
+        if train_sample_size is None:
+            # Plenty for k-means (and 256 PQ centroids), far below the corpus size
+            train_sample_size = 256 * max(getattr(index, 'nlist', 1), 256)
+        training_vectors, _ = sample_rows(store, train_sample_size, seed=seed)
+        if index_type == 'ivfpq' and len(training_vectors) < 1 << index.pq.nbits:
+            raise ValueError(f"PQ training needs at least {1 << index.pq.nbits} vectors, the sample has {len(training_vectors)}")
+        index.train(training_vectors)
+    index = wrap_with_ids(index, index_type)
+    for start, batch in store.iter_batches():
+        index.add_with_ids(batch, ids[start:start + len(batch)])
+    return index
+
+def read_faiss_index(faiss_index_path, index_type=None, mmap=False):
+    """
+    Reads an index from disk. With mmap=True the vectors/codes stay in the file and are paged in
+    on demand, so every process that maps the same file shares one copy through the page cache.
+    A memory-mapped index is read-only.
+    """
+    if not mmap:
+        return faiss.read_index(faiss_index_path)
+    if index_type is None:
+        index_type = load_index_params(faiss_index_path).get('index_type', 'flat')
+    # IO_FLAG_MMAP_IFC only exists in faiss >= 1.8; older versions map flat codes with IO_FLAG_MMAP
+    flat_codes_flag = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP)
+    mmap_flag = faiss.IO_FLAG_MMAP if index_type in IVF_INDEX_TYPES else flat_codes_flag
+    return faiss.read_index(faiss_index_path, mmap_flag | faiss.IO_FLAG_READ_ONLY)
+
+def write_faiss_index(index, faiss_index_path):
+    """
+    Writes through a temporary file and renames it, so readers never see a partial index.
+    """
+    tmp_path = faiss_index_path + ".tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, faiss_index_path)
+
+def save_json_atomic(path, data, indent=None):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, mode='w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+    os.replace(tmp_path, path)
+
+def save_index_params(faiss_index_path, params):
+    save_json_atomic(params_path_for(faiss_index_path), params, indent=4)
+
+def load_index_params(faiss_index_path):
+    """
+    Returns the parameters saved next to an index, or {} for indexes built before they were saved.
+    """
+    path = params_path_for(faiss_index_path)
+    if not os.path.exists(path):
+        return {}
+    with open(path, mode='r', encoding='utf-8') as f:
+        return json.load(f)
+
+def write_attribute_index(faiss_index_path, chunk_store=None):
+    """
+    Rebuilds <faiss_index_path>.attrs.npz (per-attribute FAISS id sets for filtered retrieval) from
+    the question attributes in the chunk store. Returns {attribute: {value: number of chunks}}.
+    Near-duplicate chunks are left out: they have no vector, and their canonical may belong to a
+    question the filter rejects.
+    """
+    own_store = chunk_store is None
+    if own_store:
+        chunk_store = ChunkStore(map_path_for(faiss_index_path), readonly=True)
+    try:
+        duplicates, _ = chunk_store.duplicate_ids()
+        entries = (
+            (np.setdiff1d(question_chunk_ids(original_id, num_chunks), duplicates, assume_unique=True), attributes)
+            for original_id, num_chunks, attributes in chunk_store.iter_question_attributes()
+        )
+        return build_attribute_index(entries, attribute_path_for(faiss_index_path))
+    finally:
+        if own_store:
+            chunk_store.close()
+
+def default_num_clusters(num_questions):
+    """
+    About sqrt(Q) topic clusters, keeping at least 39 questions per cluster for k-means.
+    """
+    return max(1, min(int(math.sqrt(num_questions)), num_questions // 39, 1024))
+
+def normalize_rows(vectors):
+    return vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+
+def store_question_vectors(store):
+    """
+    (original_ids, question vectors): the normalized mean of each question's chunk embeddings
+    (near-duplicate chunks count with their canonical's embedding), skipping questions without chunks
+    and passage records (problem_sets.py).
+    """
+    question_ids, vectors = [], []
+    row_lookup = None
+    for record in store.iter_records():
+        if record['chunks'] and passage_entry(record['original_question']) is None:
+            offset = record['offset']
+            rows = np.arange(offset, offset + len(stored_chunk_indices(record)))
+            duplicate_ids = record_duplicate_ids(record)
+            if duplicate_ids:
+                row_lookup = row_lookup or store_row_lookup(store)
+                rows = np.sort(np.concatenate([rows, rows_for_ids(row_lookup, [canonical for _, canonical in duplicate_ids])]))
+            question_ids.append(record['id'])
+            vectors.append(np.asarray(store.embeddings[rows]).mean(axis=0))
+    if not vectors:
+        return question_ids, np.zeros((0, store.dim or 0), dtype='float32')
+    return question_ids, normalize_rows(np.vstack(vectors)).astype('float32')
+
+def save_question_clusters(output_path, question_ids, centroids, assignments, distances):
+    """
+    Writes the clustering (.npz, replaced atomically), rows ordered by question key:
+
+      question_ids  original_ids
+      question_keys their FAISS id prefixes (faiss_id >> CHUNK_ID_BITS), for filtering
+      assignments   cluster of every question
+      distances     squared L2 distance of every question to its centroid
+      centroids     (clusters, dim) float32
+    """
+    keys = np.array([question_key(question_id) for question_id in question_ids], dtype='int64')
+    order = np.argsort(keys)
+    tmp_path = output_path + ".tmp.npz"
+    np.savez(tmp_path, question_ids=np.asarray(question_ids, dtype=str)[order], question_keys=keys[order],
+             assignments=np.asarray(assignments, dtype='int32')[order], distances=np.asarray(distances, dtype='float32')[order],
+             centroids=np.ascontiguousarray(centroids, dtype='float32'))
+    os.replace(tmp_path, output_path)
+
+def build_question_clusters(question_ids, vectors, output_path, num_clusters=None, niter=20, seed=0):
+    """
+    k-means (faiss.Kmeans) over question vectors, saved with save_question_clusters().
+    Returns statistics.
+    """
+    started = time.perf_counter()
+    if not len(question_ids):
+        return None
+    num_clusters = min(num_clusters or default_num_clusters(len(question_ids)), len(question_ids))
+    kmeans = faiss.Kmeans(vectors.shape[1], num_clusters, niter=niter, seed=seed)
+    kmeans.train(vectors)
+    distances, assignments = kmeans.index.search(vectors, 1)
+    save_question_clusters(output_path, question_ids, kmeans.centroids, assignments[:, 0], distances[:, 0])
+    sizes = np.bincount(assignments[:, 0], minlength=num_clusters)
+    return {
+        'clusters': num_clusters,
+        'questions': len(question_ids),
+        'min_size': int(sizes.min()),
+        'max_size': int(sizes.max()),
+        'seconds': time.perf_counter() - started
+    }
+
+def update_question_clusters(faiss_index_path, index, chunk_store, question_ids):
+    """
+    Re-assigns the given (added, edited or removed) questions after an index update: their vectors
+    are rebuilt from the index and put in the nearest existing cluster; removed ones are dropped.
+    Centroids stay as trained; rebuild the index to re-cluster.
+    """
+    path = clusters_path_for(faiss_index_path)
+    with np.load(path) as data:
+        clusters = {name: data[name] for name in data.files}
+    touched = set(question_ids)
+    keep = np.array([str(question_id) not in touched for question_id in clusters['question_ids']], dtype=bool)
+    states = chunk_store.question_states()
+    present = [question_id for question_id in sorted(touched) if states.get(question_id, {}).get('chunks')]
+    duplicate_ids = chunk_store.duplicate_ids()
+
+    new_ids = [str(question_id) for question_id in clusters['question_ids'][keep]] + present
+    assignments = [clusters['assignments'][keep]]
+    distances = [clusters['distances'][keep]]
+    if present:
+        vectors = normalize_rows(np.vstack([
+            index.reconstruct_batch(
+                chunk_store.canonical_ids(question_chunk_ids(question_id, states[question_id]['chunks']), duplicate_ids)
+            ).mean(axis=0)
+            for question_id in present
+        ])).astype('float32')
+        nearest_distances, nearest = faiss.knn(vectors, clusters['centroids'], 1)
+        assignments.append(nearest[:, 0])
+        distances.append(nearest_distances[:, 0])
+    save_question_clusters(path, new_ids, clusters['centroids'], np.concatenate(assignments), np.concatenate(distances))
+
+def create_and_save_faiss_index(processed_data_path, faiss_index_path, index_type='flat', nlist=None, hnsw_m=32,
+                                ef_construction=40, target_recall=0.95, tune_k=10, pq_m=None, lexical=True,
+                                num_clusters=None):
+    """
+    Creates a FAISS index from an embedding store written by data_processor.py and saves it to a file.
+    Vectors are added straight from the memory-mapped matrix, one batch at a time.
+
+    index_type is one of 'flat', 'ivf', 'hnsw', or the compressed 'ivfpq' (product quantization,
+    pq_m bytes per vector) and 'sq8' (8-bit scalar quantization). For the IVF/HNSW types nprobe/efSearch is tuned
+    to reach target_recall at tune_k against exact search, and the result is written to
+    <faiss_index_path>.params.json, which RAGRetriever applies when it loads the index.
+
+    With lexical=True a character n-gram inverted index over the chunk texts is written to
+    <faiss_index_path>.lex (see lexical_index.py) for hybrid and exact-term retrieval.
+    The subject/year/exam_type/difficulty id sets for filtered retrieval always go to
+    <faiss_index_path>.attrs.npz (see attribute_index.py), and a k-means clustering of the question
+    vectors (num_clusters, default about sqrt(questions)) to <faiss_index_path>.clusters.npz for
+    diverse sampling (see question_clusters.py).
+
+    Near-duplicate chunks collapsed by data_processor.py have no row in the store, so only their
+    canonical is indexed; the chunk store keeps their text and a duplicate -> canonical mapping.
+    """
+    store = EmbeddingStore(processed_data_path)
+    if not store.count:
+        raise ValueError(f"Embedding store {processed_data_path} is empty")
+
+    ids = store_faiss_ids(store)
+    index_type = resolve_index_type(index_type, store.count)
+
+    started = time.perf_counter()
+    index = build_faiss_index(store, ids, index_type, nlist, hnsw_m, ef_construction, pq_m=pq_m)
+    build_seconds = time.perf_counter() - started
+
+    search_params, tuning_report = tune_search_params(index, index_type, store, ids, k=tune_k, target_recall=target_recall)
+
+    # Store a mapping from FAISS id to original question ID and chunk index, as FAISS only stores vectors.
+    # It also records each question's content hash and chunk count, used by index_updater.py to find changed rows.
+    chunk_store = create_chunk_store(map_path_for(faiss_index_path))
+    num_duplicates = 0
+    for record in store.iter_records():
+        chunk_ids = question_chunk_ids(record['id'], len(record['chunks']))
+        chunk_store.put_chunks(
+            (chunk_ids[i], record['id'], i, chunk_text) for i, chunk_text in enumerate(record['chunks'])
+        )
+        duplicate_ids = record_duplicate_ids(record)
+        if duplicate_ids:
+            chunk_store.put_duplicates(duplicate_ids)
+            num_duplicates += len(duplicate_ids)
+        chunk_store.put_questions([(record['id'], row_content_hash(record['original_question']), len(record['chunks']))])
+        chunk_store.put_question_attributes(record['id'], question_attributes(record['original_question']))
+        passage = passage_entry(record['original_question'])
+        if passage is not None:
+            chunk_store.put_passages([passage])
+        elif record['original_question'].get('passage_ids'):
+            chunk_store.put_question_passages(record['id'], record['original_question']['passage_ids'])
+
+    # Save the FAISS index, then the mapping
+    write_faiss_index(index, faiss_index_path)
+    publish_chunk_store(chunk_store, map_path_for(faiss_index_path))
+
+    attribute_stats = write_attribute_index(faiss_index_path)
+
+    lexical_stats = None
+    if lexical:
+        # Character n-gram inverted index over the same chunks, for hybrid and exact-term retrieval
+        chunk_store = ChunkStore(map_path_for(faiss_index_path), readonly=True)
+        lexical_stats = build_lexical_index(chunk_store.iter_chunks(), lexical_path_for(faiss_index_path))
+        chunk_store.close()
+
+    question_ids, question_vectors = store_question_vectors(store)
+    cluster_stats = build_question_clusters(question_ids, question_vectors, clusters_path_for(faiss_index_path), num_clusters)
+
+    params = {
+        'index_type': index_type,
+        'model_name': store.model_name,
+        'granularity': store.granularity,
+        'dim': store.dim,
+        'ntotal': index.ntotal,
+        'duplicate_chunks': num_duplicates,
+        'file_bytes': os.path.getsize(faiss_index_path),
+        'search_params': search_params,
+        'build_seconds': build_seconds,
+        'lexical_index': lexical_stats,
+        'attribute_index': attribute_stats,
+        'question_clusters': cluster_stats,
+        'tuning': {'k': tune_k, 'target_recall': target_recall, 'trials': tuning_report}
+    }
+    save_index_params(faiss_index_path, params)
+    return params
+
+def assign_subject_shards(chunks_per_subject, num_shards):
+    """
+    Greedy balance: the largest subjects first, each onto the currently smallest shard.
+    Returns {subject: shard index}.
+    """
+    loads = [0] * num_shards
+    assignment = {}
+    for subject, chunks in sorted(chunks_per_subject.items(), key=lambda item: (-item[1], item[0])):
+        shard = loads.index(min(loads))
+        assignment[subject] = shard
+        loads[shard] += chunks
+    return assignment
+
+def record_subject(record):
+    return question_attributes(record['original_question']).get('subject', '')
+
+def create_and_save_sharded_index(processed_data_path, output_dir, num_shards, shard_by='hash', index_type='flat', **index_kwargs):
+    """
+    Splits the embedding store into num_shards and builds one complete index per shard
+    (output_dir/shard-<i>/faiss_index.bin with its chunk store, lexical and attribute indexes),
+    for scatter-gather search by shard_search.py.
+
+    shard_by='hash' places each question by its stable question key (problem set id for the
+    structured records of problem_sets.py), which balances shards;
+    'subject' keeps each subject on one shard (subjects balanced greedily by chunk count), so a
+    subject-filtered query only has to visit the shards holding that subject. All chunks of a question
+    always land on the same shard. Shards that end up empty are left out of the manifest. A
+    near-duplicate chunk whose canonical went to another shard gets a copy of the canonical's vector.
+
+    Writes output_dir/shards.json and returns it.
+    """
+    if shard_by not in SHARD_STRATEGIES:
+        raise ValueError(f"Unknown shard strategy '{shard_by}', expected one of {SHARD_STRATEGIES}")
+    store = EmbeddingStore(processed_data_path)
+    subject_shards = None
+    if shard_by == 'subject':
+        chunks_per_subject = {}
+        for record in store.iter_records():
+            subject = record_subject(record)
+            chunks_per_subject[subject] = chunks_per_subject.get(subject, 0) + len(record['chunks'])
+        subject_shards = assign_subject_shards(chunks_per_subject, num_shards)
+
+    os.makedirs(output_dir, exist_ok=True)
+    shard_store_dirs = [os.path.join(output_dir, f"shard-{i}.store") for i in range(num_shards)]
+    writers = [EmbeddingStoreWriter(shard_dir, model_name=store.model_name, granularity=store.granularity) for shard_dir in shard_store_dirs]
+    question_shards = {}
+    row_lookup = None
+    try:
+        for record in store.iter_records():
+            if subject_shards is not None:
+                shard = subject_shards[record_subject(record)]
+            else:
+                # Questions of a problem set stay with their passages
+                shard = question_key(record['original_question'].get('problem_set_id') or record['id']) % num_shards
+            question_shards[record['id']] = shard
+            positions = stored_chunk_indices(record)
+            rows = dict(zip(positions, range(record['offset'], record['offset'] + len(positions))))
+            duplicates = {}
+            for position, question_id, chunk in record_duplicates(record):
+                if question_shards.get(question_id) == shard:
+                    duplicates[position] = (question_id, chunk)
+                else:
+                    row_lookup = row_lookup or store_row_lookup(store)
+                    rows[position] = int(rows_for_ids(row_lookup, [chunk_faiss_id(question_id, chunk)])[0])
+            writers[shard].append(record['id'], record['original_question'], record['chunks'],
+                                  store.embeddings[[rows[position] for position in sorted(rows)]], duplicates)
+    finally:
+        for writer in writers:
+            writer.close()
+
+    shards = []
+    started = time.perf_counter()
+    for i, shard_store_dir in enumerate(shard_store_dirs):
+        if EmbeddingStore(shard_store_dir).count:
+            shard_index_path = os.path.join(output_dir, f"shard-{i}", "faiss_index.bin")
+            os.makedirs(os.path.dirname(shard_index_path), exist_ok=True)
+            params = create_and_save_faiss_index(shard_store_dir, shard_index_path, index_type, **index_kwargs)
+            shards.append({
+                'shard': i,
+                'path': os.path.relpath(shard_index_path, output_dir),
+                'ntotal': params['ntotal'],
+                'subjects': sorted(subject for subject, shard in (subject_shards or {}).items() if shard == i)
+            })
+        shutil.rmtree(shard_store_dir)
+
+    manifest = {
+        'num_shards': num_shards,
+        'shard_by': shard_by,
+        'index_type': index_type,
+        'ntotal': sum(shard['ntotal'] for shard in shards),
+        'build_seconds': time.perf_counter() - started,
+        'shards': shards
+    }
+    save_json_atomic(os.path.join(output_dir, SHARD_MANIFEST_FILE), manifest, indent=4)
+    return manifest
+
+def load_shard_manifest(sharded_index_dir):
+    with open(os.path.join(sharded_index_dir, SHARD_MANIFEST_FILE), mode='r', encoding='utf-8') as f:
+        return json.load(f)
 
 if __name__ == "__main__":
-    processed_data_input_path = "/mnt/d/progress/munjero_rag_system/munjero_rag_system/data/processed_data.json"
-    faiss_index_output_path = "/mnt/d/progress/munjero_rag_system/munjero_rag_system/models/faiss_index.bin"
-    
-    print(f"Creating FAISS index from {processed_data_input_path} and saving to {faiss_index_output_path}...")
-    create_and_save_faiss_index(processed_data_input_path, faiss_index_output_path)
-    print("FAISS index creation complete.")
+    parser = argparse.ArgumentParser(description="Build the FAISS index from a processed embedding store.")
+    parser.add_argument("--input", default="/mnt/d/progress/munjero_rag_system/munjero_rag_system/data/processed_data")
+    parser.add_argument("--output", default="/mnt/d/progress/munjero_rag_system/munjero_rag_system/models/faiss_index.bin")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat")
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--pq-m", type=int, default=None)
+    parser.add_argument("--target-recall", type=float, default=0.95)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--no-lexical", action="store_true", help="Skip the n-gram inverted index")
+    parser.add_argument("--clusters", type=int, default=None, help="k-means clusters of questions (default: about sqrt(questions))")
+    parser.add_argument("--shards", type=int, default=1, help="With more than 1, --output is a directory of shard indexes")
+    parser.add_argument("--shard-by", choices=SHARD_STRATEGIES, default="hash")
+    args = parser.parse_args()
+
+    if args.shards > 1:
+        print(f"Creating {args.shards} {args.index_type} FAISS shards (by {args.shard_by}) from {args.input} in {args.output}...")
+        manifest = create_and_save_sharded_index(args.input, args.output, args.shards, args.shard_by, args.index_type,
+                                                 nlist=args.nlist, hnsw_m=args.hnsw_m, target_recall=args.target_recall,
+                                                 tune_k=args.k, pq_m=args.pq_m, lexical=not args.no_lexical,
+                                                 num_clusters=args.clusters)
+        print(f"Sharded index complete: {manifest['ntotal']} vectors in {len(manifest['shards'])} shards "
+              f"({', '.join(str(shard['ntotal']) for shard in manifest['shards'])}).")
+    else:
+        print(f"Creating {args.index_type} FAISS index from {args.input} and saving to {args.output}...")
+        params = create_and_save_faiss_index(args.input, args.output, args.index_type, args.nlist, args.hnsw_m,
+                                             target_recall=args.target_recall, tune_k=args.k, pq_m=args.pq_m,
+                                             lexical=not args.no_lexical, num_clusters=args.clusters)
+        print(f"FAISS index creation complete: {params['ntotal']} vectors, search params {params['search_params']}.")
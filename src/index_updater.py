@@ -0,0 +1,175 @@
+import argparse
+import csv
+import os
+import time
+import numpy as np
+import faiss
+from data_processor import ENCODE_BATCH_SIZE, create_text_splitter, encode_row_batch, iter_row_batches
+from embedding_cache import get_default_cache
+from embedding_model import embedding_model_id, get_model_for_id
+from chunk_store import ChunkStore
+from faiss_indexer import (check_question_keys, clusters_path_for, lexical_path_for, load_index_params, map_path_for,
+                           question_chunk_ids, question_key, related_path_for, row_content_hash, save_index_params,
+                           update_question_clusters, write_attribute_index, write_faiss_index)
+from attribute_index import question_attributes
+from lexical_index import build_lexical_index
+
+def detect_row_changes(csv_file_path, row_states):
+    """
+    Compares the CSV against the row states saved with the index.
+    Returns (changed_rows, removed_ids) where changed_rows holds new and edited rows in CSV order.
+    """
+    changed_rows = []
+    seen_ids = set()
+    with open(csv_file_path, mode='r', encoding='utf-8') as csv_file:
+        for row in csv.DictReader(csv_file):
+            question_id = row['id']
+            seen_ids.add(question_id)
+            state = row_states.get(question_id)
+            if state is None or state['hash'] != row_content_hash(row):
+                changed_rows.append(row)
+    removed_ids = [question_id for question_id in row_states if question_id not in seen_ids]
+    return changed_rows, removed_ids
+
+class IndexUpdater:
+    """
+    Applies add/update/remove operations to a saved FAISS index keyed by stable question ids
+    (see question_chunk_ids in faiss_indexer.py), together with its .map.db chunk store.
+
+    Works for every index type except 'hnsw', which cannot remove vectors. Nothing is written
+    until save() is called: the index file is replaced atomically first, then the chunk store
+    transaction is committed (a retriever never sees ids without metadata for long, and skips them).
+
+    Chunks added here are not near-duplicate collapsed (that happens in data_processor.py);
+    removing a canonical chunk hands its vector to a surviving duplicate.
+    """
+
+    def __init__(self, faiss_index_path, model=None, embedding_cache=None, batch_size=ENCODE_BATCH_SIZE):
+        self.faiss_index_path = faiss_index_path
+        self.params = load_index_params(faiss_index_path)
+        if self.params.get('index_type') == 'hnsw':
+            raise ValueError("HNSW indexes do not support removal; rebuild with faiss_indexer.py instead")
+        self.index = faiss.read_index(faiss_index_path)
+        self.chunk_store = ChunkStore(map_path_for(faiss_index_path))
+        self.row_states = self.chunk_store.question_states()
+        self.touched_questions = set() # Added, edited or removed since the last save()
+        self.key_owners = None # Question key -> original_id, built on the first upsert
+        # New chunks must be embedded with the model the index was built with
+        self.model_id = self.params.get('model_name') or embedding_model_id()
+        self.model = model
+        self.embedding_cache = embedding_cache
+        self.batch_size = batch_size
+        # New rows are split like the rest of the index
+        self.text_splitter = create_text_splitter(self.params.get('granularity') or 'chunk')
+
+    def _get_model(self):
+        if self.model is None:
+            self.model = get_model_for_id(self.model_id)
+        return self.model
+
+    def remove(self, question_ids):
+        """
+        Removes every chunk of the given questions. Unknown ids are ignored. Returns the number of vectors removed.
+        """
+        chunk_ids = []
+        removed_questions = []
+        for question_id in question_ids:
+            state = self.row_states.pop(question_id, None)
+            if state is None:
+                continue
+            chunk_ids.extend(question_chunk_ids(question_id, state['chunks']).tolist())
+            removed_questions.append(question_id)
+            if self.key_owners is not None:
+                self.key_owners.pop(question_key(question_id), None)
+            self.touched_questions.add(question_id)
+        if not chunk_ids:
+            return 0
+        promoted = self.chunk_store.promote_duplicates(chunk_ids)
+        if promoted:
+            # Near-duplicates of removed chunks keep the vector under their own id
+            old_ids, new_ids = (np.array(ids, dtype='int64') for ids in zip(*promoted))
+            self.index.add_with_ids(np.ascontiguousarray(self.index.reconstruct_batch(old_ids), dtype='float32'), new_ids)
+        self.chunk_store.delete_chunks(chunk_ids)
+        self.chunk_store.delete_questions(removed_questions)
+        # IDSelectorArray, because IVF indexes with a hashtable direct map reject other selectors
+        return self.index.remove_ids(faiss.IDSelectorArray(np.asarray(chunk_ids, dtype='int64'))) - len(promoted)
+
+    def upsert(self, rows):
+        """
+        Adds new questions and replaces edited ones. Rows are CSV dicts with at least 'id' and 'question_text'.
+        Returns the number of vectors added. Raises ValueError, before changing anything, if a new id
+        shares its question key with another question (see check_question_keys in faiss_indexer.py).
+        """
+        if self.key_owners is None:
+            self.key_owners = check_question_keys(self.row_states)
+        self.key_owners = check_question_keys([row['id'] for row in rows], self.key_owners)
+        self.remove([row['id'] for row in rows])
+        chunked_rows = ((row['id'], row, self.text_splitter.split_text(row['question_text'])) for row in rows)
+        added = 0
+        for row_batch in iter_row_batches(chunked_rows, self.batch_size):
+            for question_id, row, chunks, chunk_embeddings, _ in encode_row_batch(self._get_model(), row_batch, self.batch_size, self.embedding_cache, self.model_id):
+                chunk_ids = question_chunk_ids(question_id, len(chunks))
+                if len(chunks):
+                    self.index.add_with_ids(np.ascontiguousarray(chunk_embeddings, dtype='float32'), chunk_ids)
+                self.chunk_store.put_chunks(
+                    (chunk_ids[i], question_id, i, chunk_text) for i, chunk_text in enumerate(chunks)
+                )
+                self.row_states[question_id] = {'hash': row_content_hash(row), 'chunks': len(chunks)}
+                self.touched_questions.add(question_id)
+                self.chunk_store.put_questions([(question_id, self.row_states[question_id]['hash'], len(chunks))])
+                self.chunk_store.put_question_attributes(question_id, question_attributes(row))
+                added += len(chunks)
+        return added
+
+    def save(self):
+        lexical_path = lexical_path_for(self.faiss_index_path)
+        if os.path.exists(lexical_path):
+            # Rebuilt from the chunk texts (this connection sees the pending changes); no embedding needed
+            build_lexical_index(self.chunk_store.iter_chunks(), lexical_path)
+        write_attribute_index(self.faiss_index_path, self.chunk_store)
+        if self.touched_questions and os.path.exists(clusters_path_for(self.faiss_index_path)):
+            update_question_clusters(self.faiss_index_path, self.index, self.chunk_store, self.touched_questions)
+        if os.path.exists(related_path_for(self.faiss_index_path)):
+            # Before the index file, so a retriever reloading on the new index also sees the new graph
+            from related_questions import update_related_questions
+            update_related_questions(self.faiss_index_path, self.index, self.chunk_store)
+        write_faiss_index(self.index, self.faiss_index_path)
+        self.chunk_store.commit()
+        self.params['ntotal'] = self.index.ntotal
+        save_index_params(self.faiss_index_path, self.params)
+        self.touched_questions = set()
+
+def update_faiss_index_from_csv(csv_file_path, faiss_index_path, model=None):
+    """
+    Incrementally syncs an existing index with the CSV: only new or edited rows are chunked and
+    embedded, rows missing from the CSV are removed. Returns a summary of what changed.
+    """
+    started = time.perf_counter()
+    updater = IndexUpdater(faiss_index_path, model=model, embedding_cache=get_default_cache())
+    changed_rows, removed_ids = detect_row_changes(csv_file_path, updater.row_states)
+    new_ids = [row['id'] for row in changed_rows if row['id'] not in updater.row_states]
+
+    removed_vectors = updater.remove(removed_ids)
+    added_vectors = updater.upsert(changed_rows) if changed_rows else 0
+    if changed_rows or removed_ids:
+        updater.save()
+
+    return {
+        'added': new_ids,
+        'updated': [row['id'] for row in changed_rows if row['id'] not in set(new_ids)],
+        'removed': removed_ids,
+        'vectors_added': added_vectors,
+        'vectors_removed': removed_vectors,
+        'ntotal': updater.index.ntotal,
+        'seconds': time.perf_counter() - started
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply CSV changes to an existing FAISS index without a rebuild.")
+    parser.add_argument("--csv", default="/mnt/d/progress/munjero_rag_system/munjero_rag_system/data/data.csv")
+    parser.add_argument("--index", default="/mnt/d/progress/munjero_rag_system/munjero_rag_system/models/faiss_index.bin")
+    args = parser.parse_args()
+
+    summary = update_faiss_index_from_csv(args.csv, args.index)
+    print(f"Index updated in {summary['seconds']:.1f}s: {len(summary['added'])} added, {len(summary['updated'])} updated, "
+          f"{len(summary['removed'])} removed ({summary['ntotal']} vectors).")
@@ -0,0 +1,288 @@
+import argparse
+import os
+import shutil
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from embedding_cache import get_default_cache
+from faiss_indexer import INDEX_TYPES, create_and_save_faiss_index, load_index_params, map_path_for
+from rag_retriever import LRUCache, RAGRetriever
+
+# Layout of an index root:
+#   versions/<version>/faiss_index.bin   (+ .params.json, .map.db, .lex, .attrs.npz)
+#   current -> versions/<version>        symlink, replaced atomically on publish
+VERSIONS_DIR = "versions"
+CURRENT_LINK = "current"
+INDEX_FILE = "faiss_index.bin"
+
+def versions_path(index_root):
+    return os.path.join(index_root, VERSIONS_DIR)
+
+def version_index_path(index_root, version):
+    return os.path.join(versions_path(index_root), version, INDEX_FILE)
+
+def new_version(index_root):
+    """
+    Creates an empty, unpublished version directory and returns its name (sortable by creation time,
+    down to the microsecond, so versions built within one second still prune in order).
+    """
+    now = time.time()
+    version = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}-{int(now * 1e6) % 1000000:06d}-{uuid.uuid4().hex[:6]}"
+    os.makedirs(os.path.join(versions_path(index_root), version))
+    return version
+
+def current_version(index_root):
+    """
+    Name of the published version, or None before the first publish.
+    """
+    link = os.path.join(index_root, CURRENT_LINK)
+    if not os.path.islink(link):
+        return None
+    return os.path.basename(os.readlink(link).rstrip(os.sep))
+
+def list_versions(index_root):
+    if not os.path.isdir(versions_path(index_root)):
+        return []
+    return sorted(os.listdir(versions_path(index_root)))
+
+def publish_version(index_root, version):
+    """
+    Points `current` at the version with one atomic rename; readers see either the old or the new
+    version, never a mix. Also used to roll back to an older version.
+    """
+    if not os.path.exists(version_index_path(index_root, version)):
+        raise FileNotFoundError(f"No index in version {version} under {index_root}")
+    tmp_link = os.path.join(index_root, f".{CURRENT_LINK}.{uuid.uuid4().hex}")
+    os.symlink(os.path.join(VERSIONS_DIR, version), tmp_link)
+    os.replace(tmp_link, os.path.join(index_root, CURRENT_LINK))
+
+def _created_at(version):
+    # new_version() names are '<YYYYmmdd-HHMMSS>-<microseconds>-<random>' (older ones had no
+    # microseconds and sort before anything created in the same second); the random suffix says nothing about order
+    return version.rsplit('-', 1)[0]
+
+def prune_versions(index_root, keep=3):
+    """
+    Deletes versions published before the current one, keeping the newest keep - 1 of them (plus
+    current) for roll backs. Never touches current or anything created after it, which includes
+    versions still being built or migrated (reembed_migration.py) and, after a roll back, the
+    versions it rolled back from. Nothing is pruned before the first publish. Retrievers still
+    holding a deleted version keep working from their open files and memory maps until they swap.
+    """
+    current = current_version(index_root)
+    if current is None:
+        return []
+    older = [version for version in list_versions(index_root) if _created_at(version) < _created_at(current)]
+    removed = older[:-(keep - 1)] if keep > 1 else older
+    for version in removed:
+        shutil.rmtree(os.path.join(versions_path(index_root), version))
+    return removed
+
+def build_index_version(processed_data_path, index_root, publish=True, keep=3, **index_kwargs):
+    """
+    Builds a complete index from an embedding store into a fresh version directory and, with
+    publish=True, makes it current. Returns (version, params).
+    """
+    version = new_version(index_root)
+    params = create_and_save_faiss_index(processed_data_path, version_index_path(index_root, version), **index_kwargs)
+    if publish:
+        publish_version(index_root, version)
+        prune_versions(index_root, keep)
+    return version, params
+
+class _LoadedVersion:
+    def __init__(self, version, retriever):
+        self.version = version
+        self.retriever = retriever
+        self.active_requests = 0
+        self.retired = False
+
+class HotSwappingRetriever:
+    """
+    RAGRetriever over a versioned index root that follows the `current` pointer without downtime.
+
+    A watcher thread polls `current`; when it moves, the new version is loaded and warmed with
+    sample queries in the background while the old one keeps serving. The swap itself is a pointer
+    assignment between requests. Every request holds the version it started on, so in-flight queries
+    finish on the old version; the old version is closed (index, memory maps, chunk store released)
+    as soon as its last request completes.
+    """
+
+    def __init__(self, index_root, poll_interval=2.0, warm_queries=None, num_warm_queries=32, embedding_cache=None,
+                 **retriever_kwargs):
+        self.index_root = index_root
+        self.poll_interval = poll_interval
+        self.warm_queries = warm_queries
+        self.num_warm_queries = num_warm_queries
+        # One embedding cache shared by all versions; versions swap their own index files only
+        self.embedding_cache = embedding_cache if embedding_cache is not None else get_default_cache()
+        self.retriever_kwargs = dict(retriever_kwargs, index_check_interval=float('inf'))
+        self.swaps = []
+        self._lock = threading.Lock()
+        self._swap_lock = threading.Lock()
+
+        version = current_version(index_root)
+        if version is None:
+            raise FileNotFoundError(f"No published index version under {index_root}")
+        self._active = _LoadedVersion(version, self._open(version))
+        self._stop = threading.Event()
+        self._watcher = threading.Thread(target=self._watch, name="index-version-watcher", daemon=True)
+        self._watcher.start()
+
+    def _open(self, version):
+        path = version_index_path(self.index_root, version)
+        return RAGRetriever(path, map_path_for(path), embedding_cache=self.embedding_cache, **self.retriever_kwargs)
+
+    def _warm(self, retriever):
+        queries = self.warm_queries or retriever.chunk_store.sample_chunk_texts(self.num_warm_queries)
+        return retriever.warm_up(queries) if queries else 0.0
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.check_for_new_version()
+            except Exception as e:
+                print(f"HotSwappingRetriever: loading a new version failed, still serving {self.version}: {e}", flush=True, file=sys.stderr)
+
+    def check_for_new_version(self):
+        """
+        Loads, warms and swaps in the current version if it changed. Returns True when it swapped.
+        Called by the watcher thread; safe to call directly (e.g. right after publish_version()).
+        """
+        with self._swap_lock:
+            version = current_version(self.index_root)
+            if version is None or version == self._active.version:
+                return False
+            started = time.perf_counter()
+            retriever = self._open(version)
+            warm_seconds = self._warm(retriever)
+            old = self._active
+            retriever.query_embedding_cache = old.retriever.query_embedding_cache # Keyed by model, safe to share
+
+            with self._lock:
+                self._active = _LoadedVersion(version, retriever)
+                old.retired = True
+                release_now = old.active_requests == 0
+        if release_now:
+            self._release(old)
+        self.swaps.append({
+            'from': old.version,
+            'to': version,
+            'load_seconds': time.perf_counter() - started - warm_seconds,
+            'warm_seconds': warm_seconds,
+            'swapped_at': time.time()
+        })
+        print(f"HotSwappingRetriever: swapped {old.version} -> {version}", flush=True, file=sys.stderr)
+        return True
+
+    def _release(self, loaded):
+        # The query embedding cache was handed to the next version; keep its entries
+        loaded.retriever.query_embedding_cache = LRUCache(0)
+        loaded.retriever.close()
+
+    @contextmanager
+    def _lease(self):
+        with self._lock:
+            loaded = self._active
+            loaded.active_requests += 1
+        try:
+            yield loaded.retriever
+        finally:
+            with self._lock:
+                loaded.active_requests -= 1
+                release_now = loaded.retired and loaded.active_requests == 0
+            if release_now:
+                self._release(loaded)
+
+    @property
+    def version(self):
+        return self._active.version
+
+    @property
+    def index_version(self):
+        return self._active.version
+
+    @property
+    def mode(self):
+        return self._active.retriever.mode
+
+    def retrieve(self, query, k=3, mode=None, filters=None):
+        with self._lease() as retriever:
+            return retriever.retrieve(query, k, mode, filters)
+
+    def retrieve_batch(self, queries, k=3, mode=None, filters=None):
+        with self._lease() as retriever:
+            return retriever.retrieve_batch(queries, k, mode, filters)
+
+    def search_vectors(self, query_embeddings, k=3, filters=None):
+        with self._lease() as retriever:
+            return retriever.search_vectors(query_embeddings, k, filters)
+
+    def related_questions(self, original_id, n=None):
+        with self._lease() as retriever:
+            return retriever.related_questions(original_id, n)
+
+    def sample_questions(self, m, filters=None, seed=None, central=False):
+        with self._lease() as retriever:
+            return retriever.sample_questions(m, filters, seed, central)
+
+    def lookup_term(self, term, limit=20):
+        with self._lease() as retriever:
+            return retriever.lookup_term(term, limit)
+
+    def warm_up(self, queries=("warm up",)):
+        with self._lease() as retriever:
+            return retriever.warm_up(queries)
+
+    def cache_stats(self):
+        with self._lease() as retriever:
+            stats = retriever.cache_stats()
+        stats['index_version'] = self.version
+        stats['swaps'] = self.swaps[-10:]
+        return stats
+
+    def close(self):
+        self._stop.set()
+        self._watcher.join()
+        with self._lock:
+            self._active.retired = True
+            release_now = self._active.active_requests == 0
+        if release_now:
+            self._release(self._active)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Versioned index directories with an atomic 'current' pointer.")
+    parser.add_argument("--root", required=True, help="Index root (holds versions/ and current)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="Build a new version from an embedding store and publish it")
+    build.add_argument("--input", required=True, help="Embedding store written by data_processor.py")
+    build.add_argument("--index-type", choices=INDEX_TYPES, default="flat")
+    build.add_argument("--keep", type=int, default=3, help="Versions to keep after publishing, counting the current one")
+    build.add_argument("--no-publish", action="store_true")
+
+    publish = subparsers.add_parser("publish", help="Make an existing version current (e.g. roll back)")
+    publish.add_argument("version")
+
+    subparsers.add_parser("list", help="List versions")
+
+    prune = subparsers.add_parser("prune", help="Delete versions older than the current one")
+    prune.add_argument("--keep", type=int, default=3, help="Versions to keep, counting the current one")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        version, params = build_index_version(args.input, args.root, publish=not args.no_publish, keep=args.keep,
+                                              index_type=args.index_type)
+        print(f"Built version {version}: {params['ntotal']} vectors{'' if args.no_publish else ', now current'}.")
+    elif args.command == "publish":
+        publish_version(args.root, args.version)
+        print(f"Current version is now {args.version}.")
+    elif args.command == "list":
+        current = current_version(args.root)
+        for version in list_versions(args.root):
+            params = load_index_params(version_index_path(args.root, version))
+            print(f"{'*' if version == current else ' '} {version}  {params.get('index_type')}  {params.get('ntotal')} vectors")
+    elif args.command == "prune":
+        print(f"Removed {len(prune_versions(args.root, args.keep))} versions.")
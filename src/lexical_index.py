@@ -0,0 +1,199 @@
+import math
+import os
+import re
+import shutil
+import unicodedata
+from array import array
+from collections import Counter
+import numpy as np
+
+NGRAM_SIZE = 2 # Character bigrams work well for Korean, which has no reliable word segmentation here
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def char_ngrams(text, n=NGRAM_SIZE):
+    """
+    Character n-grams of every word in the text; words shorter than n are kept whole.
+    """
+    grams = []
+    for token in _TOKEN_RE.findall(unicodedata.normalize('NFC', text).lower()):
+        if len(token) <= n:
+            grams.append(token)
+        else:
+            grams.extend(token[i:i + n] for i in range(len(token) - n + 1))
+    return grams
+
+
+def build_lexical_index(chunks, output_dir, n=NGRAM_SIZE):
+    """
+    Builds the inverted index from an iterable of (faiss_id, chunk_text) and writes it to
+    output_dir as plain .npy arrays (so it can be memory-mapped):
+
+      grams.npy     sorted unique n-grams
+      offsets.npy   postings of grams[i] are postings[offsets[i]:offsets[i+1]]
+      postings.npy  document numbers, ascending within each gram
+      tfs.npy       term frequency of the gram in that document
+      doc_ids.npy   FAISS id of each document number
+      doc_lens.npy  number of n-grams in each document (for BM25 length normalization)
+
+    The directory is replaced atomically-enough for readers: the new one is renamed into place
+    and the old one removed afterwards (already mapped files stay readable).
+    """
+    vocab = {}
+    posting_grams = array('i')
+    posting_docs = array('i')
+    posting_tfs = array('H')
+    doc_ids = array('q')
+    doc_lens = array('i')
+
+    for doc_number, (faiss_id, text) in enumerate(chunks):
+        grams = char_ngrams(text, n)
+        doc_ids.append(int(faiss_id))
+        doc_lens.append(len(grams))
+        for gram, tf in Counter(grams).items():
+            posting_grams.append(vocab.setdefault(gram, len(vocab)))
+            posting_docs.append(doc_number)
+            posting_tfs.append(min(tf, 65535))
+
+    grams_by_id = np.array(list(vocab), dtype=f'<U{n}') if vocab else np.zeros(0, dtype=f'<U{n}')
+    gram_order = np.argsort(grams_by_id, kind='stable')
+    # Rank of each gram id in sorted order, so postings can be sorted by gram string
+    gram_rank = np.empty(len(gram_order), dtype='int64')
+    gram_rank[gram_order] = np.arange(len(gram_order))
+
+    posting_rank = gram_rank[np.frombuffer(posting_grams, dtype='int32')] if len(posting_grams) else np.zeros(0, dtype='int64')
+    order = np.argsort(posting_rank, kind='stable') # Stable: documents stay ascending within a gram
+    offsets = np.zeros(len(gram_order) + 1, dtype='int64')
+    np.cumsum(np.bincount(posting_rank, minlength=len(gram_order)), out=offsets[1:])
+
+    tmp_dir = output_dir.rstrip(os.sep) + ".tmp"
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    np.save(os.path.join(tmp_dir, "grams.npy"), grams_by_id[gram_order])
+    np.save(os.path.join(tmp_dir, "offsets.npy"), offsets)
+    np.save(os.path.join(tmp_dir, "postings.npy"), np.frombuffer(posting_docs, dtype='int32')[order])
+    np.save(os.path.join(tmp_dir, "tfs.npy"), np.frombuffer(posting_tfs, dtype='uint16')[order])
+    np.save(os.path.join(tmp_dir, "doc_ids.npy"), np.frombuffer(doc_ids, dtype='int64'))
+    np.save(os.path.join(tmp_dir, "doc_lens.npy"), np.frombuffer(doc_lens, dtype='int32'))
+
+    old_dir = output_dir.rstrip(os.sep) + ".old"
+    if os.path.exists(output_dir):
+        if os.path.exists(old_dir):
+            shutil.rmtree(old_dir)
+        os.rename(output_dir, old_dir)
+    os.rename(tmp_dir, output_dir)
+    if os.path.exists(old_dir):
+        shutil.rmtree(old_dir)
+    return {'documents': len(doc_ids), 'grams': len(gram_order), 'postings': len(posting_docs)}
+
+
+class LexicalIndex:
+    """
+    Read side of the n-gram inverted index. Arrays are memory-mapped, so loading is cheap and
+    queries only touch the posting lists of their own n-grams.
+    """
+
+    def __init__(self, index_dir, n=NGRAM_SIZE):
+        self.index_dir = index_dir
+        self.n = n
+        load = lambda name: np.load(os.path.join(index_dir, name), mmap_mode='r')
+        self.grams = load("grams.npy")
+        self.offsets = load("offsets.npy")
+        self.postings = load("postings.npy")
+        self.tfs = load("tfs.npy")
+        self.doc_ids = load("doc_ids.npy")
+        self.doc_lens = load("doc_lens.npy")
+        self.num_docs = len(self.doc_ids)
+        self.avg_doc_len = float(np.mean(self.doc_lens)) if self.num_docs else 0.0
+
+    def _posting_slice(self, gram):
+        slot = int(np.searchsorted(self.grams, gram))
+        if slot >= len(self.grams) or self.grams[slot] != gram:
+            return None
+        return slice(int(self.offsets[slot]), int(self.offsets[slot + 1]))
+
+    def search(self, query, k=10, allowed_ids=None):
+        """
+        BM25 over character n-grams. Returns (faiss_ids, scores), best first.
+        allowed_ids (sorted FAISS ids) restricts the results to those documents.
+        """
+        query_grams = Counter(char_ngrams(query, self.n))
+        doc_parts = []
+        score_parts = []
+        for gram, query_tf in query_grams.items():
+            posting = self._posting_slice(gram)
+            if posting is None:
+                continue
+            docs = np.asarray(self.postings[posting])
+            tfs = np.asarray(self.tfs[posting], dtype='float32')
+            idf = math.log(1 + (self.num_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            lengths = np.asarray(self.doc_lens[docs], dtype='float32')
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / self.avg_doc_len)
+            doc_parts.append(docs)
+            score_parts.append(query_tf * idf * tfs * (BM25_K1 + 1) / (tfs + norm))
+        if not doc_parts:
+            return np.zeros(0, dtype='int64'), np.zeros(0, dtype='float32')
+
+        docs, inverse = np.unique(np.concatenate(doc_parts), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(score_parts)).astype('float32')
+        if allowed_ids is not None:
+            allowed = np.isin(np.asarray(self.doc_ids[docs]), allowed_ids, assume_unique=True)
+            docs, scores = docs[allowed], scores[allowed]
+        top = np.argsort(-scores, kind='stable')[:k]
+        return np.asarray(self.doc_ids[docs[top]]), scores[top]
+
+    def candidates_containing(self, term):
+        """
+        FAISS ids of documents containing every n-gram of the term: a superset of the documents
+        that contain the exact term, found from the posting lists alone.
+        """
+        docs = None
+        for gram in set(char_ngrams(term, self.n)):
+            posting = self._posting_slice(gram)
+            if posting is None:
+                return np.zeros(0, dtype='int64')
+            gram_docs = np.asarray(self.postings[posting])
+            docs = gram_docs if docs is None else np.intersect1d(docs, gram_docs, assume_unique=True)
+            if not len(docs):
+                break
+        if docs is None:
+            return np.zeros(0, dtype='int64')
+        return np.asarray(self.doc_ids[docs])
+
+
+def reciprocal_rank_fusion(ranked_id_lists, rrf_k=60):
+    """
+    Fuses several best-first id lists: score(id) = sum of 1 / (rrf_k + rank). Returns {id: score}.
+    """
+    fused = {}
+    for ranked_ids in ranked_id_lists:
+        for rank, faiss_id in enumerate(ranked_ids):
+            fused[int(faiss_id)] = fused.get(int(faiss_id), 0.0) + 1.0 / (rrf_k + rank + 1)
+    return fused
+
+
+def weighted_score_fusion(vector_ids, vector_distances, lexical_ids, lexical_scores, vector_weight=0.5):
+    """
+    Min-max normalizes both score sources to [0, 1] (distances inverted) and mixes them linearly.
+    Returns {id: score}.
+    """
+    def normalized(values, invert):
+        values = np.asarray(values, dtype='float32')
+        if not len(values):
+            return values
+        span = float(values.max() - values.min())
+        if span <= 0:
+            return np.ones_like(values) # All equally good, whichever direction is better
+        scaled = (values - values.min()) / span
+        return 1 - scaled if invert else scaled
+
+    fused = {}
+    for faiss_id, score in zip(vector_ids, normalized(vector_distances, invert=True)):
+        fused[int(faiss_id)] = fused.get(int(faiss_id), 0.0) + vector_weight * float(score)
+    for faiss_id, score in zip(lexical_ids, normalized(lexical_scores, invert=False)):
+        fused[int(faiss_id)] = fused.get(int(faiss_id), 0.0) + (1 - vector_weight) * float(score)
+    return fused
@@ -0,0 +1,101 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+class MicroBatcher:
+    """
+    Collects items submitted from many threads and hands them to process_batch(items) in groups.
+
+    A batch is dispatched as soon as it holds max_batch_size items, or max_wait_ms after its first
+    item arrived, whichever comes first; an idle batcher therefore adds at most max_wait_ms of latency
+    to a lone request. process_batch runs on one background thread and must return one result per
+    item, in order. submit() returns a Future. A result that is an exception instance fails only
+    that item's Future, so process_batch can keep one bad item from failing the rest; an exception
+    raised by process_batch itself fails every item of that batch.
+    """
+
+    def __init__(self, process_batch, max_batch_size=64, max_wait_ms=5.0, name="micro-batcher"):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._stats = {'items': 0, 'batches': 0, 'max_batch_size_seen': 0, 'busy_seconds': 0.0}
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        if self._closed:
+            raise RuntimeError("MicroBatcher is closed")
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def _collect(self):
+        """
+        Blocks for the first item, then gathers more until the batch is full or the wait expires.
+        Returns None once close() was called and the queue is drained.
+        """
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is None:
+                self._queue.put(None) # Finish this batch first, stop on the next collect
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            items = [item for item, _ in batch]
+            started = time.perf_counter()
+            try:
+                results = self.process_batch(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"process_batch returned {len(results)} results for {len(items)} items")
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    if isinstance(result, BaseException):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+            with self._stats_lock:
+                self._stats['items'] += len(items)
+                self._stats['batches'] += 1
+                self._stats['max_batch_size_seen'] = max(self._stats['max_batch_size_seen'], len(items))
+                self._stats['busy_seconds'] += time.perf_counter() - started
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['mean_batch_size'] = stats['items'] / stats['batches'] if stats['batches'] else 0.0
+        stats['queued'] = self._queue.qsize()
+        stats['max_batch_size'] = self.max_batch_size
+        stats['max_wait_ms'] = self.max_wait_ms
+        return stats
+
+    def close(self, timeout=None):
+        """
+        Stops accepting items; items already queued are still processed.
+        """
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout)
@@ -1,12 +1,13 @@
 import os
 import re
-from flask import Flask, request, render_template
+from flask import Flask, request, render_template, jsonify
 from munjero_rag_system.pdf_processor import parse_problem_block, extract_structured_content_from_pdf
 import io
 import json
 import redis
 
 from munjero_rag_system.rag_core import process_pdf_for_rag
+from embedding_model import is_model_loaded, model_load_seconds
 
 app = Flask(__name__, template_folder="templates", static_folder="static")
 r = redis.Redis(host='localhost', port=6379, db=0)
@@ -16,6 +17,11 @@ r = redis.Redis(host='localhost', port=6379, db=0)
 def from_json_filter(value):
     return json.loads(value)
 
+@app.route('/health')
+def health():
+    """Answers as soon as the app is imported; the embedding model loads lazily on the first upload."""
+    return jsonify({'status': 'ok', 'model_loaded': is_model_loaded(), 'model_load_seconds': model_load_seconds()}), 200
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -1,20 +1,39 @@
-from sentence_transformers import SentenceTransformer
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 import faiss
 import numpy as np
 import json
+import threading
+import time
+from embedding_cache import encode_with_cache, get_default_cache
+from embedding_model import get_model, model_id_of
+from near_duplicates import NearDuplicateDetector
 
-# Initialize SentenceTransformer model globally to avoid reloading
-model = SentenceTransformer('all-MiniLM-L6-v2')
+_embedding_cache = None
+_embedding_cache_opened = False
+_embedding_cache_lock = threading.Lock()
 
-# Initialize text splitter globally (will be used if custom parsing fails or for general text)
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=200,
-    chunk_overlap=20,
-    separators=["\n\n", "\n", " ", ""]
-)
+def get_embedding_cache():
+    """
+    Shared on-disk embedding cache, so re-uploading the same PDF does not re-embed it (None when
+    disabled); opened on the first upload, so importing the app touches no file.
+    """
+    global _embedding_cache, _embedding_cache_opened
+    if not _embedding_cache_opened:
+        with _embedding_cache_lock:
+            if not _embedding_cache_opened:
+                _embedding_cache = get_default_cache()
+                _embedding_cache_opened = True
+    return _embedding_cache
 
-def process_pdf_for_rag(pdf_file, extract_structured_content_from_pdf_func):
+def process_pdf_for_rag(pdf_file, extract_structured_content_from_pdf_func, dedup=False):
+    """
+    Extracts structured chunks from the PDF, embeds them and builds an in-memory FAISS index whose
+    row i is chunks[i].
+
+    With dedup=True near-identical chunks (repeated headers, instructions, passages) are collapsed
+    first: only the first of each group is embedded and indexed, 'chunks' holds just those (still
+    row-aligned with the index), 'all_chunks' every extracted chunk, 'duplicate_of' maps an
+    all_chunks position to the position of its canonical, and 'dedup' is the near_duplicates.py report.
+    """
     # pdfplumber expects a file path or a file-like object that it can seek
     # io.BytesIO is suitable for this.
     
@@ -27,16 +46,40 @@ def process_pdf_for_rag(pdf_file, extract_structured_content_from_pdf_func):
     # Convert structured chunks to a string representation for embedding
     chunks_for_embedding = [json.dumps(chunk, ensure_ascii=False) for chunk in structured_chunks]
 
-    # Generate embeddings for each chunk
-    chunk_embeddings = model.encode(chunks_for_embedding).astype('float32')
+    detector = NearDuplicateDetector() if dedup else None
+    duplicate_of = {}
+    canonical_positions = []
+    for position, text in enumerate(chunks_for_embedding):
+        canonical = detector.add(position, text) if detector is not None else None
+        if canonical is None:
+            canonical_positions.append(position)
+        else:
+            duplicate_of[position] = canonical
+
+    # Generate embeddings for each (canonical) chunk
+    # The model is loaded on the first upload (or by warm_up()), not when the app is imported
+    started = time.perf_counter()
+    model = get_model()
+    chunk_embeddings = encode_with_cache(
+        model, [chunks_for_embedding[position] for position in canonical_positions], model_id_of(model), get_embedding_cache()
+    )
+    seconds_per_chunk = (time.perf_counter() - started) / len(canonical_positions)
 
     # Create an in-memory FAISS index
     embedding_dimension = chunk_embeddings.shape[1]
     index = faiss.IndexFlatL2(embedding_dimension)
     index.add(chunk_embeddings)
 
-    return {
-        'chunks': structured_chunks, # Return structured chunks for display
+    result = {
+        'chunks': [structured_chunks[position] for position in canonical_positions], # Return structured chunks for display
         'index': index,
-        'chunk_embeddings': chunk_embeddings 
-    }, None
+        'chunk_embeddings': chunk_embeddings
+    }
+    if detector is not None:
+        result.update({
+            'all_chunks': structured_chunks,
+            'canonical_positions': canonical_positions,
+            'duplicate_of': duplicate_of,
+            'dedup': detector.report(seconds_per_chunk, embedding_dimension * 4)
+        })
+    return result, None
@@ -0,0 +1,128 @@
+import time
+import zlib
+import numpy as np
+from embedding_cache import normalize_text
+
+SHINGLE_SIZE = 5
+NUM_PERMUTATIONS = 128
+NUM_BANDS = 32 # 32 bands x 4 rows: pairs at Jaccard 0.8 become candidates with probability > 0.999
+DEFAULT_THRESHOLD = 0.9
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    """
+    Hashes (crc32) of the character shingles of the normalized, lowercased text.
+    Text shorter than one shingle is hashed whole, so short chunks still compare.
+    """
+    text = normalize_text(text).lower()
+    if len(text) <= size:
+        return np.array([zlib.crc32(text.encode('utf-8'))], dtype='uint64')
+    return np.unique(np.fromiter(
+        (zlib.crc32(text[i:i + size].encode('utf-8')) for i in range(len(text) - size + 1)),
+        dtype='uint64', count=len(text) - size + 1
+    ))
+
+
+class NearDuplicateDetector:
+    """
+    Streaming MinHash-LSH near-duplicate detection over chunk texts.
+
+    add(key, text) returns the key of an earlier canonical chunk whose estimated Jaccard similarity
+    (over character shingles) is at least `threshold`, or None after registering the text as a new
+    canonical. Only canonicals enter the LSH buckets, so a group never chains away from its first
+    member and memory grows with the number of distinct chunks, not the corpus size.
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, num_permutations=NUM_PERMUTATIONS, num_bands=NUM_BANDS, seed=1):
+        if num_permutations % num_bands:
+            raise ValueError(f"num_permutations ({num_permutations}) must be a multiple of num_bands ({num_bands})")
+        rng = np.random.default_rng(seed)
+        # a, b < 2**32 and shingle hashes < 2**32 keep a * x + b below 2**64
+        self._a = rng.integers(1, 1 << 32, size=(num_permutations, 1), dtype='uint64')
+        self._b = rng.integers(0, 1 << 32, size=(num_permutations, 1), dtype='uint64')
+        self.threshold = threshold
+        self.num_bands = num_bands
+        self.rows_per_band = num_permutations // num_bands
+        self._buckets = [{} for _ in range(num_bands)]
+        self._keys = []
+        self._signatures = []
+        self.chunks = 0
+        self.duplicates = 0
+        self.seconds = 0.0
+
+    def signature(self, text):
+        hashed = (self._a * shingles(text)[None, :] + self._b) % _MERSENNE_PRIME
+        return (hashed & _MAX_HASH).min(axis=1).astype('uint32')
+
+    def add(self, key, text):
+        started = time.perf_counter()
+        signature = self.signature(text)
+        bands = [
+            signature[band * self.rows_per_band:(band + 1) * self.rows_per_band].tobytes()
+            for band in range(self.num_bands)
+        ]
+        candidates = set()
+        for buckets, band in zip(self._buckets, bands):
+            candidates.update(buckets.get(band, ()))
+
+        canonical, best = None, self.threshold
+        for candidate in candidates:
+            similarity = np.count_nonzero(self._signatures[candidate] == signature) / len(signature)
+            if similarity >= best:
+                canonical, best = candidate, similarity
+
+        self.chunks += 1
+        if canonical is None:
+            position = len(self._keys)
+            self._keys.append(key)
+            self._signatures.append(signature)
+            for buckets, band in zip(self._buckets, bands):
+                buckets.setdefault(band, []).append(position)
+        else:
+            self.duplicates += 1
+        self.seconds += time.perf_counter() - started
+        return None if canonical is None else self._keys[canonical]
+
+    def report(self, seconds_per_chunk=None, bytes_per_vector=None):
+        """
+        Dedup ratio plus the embedding time and vector memory saved, estimated from the measured
+        cost of one embedded chunk and the size of one stored vector.
+        """
+        report = {
+            'chunks': self.chunks,
+            'canonical_chunks': self.chunks - self.duplicates,
+            'duplicates': self.duplicates,
+            'dedup_ratio': self.duplicates / self.chunks if self.chunks else 0.0,
+            'detect_seconds': self.seconds
+        }
+        if seconds_per_chunk is not None:
+            report['embed_seconds_saved'] = self.duplicates * seconds_per_chunk
+        if bytes_per_vector is not None:
+            report['vector_bytes_saved'] = self.duplicates * bytes_per_vector
+        return report
+
+
+def merge_dedup_reports(reports):
+    """
+    Sums per-worker reports (each worker dedups its own rows).
+    """
+    merged = {}
+    for report in reports:
+        for name, value in report.items():
+            if name != 'dedup_ratio':
+                merged[name] = merged.get(name, 0) + value
+    merged['dedup_ratio'] = merged['duplicates'] / merged['chunks'] if merged.get('chunks') else 0.0
+    return merged
+
+
+def format_dedup_report(report):
+    line = (f"Near-duplicates: {report['duplicates']} of {report['chunks']} chunks "
+            f"({report['dedup_ratio']:.1%}) collapsed into {report['canonical_chunks']} canonical vectors")
+    if 'embed_seconds_saved' in report:
+        line += f", ~{report['embed_seconds_saved']:.1f}s of embedding saved"
+    if 'vector_bytes_saved' in report:
+        line += f", {report['vector_bytes_saved'] / 2**20:.1f} MiB of vectors saved"
+    return line + f" (detection took {report['detect_seconds']:.1f}s)."
@@ -0,0 +1,162 @@
+import argparse
+import json
+import os
+import numpy as np
+
+CONFIG_FILE = "onnx_config.json"
+FP32_FILE = "model.onnx"
+INT8_FILE = "model.int8.onnx"
+ONNX_BATCH_SIZE = 64
+
+def default_onnx_model_dir(model_name):
+    """
+    Export directory of model_name: one subdirectory per model under ONNX_MODEL_DIR (default models/onnx),
+    so models exported side by side (e.g. during a reembed_migration.py cutover) never share one.
+    """
+    root = os.environ.get('ONNX_MODEL_DIR') or os.path.join("models", "onnx")
+    return os.path.join(root, model_name.replace('/', '__'))
+
+def import_onnxruntime():
+    """
+    onnxruntime is an optional dependency (requirements-onnx.txt); raises an ImportError saying how
+    to install it instead of a bare ModuleNotFoundError.
+    """
+    try:
+        import onnxruntime
+    except ImportError as e:
+        raise ImportError("The ONNX backend needs onnx and onnxruntime: pip install -r requirements-onnx.txt") from e
+    return onnxruntime
+
+def export_onnx_model(model_name, output_dir, quantize=True, opset_version=14):
+    """
+    Exports the transformer of a SentenceTransformer to ONNX (token embeddings, dynamic batch and
+    sequence axes) and, with quantize=True, an int8 dynamically quantized copy of it. Pooling and
+    normalization are reproduced in numpy by OnnxEmbedder, so the graph stays a plain encoder.
+
+    Writes model.onnx, model.int8.onnx, the tokenizer files and onnx_config.json to output_dir.
+    """
+    import_onnxruntime()
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    st_model = SentenceTransformer(model_name, device='cpu')
+    pooling = [module for module in st_model if type(module).__name__ == 'Pooling']
+    if not pooling or pooling[0].get_pooling_mode_str() != 'mean':
+        raise ValueError(f"Only mean-pooled models can be exported, '{model_name}' uses {pooling[0].get_pooling_mode_str() if pooling else 'no pooling'}")
+    normalize = any(type(module).__name__ == 'Normalize' for module in st_model)
+
+    class TokenEmbeddings(torch.nn.Module):
+        def __init__(self, encoder):
+            super().__init__()
+            self.encoder = encoder
+
+        def forward(self, input_ids, attention_mask, token_type_ids=None):
+            return self.encoder(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids)[0]
+
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = st_model.tokenizer
+    dummy = tokenizer(["시험 문제 예시", "dummy"], padding=True, return_tensors='pt')
+    input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in dummy]
+    fp32_path = os.path.join(output_dir, FP32_FILE)
+    wrapper = TokenEmbeddings(st_model[0].auto_model).eval()
+    with torch.no_grad():
+        torch.onnx.export(
+            wrapper, tuple(dummy[name] for name in input_names), fp32_path,
+            input_names=input_names, output_names=['token_embeddings'],
+            dynamic_axes={name: {0: 'batch', 1: 'sequence'} for name in input_names + ['token_embeddings']},
+            opset_version=opset_version
+        )
+    tokenizer.save_pretrained(output_dir)
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(fp32_path, os.path.join(output_dir, INT8_FILE), weight_type=QuantType.QInt8)
+
+    config = {
+        'model_name': model_name,
+        'dim': st_model.get_sentence_embedding_dimension(),
+        'max_seq_length': st_model.max_seq_length,
+        'normalize': normalize,
+        'quantized': quantize
+    }
+    with open(os.path.join(output_dir, CONFIG_FILE), mode='w', encoding='utf-8') as f:
+        json.dump(config, f, indent=4)
+    return config
+
+class OnnxEmbedder:
+    """
+    CPU inference through onnxruntime for a model exported by export_onnx_model(). Exposes the
+    encode() / get_sentence_embedding_dimension() subset of SentenceTransformer that the rest of
+    the pipeline uses, so it is selected through embedding_model.get_model() (EMBEDDING_BACKEND=onnx).
+
+    Sentences are sorted by length before batching so each batch pads to a similar length.
+    """
+
+    def __init__(self, model_dir, quantized=True, num_threads=None):
+        ort = import_onnxruntime()
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(model_dir, CONFIG_FILE), mode='r', encoding='utf-8') as f:
+            self.config = json.load(f)
+        model_file = INT8_FILE if quantized and self.config.get('quantized') else FP32_FILE
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        num_threads = num_threads if num_threads is not None else int(os.environ.get('ONNX_NUM_THREADS', '0'))
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(os.path.join(model_dir, model_file), options, providers=['CPUExecutionProvider'])
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.model_dir = model_dir
+        self.model_file = model_file
+
+    def get_sentence_embedding_dimension(self):
+        return self.config['dim']
+
+    def _encode_batch(self, sentences):
+        tokens = self.tokenizer(sentences, padding=True, truncation=True, max_length=self.config['max_seq_length'], return_tensors='np')
+        feed = {name: tokens[name].astype('int64') for name in self.input_names}
+        token_embeddings = self.session.run(None, feed)[0]
+        mask = tokens['attention_mask'][:, :, None].astype('float32')
+        embeddings = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.config['normalize']:
+            embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings.astype('float32', copy=False)
+
+    def encode(self, sentences, batch_size=ONNX_BATCH_SIZE, show_progress_bar=None, convert_to_numpy=True, **kwargs):
+        single = isinstance(sentences, str)
+        sentences = [sentences] if single else list(sentences)
+        embeddings = np.zeros((len(sentences), self.config['dim']), dtype='float32')
+        order = np.argsort([-len(sentence) for sentence in sentences], kind='stable')
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            embeddings[rows] = self._encode_batch([sentences[i] for i in rows])
+        return embeddings[0] if single else embeddings
+
+def load_onnx_embedder(model_name, quantized=True):
+    """
+    The int8 (quantized=True) or fp32 OnnxEmbedder for model_name from default_onnx_model_dir(),
+    exporting it there first if needed. Raises ValueError if the directory holds an export of a
+    different model, or has no int8 copy when one is asked for (its vectors would be recorded as int8).
+    """
+    model_dir = default_onnx_model_dir(model_name)
+    if not os.path.exists(os.path.join(model_dir, CONFIG_FILE)):
+        export_onnx_model(model_name, model_dir, quantize=quantized)
+    embedder = OnnxEmbedder(model_dir, quantized=quantized)
+    if embedder.config.get('model_name') != model_name:
+        raise ValueError(f"{model_dir} holds an ONNX export of '{embedder.config.get('model_name')}', not '{model_name}'")
+    if quantized and embedder.model_file != INT8_FILE:
+        raise ValueError(f"{model_dir} has no int8 export of '{model_name}'; re-export it without --no-quantize or set ONNX_QUANTIZED=0")
+    return embedder
+
+if __name__ == "__main__":
+    from embedding_model import MODEL_NAME
+    parser = argparse.ArgumentParser(description="Export the embedding model to ONNX with int8 dynamic quantization.")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--output", help="Output directory (default: <ONNX_MODEL_DIR or models/onnx>/<model>)")
+    parser.add_argument("--no-quantize", action="store_true")
+    args = parser.parse_args()
+
+    config = export_onnx_model(args.model, args.output or default_onnx_model_dir(args.model), quantize=not args.no_quantize)
+    print(f"Exported {config['model_name']} (dim {config['dim']}, max_seq_length {config['max_seq_length']}, "
+          f"{'int8 + fp32' if config['quantized'] else 'fp32'}) to {args.output or default_onnx_model_dir(args.model)}")
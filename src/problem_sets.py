@@ -0,0 +1,91 @@
+import argparse
+import itertools
+import json
+import os
+
+PASSAGE_KIND = 'passage'
+QUESTION_KIND = 'question'
+
+
+def load_problem_sets(path):
+    """
+    Reads the JSON written by scripts/text_parser.py (a list of problem sets with 'passages' and 'questions').
+    """
+    with open(path, mode='r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def question_body(question):
+    """
+    The text embedded for a question: its stem followed by one line per option.
+    """
+    lines = [question.get('question_text') or '']
+    lines.extend(f"{option['label']} {option['content']}" for option in question.get('options', []))
+    return "\n".join(line for line in lines if line)
+
+
+def problem_set_rows(problem_sets, source, attributes=None):
+    """
+    Flattens parsed problem sets into rows for data_processor.py: one row per passage and one per
+    question, so a passage shared by several questions is chunked and embedded once.
+
+    Ids are stable for the same input: <source>-<set>-p<passage> and <source>-<set>-q<number>.
+    Every row carries 'kind', 'problem_set_id' and the given attributes (subject, year, ... see
+    attribute_index.py); question rows list the passages they are about under 'passage_ids'.
+    As in the CSV, 'question_text' holds the text to chunk, the passage content for passage rows.
+    """
+    attributes = attributes or {}
+    for set_index, problem_set in enumerate(problem_sets):
+        set_id = f"{source}-{set_index}"
+        title = problem_set.get('problem_set_title', '')
+        passage_ids = []
+        for passage_index, passage in enumerate(problem_set.get('passages', [])):
+            passage_id = f"{set_id}-p{passage_index}"
+            passage_ids.append(passage_id)
+            yield dict(attributes, id=passage_id, kind=PASSAGE_KIND, problem_set_id=set_id, problem_set_title=title,
+                       label=passage.get('label') or '', question_text=passage['content'])
+        seen_numbers = set()
+        for question_index, question in enumerate(problem_set.get('questions', [])):
+            number = (question.get('number') or '').rstrip('.') or str(question_index + 1)
+            if number in seen_numbers: # A misparsed number must not overwrite an earlier question
+                number = next(f"{number}.{suffix}" for suffix in itertools.count(question_index) if f"{number}.{suffix}" not in seen_numbers)
+            seen_numbers.add(number)
+            yield dict(attributes, id=f"{set_id}-q{number}", kind=QUESTION_KIND, problem_set_id=set_id,
+                       problem_set_title=title, number=number, points=question.get('points') or '',
+                       question_text=question_body(question), passage_ids=passage_ids)
+
+
+def passage_entry(row):
+    """
+    (passage_id, problem_set_id, label, content) if the row is a passage, else None.
+    """
+    if row.get('kind') != PASSAGE_KIND:
+        return None
+    return row['id'], row['problem_set_id'], row['label'], row['question_text']
+
+
+if __name__ == "__main__":
+    from data_processor import GRANULARITIES, process_problem_sets_for_rag
+    from near_duplicates import DEFAULT_THRESHOLD, format_dedup_report
+
+    parser = argparse.ArgumentParser(description="Embed parsed problem sets (scripts/text_parser.py output), each passage once.")
+    parser.add_argument("--input", required=True, help="structured_text.json written by scripts/text_parser.py")
+    parser.add_argument("--output", required=True, help="Embedding store directory, for faiss_indexer.py")
+    parser.add_argument("--source", default=None, help="Id prefix (default: the input file name)")
+    parser.add_argument("--subject", default=None)
+    parser.add_argument("--year", default=None)
+    parser.add_argument("--exam-type", default=None)
+    parser.add_argument("--granularity", choices=GRANULARITIES, default='chunk',
+                        help="Vectors per passage/question: 'chunk' (many small), 'passage_stem' (one each) or 'question' (one per question)")
+    parser.add_argument("--dedup", action="store_true",
+                        help="Embed and index only the first of each group of near-identical chunks (see near_duplicates.py)")
+    parser.add_argument("--dedup-threshold", type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args()
+
+    source = args.source or os.path.splitext(os.path.basename(args.input))[0]
+    attributes = {name: value for name, value in (('subject', args.subject), ('year', args.year), ('exam_type', args.exam_type)) if value}
+    stats = process_problem_sets_for_rag(load_problem_sets(args.input), args.output, source, attributes, dedup=args.dedup,
+                                         dedup_threshold=args.dedup_threshold, granularity=args.granularity)
+    print(f"Embedded {stats['questions']} questions and {stats['passages']} passages ({stats['chunks']} chunks).")
+    if 'dedup' in stats:
+        print(format_dedup_report(stats['dedup']))
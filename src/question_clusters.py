@@ -0,0 +1,76 @@
+import argparse
+import json
+import numpy as np
+from attribute_index import AttributeIndex, normalize_filters
+from faiss_indexer import CHUNK_ID_BITS, attribute_path_for, clusters_path_for
+
+class QuestionClusters:
+    """
+    Read side of the question clustering written by faiss_indexer.py (<index>.clusters.npz).
+
+    sample() draws questions spread over as many clusters (topics) as possible with a few numpy
+    sorts over the assignment array; no FAISS search or embedding runs at request time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with np.load(path) as data:
+            self.question_ids = data['question_ids']
+            self.question_keys = data['question_keys']
+            self.assignments = data['assignments']
+            self.distances = data['distances']
+            self.centroids = data['centroids']
+        self.num_clusters = len(self.centroids)
+
+    def cluster_sizes(self):
+        return np.bincount(self.assignments, minlength=self.num_clusters)
+
+    def sample(self, m, allowed_keys=None, seed=None, central=False):
+        """
+        Draws up to m distinct questions round-robin over the clusters, in random cluster order:
+        one question from each of m clusters when there are at least m, otherwise as evenly as the
+        cluster sizes allow. Within a cluster the question is random, or with central=True the one
+        closest to the centroid (the most typical question of the topic) first.
+
+        allowed_keys (question keys, faiss_id >> CHUNK_ID_BITS) restricts the candidates.
+        Returns [{'original_id', 'cluster'}].
+        """
+        rng = np.random.default_rng(seed)
+        rows = np.arange(len(self.question_ids)) if allowed_keys is None else np.flatnonzero(np.isin(self.question_keys, allowed_keys))
+        if not len(rows) or m <= 0:
+            return []
+        clusters = self.assignments[rows]
+        within = self.distances[rows] if central else rng.random(len(rows))
+        order = np.lexsort((within, clusters))
+        rows, clusters = rows[order], clusters[order]
+        starts = np.flatnonzero(np.r_[True, clusters[1:] != clusters[:-1]])
+        rank = np.arange(len(rows)) - np.repeat(starts, np.diff(np.r_[starts, len(rows)]))
+        cluster_priority = rng.permutation(self.num_clusters)[clusters]
+        picked = np.lexsort((cluster_priority, rank))[:m]
+        return [
+            {'original_id': str(self.question_ids[rows[i]]), 'cluster': int(clusters[i])}
+            for i in picked
+        ]
+
+def question_keys_for(attribute_index, filters):
+    """
+    Question keys admitted by a filters dict (see attribute_index.normalize_filters), or None without filters.
+    """
+    filter_key = normalize_filters(filters)
+    if not filter_key:
+        return None
+    return np.unique(attribute_index.ids_for(filter_key) >> CHUNK_ID_BITS)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Draw questions spread over topic clusters, e.g. to assemble an exam.")
+    parser.add_argument("--index", required=True, help="faiss_index.bin written by faiss_indexer.py")
+    parser.add_argument("--m", type=int, default=20, help="Number of questions")
+    parser.add_argument("--filters", type=json.loads, default=None, help='JSON, e.g. \'{"subject": "국어", "year": [2022, 2023]}\'')
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--central", action="store_true", help="Prefer the most typical question of each cluster")
+    args = parser.parse_args()
+
+    question_clusters = QuestionClusters(clusters_path_for(args.index))
+    allowed_keys = question_keys_for(AttributeIndex(attribute_path_for(args.index)), args.filters) if args.filters else None
+    for question in question_clusters.sample(args.m, allowed_keys, args.seed, args.central):
+        print(f"{question['original_id']}\tcluster {question['cluster']}")
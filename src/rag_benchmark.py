@@ -0,0 +1,630 @@
+import argparse
+import csv
+import json
+import os
+import random
+import secrets
+import subprocess
+import sys
+import time
+import numpy as np
+from chunk_store import ChunkStore
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+from embedding_cache import encode_with_cache
+from embedding_model import MODEL_NAME
+from embedding_store import EmbeddingStore
+from faiss_indexer import (INDEX_TYPES, SHARD_STRATEGIES, apply_search_params, create_and_save_faiss_index,
+                           create_and_save_sharded_index, exact_knn, load_index_params, map_path_for, question_key,
+                           question_keys_of, read_faiss_index, recall_at_k, sample_rows, store_faiss_ids)
+from rag_retriever import RAGRetriever, best_per_question
+
+def read_rss_breakdown():
+    """
+    Returns {'anon': bytes, 'file': bytes} from /proc/self/status (Linux only).
+    RssAnon is memory private to the process; RssFile is page cache shared with other processes.
+    """
+    rss = {'anon': 0, 'file': 0}
+    with open('/proc/self/status', mode='r') as f:
+        for line in f:
+            if line.startswith('RssAnon:'):
+                rss['anon'] = int(line.split()[1]) * 1024
+            elif line.startswith('RssFile:'):
+                rss['file'] = int(line.split()[1]) * 1024
+    return rss
+
+def _measure_index_load(faiss_index_path, index_type, mmap, queries, k):
+    """
+    Runs in a fresh process: loads the index, searches the queries and reports the RSS growth.
+    """
+    before = read_rss_breakdown()
+    started = time.perf_counter()
+    index = read_faiss_index(faiss_index_path, index_type, mmap=mmap)
+    load_seconds = time.perf_counter() - started
+    apply_search_params(index, load_index_params(faiss_index_path).get('search_params'))
+    index.search(queries, k) # Touch the pages a real query load would touch
+    after = read_rss_breakdown()
+    return {
+        'load_seconds': load_seconds,
+        'private_bytes': after['anon'] - before['anon'],
+        'shared_bytes': after['file'] - before['file']
+    }
+
+def index_tradeoff_report(processed_data_path, output_dir, index_types=INDEX_TYPES, k=10, num_queries=500):
+    """
+    Builds every index type from one embedding store and reports, per type: file size, bytes per vector,
+    recall@k against exact search, query latency, and the private/shared memory of a normal load vs
+    a memory-mapped load (each measured in its own process).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    store = EmbeddingStore(processed_data_path)
+    queries, _ = sample_rows(store, min(num_queries, store.count), seed=1234)
+    _, ground_truth_rows = exact_knn(store, queries, k)
+    ground_truth = store_faiss_ids(store)[ground_truth_rows]
+
+    report = []
+    for index_type in index_types:
+        faiss_index_path = os.path.join(output_dir, f"faiss_index_{index_type}.bin")
+        params = create_and_save_faiss_index(processed_data_path, faiss_index_path, index_type, tune_k=k)
+
+        index = read_faiss_index(faiss_index_path)
+        apply_search_params(index, params['search_params'])
+        started = time.perf_counter()
+        _, found = index.search(queries, k)
+        ms_per_query = 1000 * (time.perf_counter() - started) / len(queries)
+        del index
+
+        entry = {
+            'index_type': index_type,
+            'search_params': params['search_params'],
+            'build_seconds': params['build_seconds'],
+            'file_bytes': params['file_bytes'],
+            'bytes_per_vector': params['file_bytes'] / params['ntotal'],
+            'recall_at_k': recall_at_k(ground_truth, found),
+            'ms_per_query': ms_per_query
+        }
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            entry['memory_ram_load'] = executor.submit(_measure_index_load, faiss_index_path, index_type, False, queries, k).result()
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            entry['memory_mmap_load'] = executor.submit(_measure_index_load, faiss_index_path, index_type, True, queries, k).result()
+        report.append(entry)
+    return {'k': k, 'num_vectors': store.count, 'dim': store.dim, 'indexes': report}
+
+def print_index_tradeoff_report(report):
+    print(f"{report['num_vectors']} vectors, dim {report['dim']}, recall@{report['k']}")
+    print(f"{'type':<7}{'bytes/vec':>10}{'recall':>8}{'ms/q':>8}{'ram MB':>9}{'mmap private MB':>17}{'mmap shared MB':>16}")
+    for entry in report['indexes']:
+        ram = entry['memory_ram_load']
+        mapped = entry['memory_mmap_load']
+        print(f"{entry['index_type']:<7}{entry['bytes_per_vector']:>10.1f}{entry['recall_at_k']:>8.3f}"
+              f"{entry['ms_per_query']:>8.3f}{ram['private_bytes'] / 2**20:>9.1f}"
+              f"{mapped['private_bytes'] / 2**20:>17.1f}{mapped['shared_bytes'] / 2**20:>16.1f}")
+
+def load_benchmark_queries(faiss_map_path, queries_file=None, num_queries=200):
+    """
+    Queries from a file (one per line), or random chunk texts from the chunk store.
+    """
+    if queries_file:
+        with open(queries_file, mode='r', encoding='utf-8') as f:
+            return [line.strip() for line in f if line.strip()][:num_queries]
+    chunk_store = ChunkStore(faiss_map_path, readonly=True)
+    try:
+        return chunk_store.sample_chunk_texts(num_queries)
+    finally:
+        chunk_store.close()
+
+def batch_retrieval_benchmark(retriever, queries, k=3, batch_size=64, repeats=3):
+    """
+    Queries/sec of a retrieve() loop vs retrieve_batch() over the same queries (best of `repeats`).
+    Construct the retriever without an embedding cache or query/result caches, otherwise repeats
+    measure cache hits.
+    """
+    retriever.retrieve_batch(queries[:batch_size], k) # Warm up the model and the index pages
+
+    loop_seconds = []
+    batch_seconds = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        for query in queries:
+            retriever.retrieve(query, k)
+        loop_seconds.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        for start in range(0, len(queries), batch_size):
+            retriever.retrieve_batch(queries[start:start + batch_size], k)
+        batch_seconds.append(time.perf_counter() - started)
+
+    loop_qps = len(queries) / min(loop_seconds)
+    batch_qps = len(queries) / min(batch_seconds)
+    return {
+        'num_queries': len(queries),
+        'k': k,
+        'batch_size': batch_size,
+        'loop_qps': loop_qps,
+        'batch_qps': batch_qps,
+        'speedup': batch_qps / loop_qps
+    }
+
+STARTUP_MODULES = ('munjero_rag_system.app', 'rag_retriever', 'retrieval_service')
+
+def import_time_report(module, top=10):
+    """
+    Imports the module in a fresh interpreter under `python -X importtime` and breaks the cost down
+    by top-level package (own import time of every module, summed per package).
+    """
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [src_dir, os.environ.get('PYTHONPATH')])))
+    started = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                               env=env, capture_output=True, text=True)
+    wall_seconds = time.perf_counter() - started
+    if completed.returncode != 0:
+        return {'module': module, 'error': completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else 'failed'}
+
+    by_package = {}
+    import_us = 0
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        if not self_us.strip().isdigit():
+            continue # Header line
+        if name.strip() == module:
+            import_us = int(cumulative_us)
+        # Self times add up to the total without double counting nested imports
+        package = name.strip().split('.')[0]
+        by_package[package] = by_package.get(package, 0) + int(self_us)
+    slowest = sorted(by_package.items(), key=lambda item: -item[1])[:top]
+    return {
+        'module': module,
+        'wall_seconds': wall_seconds,
+        'import_seconds': import_us / 1e6,
+        'slowest_packages': [{'package': package, 'seconds': us / 1e6} for package, us in slowest]
+    }
+
+def _measure_model_load():
+    """
+    Runs in a fresh process: cost of importing the model stack, loading the weights and the first encode.
+    """
+    started = time.perf_counter()
+    from embedding_model import get_model, model_load_seconds, warm_up
+    module_seconds = time.perf_counter() - started
+    get_model()
+    load_seconds = model_load_seconds()
+    return {
+        'embedding_model_import_seconds': module_seconds,
+        'model_load_seconds': load_seconds, # Includes importing sentence_transformers/torch
+        'first_encode_seconds': warm_up()
+    }
+
+def startup_time_report(modules=STARTUP_MODULES, budget_seconds=1.0):
+    """
+    Import cost of each app entry module (nothing should load the model at import time any more),
+    plus what the deferred model load costs when it does happen.
+    """
+    imports = [import_time_report(module) for module in modules]
+    for entry in imports:
+        if 'import_seconds' in entry:
+            entry['within_budget'] = entry['import_seconds'] <= budget_seconds
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+        model_load = executor.submit(_measure_model_load).result()
+    return {'budget_seconds': budget_seconds, 'imports': imports, 'model_load': model_load}
+
+def print_startup_time_report(report):
+    for entry in report['imports']:
+        if 'error' in entry:
+            print(f"{entry['module']}: import failed ({entry['error']})")
+            continue
+        verdict = 'ok' if entry['within_budget'] else f"OVER the {report['budget_seconds']:.1f}s budget"
+        print(f"{entry['module']}: {entry['import_seconds']:.3f}s import, {entry['wall_seconds']:.3f}s interpreter wall ({verdict})")
+        for package in entry['slowest_packages']:
+            print(f"    {package['package']:<30}{package['seconds']:>8.3f}s")
+    model_load = report['model_load']
+    print(f"Model (deferred): load {model_load['model_load_seconds']:.2f}s, first encode {model_load['first_encode_seconds']:.2f}s")
+
+def load_corpus_texts(csv_file_path, num_texts=2000):
+    """
+    The first num_texts chunks of the question CSV, chunked exactly as data_processor.py does for ingestion.
+    """
+    from data_processor import create_text_splitter, iter_chunked_rows
+    texts = []
+    for _, _, chunks in iter_chunked_rows(csv_file_path, create_text_splitter()):
+        texts.extend(chunks)
+        if len(texts) >= num_texts:
+            break
+    return texts[:num_texts]
+
+def _sentences_per_second(model, texts, batch_size, repeats):
+    model.encode(texts[:batch_size], batch_size=batch_size) # Warm up
+    best = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        embeddings = model.encode(texts, batch_size=batch_size)
+        seconds = time.perf_counter() - started
+        best = seconds if best is None else min(best, seconds)
+    return len(texts) / best, np.asarray(embeddings, dtype='float32')
+
+def onnx_parity_benchmark(texts, model_name=MODEL_NAME, onnx_model_dir=None, quantized=True, batch_size=64, repeats=3, k=10):
+    """
+    Throughput of the PyTorch SentenceTransformer vs the ONNX backend (onnx_embedder.py) on the same
+    texts, and how closely the ONNX vectors agree: per-text cosine similarity with the PyTorch vector,
+    and the overlap of each text's k nearest neighbours among the texts under both backends.
+    """
+    from sentence_transformers import SentenceTransformer
+    from onnx_embedder import CONFIG_FILE, OnnxEmbedder, default_onnx_model_dir, export_onnx_model
+
+    onnx_model_dir = onnx_model_dir or default_onnx_model_dir(model_name)
+    if not os.path.exists(os.path.join(onnx_model_dir, CONFIG_FILE)):
+        export_onnx_model(model_name, onnx_model_dir)
+    torch_qps, torch_embeddings = _sentences_per_second(SentenceTransformer(model_name, device='cpu'), texts, batch_size, repeats)
+    onnx_model = OnnxEmbedder(onnx_model_dir, quantized=quantized)
+    onnx_qps, onnx_embeddings = _sentences_per_second(onnx_model, texts, batch_size, repeats)
+
+    norms = np.linalg.norm(torch_embeddings, axis=1) * np.linalg.norm(onnx_embeddings, axis=1)
+    cosine = np.sum(torch_embeddings * onnx_embeddings, axis=1) / np.clip(norms, 1e-12, None)
+
+    k = min(k, len(texts) - 1)
+    def neighbours(embeddings):
+        similarities = embeddings @ embeddings.T
+        np.fill_diagonal(similarities, -np.inf)
+        return np.argsort(-similarities, axis=1)[:, :k]
+    overlap = [
+        len(set(a) & set(b)) / k for a, b in zip(neighbours(torch_embeddings).tolist(), neighbours(onnx_embeddings).tolist())
+    ] if k > 0 else [1.0]
+
+    return {
+        'model_name': model_name,
+        'onnx_model_file': onnx_model.model_file,
+        'num_texts': len(texts),
+        'batch_size': batch_size,
+        'torch_sentences_per_second': torch_qps,
+        'onnx_sentences_per_second': onnx_qps,
+        'speedup': onnx_qps / torch_qps,
+        'cosine_mean': float(np.mean(cosine)),
+        'cosine_min': float(np.min(cosine)),
+        'cosine_p01': float(np.percentile(cosine, 1)),
+        f'neighbor_overlap_at_{k}': float(np.mean(overlap))
+    }
+
+def latency_percentiles(seconds):
+    milliseconds = 1000 * np.asarray(seconds)
+    return {f'p{p}_ms': float(np.percentile(milliseconds, p)) for p in (50, 95, 99)}
+
+def shard_scaling_benchmark(processed_data_path, output_dir, shard_counts=(1, 2, 4), shard_by='hash', index_type='flat',
+                            k=10, num_queries=200, concurrency=8, remote=False):
+    """
+    Builds the store into 1, 2, 4, ... shards and measures scatter-gather search on each: single-query
+    latency percentiles and throughput with `concurrency` client threads. Queries are vectors sampled
+    from the store, so the numbers exclude the transformer. With remote=True every shard runs as a
+    local shard server (the stand-in for separate hosts) instead of a worker process.
+    """
+    from shard_search import ShardedRetriever, start_local_shard_servers
+
+    store = EmbeddingStore(processed_data_path)
+    queries, _ = sample_rows(store, min(num_queries, store.count), seed=4321)
+    report = []
+    for num_shards in shard_counts:
+        sharded_dir = os.path.join(output_dir, f"shards-{num_shards}")
+        started = time.perf_counter()
+        manifest = create_and_save_sharded_index(processed_data_path, sharded_dir, num_shards, shard_by, index_type, tune_k=k)
+        build_seconds = time.perf_counter() - started
+
+        servers = []
+        addresses = None
+        authkey = secrets.token_bytes(32) # Servers and client live in this run only
+        if remote:
+            servers, addresses = start_local_shard_servers(sharded_dir, authkey, base_port=6100 + 10 * num_shards)
+        try:
+            with ShardedRetriever(sharded_dir, remote_addresses=addresses, authkey=authkey) as retriever:
+                retriever.search_vectors(queries[:1], k) # Wait for every shard to load
+
+                latencies = []
+                for row in range(len(queries)):
+                    started = time.perf_counter()
+                    retriever.search_vectors(queries[row:row + 1], k)
+                    latencies.append(time.perf_counter() - started)
+
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                    list(executor.map(lambda row: retriever.search_vectors(queries[row:row + 1], k), range(len(queries))))
+                concurrent_qps = len(queries) / (time.perf_counter() - started)
+        finally:
+            for server in servers:
+                server.terminate()
+
+        entry = {
+            'num_shards': len(manifest['shards']),
+            'shard_sizes': [shard['ntotal'] for shard in manifest['shards']],
+            'build_seconds': build_seconds,
+            'sequential_qps': len(queries) / sum(latencies),
+            'concurrent_qps': concurrent_qps
+        }
+        entry.update(latency_percentiles(latencies))
+        report.append(entry)
+    return {'index_type': index_type, 'shard_by': shard_by, 'k': k, 'concurrency': concurrency,
+            'remote': remote, 'num_vectors': store.count, 'shards': report}
+
+SYNTHETIC_SUBJECTS = {
+    '국어': ('화자', '정서', '시어', '서술자', '갈등', '인물', '주제', '표현', '운율', '비유', '독서', '논지'),
+    '경제': ('수요', '공급', '가격', '균형', '소비자', '생산자', '세금', '환율', '물가', '금리', '시장', '효용'),
+    '법': ('헌법', '민법', '국회', '대통령', '판례', '계약', '기본권', '법원', '소송', '권리', '의무', '조약'),
+    '과학': ('물리', '화학', '생명', '에너지', '전자', '반응', '세포', '유전', '속력', '온도', '압력', '원소')
+}
+SYNTHETIC_STEMS = (
+    '윗글에 대한 설명으로 가장 적절한 것은?',
+    '윗글의 내용과 일치하지 않는 것은?',
+    '<보기>를 참고하여 윗글을 이해한 내용으로 적절하지 않은 것은?',
+    '㉠에 대한 이해로 가장 적절한 것은?',
+    '다음 자료에 대한 분석으로 옳은 것은?'
+)
+
+def _particle(word, with_final, without_final):
+    # Korean particles depend on whether the last syllable ends in a consonant (은/는, 과/와)
+    code = ord(word[-1]) - 0xAC00
+    return with_final if 0 <= code < 11172 and code % 28 else without_final
+
+def _synthetic_sentence(rng, words):
+    picked = rng.sample(words, 4)
+    return (f"{picked[0]}{_particle(picked[0], '은', '는')} {picked[1]}{_particle(picked[1], '과', '와')} 관련되며, "
+            f"{picked[2]}의 변화는 {picked[3]}에 영향을 준다.")
+
+def generate_synthetic_corpus(csv_file_path, num_rows, questions_per_passage=3, seed=0):
+    """
+    Writes a question CSV shaped like data/data.csv (id, question_text and the filter attributes)
+    with num_rows synthetic Korean questions: consecutive groups of questions_per_passage share a
+    passage, followed by their own stem and five options, so chunking, near-duplicate collapsing
+    and filters all see realistic input. Deterministic for a seed.
+    """
+    rng = random.Random(seed)
+    subjects = list(SYNTHETIC_SUBJECTS)
+    with open(csv_file_path, mode='w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['id', 'question_text', 'subject', 'year', 'exam_type', 'difficulty'])
+        writer.writeheader()
+        for row in range(num_rows):
+            if row % questions_per_passage == 0:
+                subject = rng.choice(subjects)
+                words = SYNTHETIC_SUBJECTS[subject]
+                passage = " ".join(_synthetic_sentence(rng, words) for _ in range(rng.randint(4, 20)))
+                attributes = {'subject': subject, 'year': str(rng.randint(2015, 2024)),
+                              'exam_type': rng.choice(('수능', '모의평가', '학력평가')), 'difficulty': rng.choice(('상', '중', '하'))}
+            options = "\n".join(f"{label} {_synthetic_sentence(rng, words)}" for label in ('①', '②', '③', '④', '⑤'))
+            question_text = f"{passage}\n\n{row % questions_per_passage + 1}. {rng.choice(SYNTHETIC_STEMS)}\n{options}"
+            writer.writerow(dict(attributes, id=f"synthetic-{row}", question_text=question_text))
+    return csv_file_path
+
+def _measure_retriever_startup(faiss_index_path, mmap):
+    """
+    Runs in a fresh process: time to construct a RAGRetriever (index, chunk store, side files) and
+    for the first query through warm_up(), which includes loading the model.
+    """
+    started = time.perf_counter()
+    retriever = RAGRetriever(faiss_index_path, map_path_for(faiss_index_path), mmap=mmap)
+    load_seconds = time.perf_counter() - started
+    warm_up_seconds = retriever.warm_up()
+    retriever.close()
+    return {'load_seconds': load_seconds, 'first_query_seconds': warm_up_seconds, 'ready_seconds': load_seconds + warm_up_seconds}
+
+def concurrent_latency_benchmark(retriever, queries, k=3, concurrency_levels=(1, 4, 16)):
+    """
+    Per-query latency percentiles and throughput of retrieve() with 1, 4, 16, ... client threads
+    sharing one retriever, every query timed from submit to result.
+    Construct the retriever without caches, otherwise the numbers measure cache hits.
+    """
+    def timed_retrieve(query):
+        started = time.perf_counter()
+        retriever.retrieve(query, k)
+        return time.perf_counter() - started
+
+    report = []
+    for concurrency in concurrency_levels:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencies = list(executor.map(timed_retrieve, queries))
+        entry = {'concurrency': concurrency, 'qps': len(queries) / (time.perf_counter() - started)}
+        entry.update(latency_percentiles(latencies))
+        report.append(entry)
+    return report
+
+def retrieval_recall(retriever, store, queries, k=10):
+    """
+    Recall@k of the index against exact search over the embedding store, for the embedded queries:
+    'chunk' compares the raw FAISS neighbours, 'question' compares the distinct questions returned
+    by the retriever with the best-per-question reduction of the exact overfetch * k neighbours.
+    """
+    query_embeddings = encode_with_cache(retriever.model, queries, retriever.model_id)
+    faiss_ids = store_faiss_ids(store)
+    pool = k * max(1, retriever.overfetch)
+    exact_distances, exact_rows = exact_knn(store, query_embeddings, pool)
+    exact_ids = np.where(exact_rows >= 0, faiss_ids[np.clip(exact_rows, 0, None)], -1)
+
+    _, found_ids = retriever.index.search(query_embeddings, k)
+    _, best_ids, _ = best_per_question(exact_distances, exact_ids, k)
+    truth_questions = np.where(best_ids >= 0, question_keys_of(best_ids), -1)
+    found_questions = np.array([
+        [question_key(hit['original_id']) for hit in hits] + [-1] * (k - len(hits))
+        for hits in retriever.search_vectors(query_embeddings, k)
+    ], dtype='int64')
+    return {
+        'chunk_recall_at_k': recall_at_k(exact_ids[:, :k], found_ids),
+        'question_recall_at_k': recall_at_k(truth_questions, found_questions)
+    }
+
+def rag_pipeline_benchmark(csv_file_path, output_dir, index_type='flat', k=10, num_queries=200,
+                           concurrency_levels=(1, 4, 16), num_workers=1, granularity='chunk', mmap=False, dedup=False):
+    """
+    End-to-end numbers for the RAG path on one CSV: ingest rate through process_data_for_rag,
+    index build time, retriever startup in a fresh process, retrieve() latency percentiles at
+    each concurrency level and recall@k against exact search. Queries are random chunk texts.
+    Disable the embedding cache (EMBEDDING_CACHE_PATH='') so repeated runs re-embed.
+    """
+    from data_processor import process_data_for_rag
+    from embedding_model import get_model
+
+    store_dir = os.path.join(output_dir, "embeddings")
+    faiss_index_path = os.path.join(output_dir, f"faiss_index_{index_type}.bin")
+    os.makedirs(output_dir, exist_ok=True)
+
+    if num_workers <= 1:
+        get_model() # Ingest rate excludes the model load; workers load their own and report it
+    started = time.perf_counter()
+    ingest_stats = process_data_for_rag(csv_file_path, store_dir, num_workers=num_workers, dedup=dedup, granularity=granularity)
+    ingest_seconds = time.perf_counter() - started
+    ingest = {
+        'rows': ingest_stats['rows'],
+        'chunks': ingest_stats['chunks'],
+        'embedded_chunks': ingest_stats['embedded_chunks'],
+        'seconds': ingest_seconds,
+        'rows_per_second': ingest_stats['rows'] / ingest_seconds,
+        'chunks_per_second': ingest_stats['chunks'] / ingest_seconds
+    }
+    if 'dedup' in ingest_stats:
+        ingest['dedup_ratio'] = ingest_stats['dedup']['dedup_ratio']
+
+    started = time.perf_counter()
+    params = create_and_save_faiss_index(store_dir, faiss_index_path, index_type, tune_k=k)
+    build = {'seconds': time.perf_counter() - started, 'ntotal': params['ntotal'], 'file_bytes': params['file_bytes'],
+             'search_params': params['search_params']}
+
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+        startup = executor.submit(_measure_retriever_startup, faiss_index_path, mmap).result()
+
+    retriever = RAGRetriever(faiss_index_path, map_path_for(faiss_index_path), mmap=mmap,
+                             query_cache_size=0, result_cache_size=0)
+    try:
+        queries = load_benchmark_queries(map_path_for(faiss_index_path), num_queries=num_queries)
+        retriever.warm_up(queries[:8])
+        latency = concurrent_latency_benchmark(retriever, queries, k, concurrency_levels)
+        recall = retrieval_recall(retriever, EmbeddingStore(store_dir), queries, k)
+    finally:
+        retriever.close()
+
+    return {
+        'model_name': params.get('model_name'),
+        'index_type': index_type,
+        'granularity': granularity,
+        'k': k,
+        'num_queries': len(queries),
+        'num_workers': num_workers,
+        'mmap': mmap,
+        'dedup': dedup,
+        'ingest': ingest,
+        'build': build,
+        'startup': startup,
+        'latency': latency,
+        'recall': recall
+    }
+
+def print_rag_pipeline_report(report):
+    ingest = report['ingest']
+    print(f"Ingest: {ingest['rows']} rows, {ingest['chunks']} chunks in {ingest['seconds']:.1f}s "
+          f"({ingest['rows_per_second']:.1f} rows/s, {ingest['chunks_per_second']:.1f} chunks/s)")
+    print(f"Build ({report['index_type']}): {report['build']['ntotal']} vectors in {report['build']['seconds']:.1f}s")
+    startup = report['startup']
+    print(f"Startup: load {startup['load_seconds']:.2f}s, first query {startup['first_query_seconds']:.2f}s")
+    print(f"{'clients':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'q/s':>9}")
+    for entry in report['latency']:
+        print(f"{entry['concurrency']:>7}{entry['p50_ms']:>9.2f}{entry['p95_ms']:>9.2f}{entry['p99_ms']:>9.2f}{entry['qps']:>9.1f}")
+    recall = report['recall']
+    print(f"Recall@{report['k']}: chunks {recall['chunk_recall_at_k']:.3f}, questions {recall['question_recall_at_k']:.3f}")
+
+if __name__ == "__main__":
+    from data_processor import GRANULARITIES
+
+    parser = argparse.ArgumentParser(description="Benchmarks for the RAG pipeline.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    tradeoffs = subparsers.add_parser("index-tradeoffs", help="Memory/recall tradeoff of every index type")
+    tradeoffs.add_argument("--input", required=True, help="Embedding store written by data_processor.py")
+    tradeoffs.add_argument("--output-dir", required=True)
+    tradeoffs.add_argument("--index-types", nargs="+", choices=INDEX_TYPES, default=list(INDEX_TYPES))
+    tradeoffs.add_argument("--k", type=int, default=10)
+    tradeoffs.add_argument("--json", help="Also write the report to this file")
+
+    batch = subparsers.add_parser("batch-retrieval", help="retrieve() loop vs retrieve_batch() throughput")
+    batch.add_argument("--index", required=True, help="faiss_index.bin built by faiss_indexer.py")
+    batch.add_argument("--queries-file", help="One query per line (default: random chunk texts)")
+    batch.add_argument("--num-queries", type=int, default=200)
+    batch.add_argument("--batch-size", type=int, default=64)
+    batch.add_argument("--k", type=int, default=3)
+    batch.add_argument("--json", help="Also write the report to this file")
+
+    startup = subparsers.add_parser("startup-time", help="Import-time breakdown of the app entry modules and model load cost")
+    startup.add_argument("--modules", nargs="+", default=list(STARTUP_MODULES))
+    startup.add_argument("--budget-seconds", type=float, default=1.0)
+    startup.add_argument("--json", help="Also write the report to this file")
+
+    parity = subparsers.add_parser("onnx-parity", help="PyTorch vs quantized ONNX embedding speed and agreement")
+    parity.add_argument("--csv", required=True, help="Question CSV; its chunks are the benchmark texts")
+    parity.add_argument("--num-texts", type=int, default=2000)
+    parity.add_argument("--onnx-model-dir", help="Exported model (default: <ONNX_MODEL_DIR or models/onnx>/<model>; exported if missing)")
+    parity.add_argument("--fp32", action="store_true", help="Compare the unquantized ONNX model instead")
+    parity.add_argument("--batch-size", type=int, default=64)
+    parity.add_argument("--json", help="Also write the report to this file")
+
+    sharding = subparsers.add_parser("shard-scaling", help="Scatter-gather latency/throughput as the shard count grows")
+    sharding.add_argument("--input", required=True, help="Embedding store written by data_processor.py")
+    sharding.add_argument("--output-dir", required=True)
+    sharding.add_argument("--shard-counts", type=int, nargs="+", default=[1, 2, 4])
+    sharding.add_argument("--shard-by", choices=SHARD_STRATEGIES, default="hash")
+    sharding.add_argument("--index-type", choices=INDEX_TYPES, default="flat")
+    sharding.add_argument("--k", type=int, default=10)
+    sharding.add_argument("--num-queries", type=int, default=200)
+    sharding.add_argument("--concurrency", type=int, default=8)
+    sharding.add_argument("--remote", action="store_true", help="Serve shards through local shard servers")
+    sharding.add_argument("--json", help="Also write the report to this file")
+
+    pipeline = subparsers.add_parser("rag-pipeline", help="End-to-end ingest, build, startup, latency and recall")
+    pipeline.add_argument("--csv", help="Question CSV (default: a synthetic Korean corpus of --num-rows questions)")
+    pipeline.add_argument("--num-rows", type=int, default=5000)
+    pipeline.add_argument("--output-dir", required=True)
+    pipeline.add_argument("--index-type", choices=INDEX_TYPES, default="flat")
+    pipeline.add_argument("--granularity", choices=GRANULARITIES, default="chunk")
+    pipeline.add_argument("--num-workers", type=int, default=1)
+    pipeline.add_argument("--k", type=int, default=10)
+    pipeline.add_argument("--num-queries", type=int, default=200)
+    pipeline.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    pipeline.add_argument("--mmap", action="store_true")
+    pipeline.add_argument("--dedup", action="store_true", help="Collapse near-duplicate chunks during ingest")
+    pipeline.add_argument("--json", help="Also write the report to this file")
+
+    args = parser.parse_args()
+    if args.command == "rag-pipeline":
+        os.environ['EMBEDDING_CACHE_PATH'] = '' # Measure the model, not the embedding cache
+        csv_file_path = args.csv
+        if not csv_file_path:
+            os.makedirs(args.output_dir, exist_ok=True)
+            csv_file_path = generate_synthetic_corpus(os.path.join(args.output_dir, "synthetic.csv"), args.num_rows)
+        result = rag_pipeline_benchmark(csv_file_path, args.output_dir, args.index_type, args.k, args.num_queries,
+                                        args.concurrency, args.num_workers, args.granularity, args.mmap, args.dedup)
+        result['csv'] = csv_file_path
+        print_rag_pipeline_report(result)
+    elif args.command == "shard-scaling":
+        result = shard_scaling_benchmark(args.input, args.output_dir, args.shard_counts, args.shard_by, args.index_type,
+                                         args.k, args.num_queries, args.concurrency, args.remote)
+        print(f"{result['num_vectors']} vectors, {result['index_type']}, k={result['k']}, {result['concurrency']} clients")
+        print(f"{'shards':>6}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'seq q/s':>10}{'conc q/s':>10}{'build s':>9}")
+        for entry in result['shards']:
+            print(f"{entry['num_shards']:>6}{entry['p50_ms']:>9.2f}{entry['p95_ms']:>9.2f}{entry['p99_ms']:>9.2f}"
+                  f"{entry['sequential_qps']:>10.1f}{entry['concurrent_qps']:>10.1f}{entry['build_seconds']:>9.1f}")
+    elif args.command == "onnx-parity":
+        result = onnx_parity_benchmark(load_corpus_texts(args.csv, args.num_texts), onnx_model_dir=args.onnx_model_dir,
+                                       quantized=not args.fp32, batch_size=args.batch_size)
+        print(f"{result['num_texts']} texts: torch {result['torch_sentences_per_second']:.1f}/s, "
+              f"onnx ({result['onnx_model_file']}) {result['onnx_sentences_per_second']:.1f}/s, {result['speedup']:.2f}x; "
+              f"cosine mean {result['cosine_mean']:.4f}, min {result['cosine_min']:.4f}")
+    elif args.command == "startup-time":
+        result = startup_time_report(args.modules, args.budget_seconds)
+        print_startup_time_report(result)
+    elif args.command == "batch-retrieval":
+        os.environ['EMBEDDING_CACHE_PATH'] = '' # Measure the model, not the embedding cache
+        retriever = RAGRetriever(args.index, map_path_for(args.index), query_cache_size=0, result_cache_size=0)
+        queries = load_benchmark_queries(map_path_for(args.index), args.queries_file, args.num_queries)
+        result = batch_retrieval_benchmark(retriever, queries, args.k, args.batch_size)
+        print(f"{result['num_queries']} queries, k={result['k']}: loop {result['loop_qps']:.1f} q/s, "
+              f"batch({result['batch_size']}) {result['batch_qps']:.1f} q/s, {result['speedup']:.1f}x")
+    elif args.command == "index-tradeoffs":
+        result = index_tradeoff_report(args.input, args.output_dir, args.index_types, args.k)
+        print_index_tradeoff_report(result)
+    if args.json:
+        with open(args.json, mode='w', encoding='utf-8') as f:
+            json.dump(result, f, indent=4)
@@ -1,38 +1,584 @@
-import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 import faiss
-from sentence_transformers import SentenceTransformer
 import numpy as np
+from embedding_cache import encode_with_cache, get_default_cache, normalize_text
+from embedding_model import embedding_model_id, get_model_for_id
+from faiss_indexer import (CHUNK_ID_BITS, apply_search_params, attribute_path_for, clusters_path_for, filtered_search,
+                           lexical_path_for, load_index_params, read_faiss_index, related_path_for, search_with_selector)
+from attribute_index import AttributeIndex, normalize_filters
+from chunk_store import ChunkStore
+from lexical_index import LexicalIndex, reciprocal_rank_fusion, weighted_score_fusion
+from question_clusters import QuestionClusters, question_keys_for
+from related_questions import RelatedQuestions
+
+RETRIEVAL_MODES = ('vector', 'lexical', 'hybrid')
+FUSION_METHODS = ('rrf', 'weighted')
+
+class LRUCache:
+    """
+    Small thread-safe LRU map with hit/miss counters.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+def best_per_question(distances, indices, k):
+    """
+    Max-sim aggregation of a chunk-level search result: keeps the closest chunk of every question
+    (chunks share the question key, faiss_id >> CHUNK_ID_BITS) and the k closest questions per row.
+    Rows must be sorted by distance, as FAISS returns them. Returns (distances, indices) padded with
+    inf/-1 like a FAISS result, plus the number of distinct questions each row held. One stable sort
+    over the whole batch finds each question's first (closest) hit; no per-query Python loop.
+    """
+    num_queries, pool = indices.shape
+    flat_ids = indices.ravel()
+    positions = np.flatnonzero(flat_ids != -1)
+    rows = positions // pool
+    keys = flat_ids[positions] >> CHUNK_ID_BITS
+
+    order = np.lexsort((keys, rows)) # Stable: within a question the closest hit stays first
+    rows, keys = rows[order], keys[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (rows[1:] != rows[:-1]) | (keys[1:] != keys[:-1])
+    positions = np.sort(positions[order[first]]) # Back to row-major, distance order
+    rows = positions // pool
+    rank = np.arange(len(positions)) - np.searchsorted(rows, rows)
+    keep = rank < k
+    best_distances = np.full((num_queries, k), np.inf, dtype='float32')
+    best_indices = np.full((num_queries, k), -1, dtype='int64')
+    best_distances[rows[keep], rank[keep]] = distances.ravel()[positions[keep]]
+    best_indices[rows[keep], rank[keep]] = flat_ids[positions[keep]]
+    return best_distances, best_indices, np.bincount(rows, minlength=num_queries)
+
+def distinct_question_hits(hits, k):
+    """
+    The first (best ranked) hit of every question in a [(faiss_id, distance, score)] list, up to k.
+    """
+    seen = set()
+    distinct = []
+    for hit in hits:
+        key = hit[0] >> CHUNK_ID_BITS
+        if key not in seen:
+            seen.add(key)
+            distinct.append(hit)
+            if len(distinct) == k:
+                break
+    return distinct
+
+def index_file_version(faiss_index_path):
+    """
+    Identifies one build of an index file; changes whenever the file is rebuilt or updated
+    (writes go through a rename, so the inode/mtime always change).
+    """
+    stat = os.stat(faiss_index_path)
+    return f"{stat.st_ino}-{stat.st_mtime_ns}-{stat.st_size}"
+
+class _LoadedIndex:
+    """
+    Everything one build of the index file was loaded into. A reload replaces the whole set;
+    requests lease the set they started on, and it is closed once retired and no longer leased.
+    """
+
+    def __init__(self, faiss_index_path, faiss_map_path, mmap):
+        self.index_version = index_file_version(faiss_index_path)
+        self.index_params = load_index_params(faiss_index_path)
+        # Queries are embedded with the model the index was built with (older indexes: the configured one)
+        self.model_id = self.index_params.get('model_name') or embedding_model_id()
+        # One vector per question needs no per-question aggregation (older indexes were chunked)
+        self.granularity = self.index_params.get('granularity') or 'chunk'
+        index = read_faiss_index(faiss_index_path, self.index_params.get('index_type'), mmap=mmap)
+        # nprobe/efSearch chosen by the auto-tuner in faiss_indexer.py
+        apply_search_params(index, self.index_params.get('search_params'))
+        self.index = index
+        # faiss_map_path is the SQLite chunk store (faiss_index.bin.map.db); rows are read per query
+        self.chunk_store = ChunkStore(faiss_map_path, readonly=True)
+        lexical_path = lexical_path_for(faiss_index_path)
+        self.lexical_index = LexicalIndex(lexical_path) if os.path.exists(lexical_path) else None
+        attribute_path = attribute_path_for(faiss_index_path)
+        self.attribute_index = AttributeIndex(attribute_path) if os.path.exists(attribute_path) else None
+        related_path = related_path_for(faiss_index_path)
+        self.related = RelatedQuestions(related_path) if os.path.exists(related_path) else None
+        clusters_path = clusters_path_for(faiss_index_path)
+        self.question_clusters = QuestionClusters(clusters_path) if os.path.exists(clusters_path) else None
+        self.active_requests = 0
+        self.retired = False
+        self.closed = False
+
+    def close(self):
+        """
+        Closes the chunk store connection and drops the index and memory-mapped arrays.
+        """
+        self.closed = True
+        self.chunk_store.close()
+        self.index = None
+        self.lexical_index = None
+        self.attribute_index = None
+        self.related = None
+        self.question_clusters = None
 
 class RAGRetriever:
-    def __init__(self, faiss_index_path, faiss_map_path):
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
-        self.index = faiss.read_index(faiss_index_path)
-        with open(faiss_map_path, mode='r', encoding='utf-8') as f:
-            self.faiss_map = json.load(f)
+    def __init__(self, faiss_index_path, faiss_map_path, embedding_cache=None, mmap=False,
+                 query_cache_size=10000, result_cache_size=10000, index_check_interval=5.0,
+                 mode='vector', fusion='rrf', vector_weight=0.5, prefilter=False, candidate_pool=200,
+                 filter_cache_size=256, distinct_questions=True, overfetch=4):
+        """
+        With mmap=True the index is memory-mapped read-only instead of copied into RAM, so all
+        retriever processes on a host share one copy (pairs well with the compressed 'ivfpq'/'sq8' builds).
+
+        Repeated queries are served from two in-process LRU caches: normalized query -> embedding,
+        and (normalized query, k, index version) -> results. The index file is checked at most every
+        index_check_interval seconds; when it was rebuilt it is reloaded and the version changes, so
+        stale results can never be returned.
+
+        mode selects the score source: 'vector' (FAISS only), 'lexical' (BM25 over the character n-gram
+        index built by faiss_indexer.py, no transformer call) or 'hybrid'. Hybrid results are fused with
+        reciprocal rank fusion ('rrf') or a min-max normalized weighted sum ('weighted', vector_weight
+        for the FAISS side). With prefilter=True the vector search is restricted to the candidate_pool
+        best lexical candidates instead of scanning the whole index.
+
+        retrieve(..., filters={'subject': '국어', 'year': [2022, 2023]}) restricts every mode to the
+        matching questions using the id sets faiss_indexer.py writes to <index>.attrs.npz; the
+        restriction is applied inside the FAISS search, so k hits come back whenever k chunks match.
+        The resolved id set and FAISS selector of the last filter_cache_size filters are kept.
+
+        With distinct_questions=True (the default) every result is a different question: indexes with
+        several vectors per question (the 'chunk' and 'passage_stem' granularities of data_processor.py)
+        are searched for overfetch * k chunks, which are reduced to each question's best chunk
+        (best_per_question), searching further when that leaves fewer than k questions.
+        """
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode '{mode}', expected one of {RETRIEVAL_MODES}")
+        if fusion not in FUSION_METHODS:
+            raise ValueError(f"Unknown fusion method '{fusion}', expected one of {FUSION_METHODS}")
+        self.mode = mode
+        self.fusion = fusion
+        self.vector_weight = vector_weight
+        self.prefilter = prefilter
+        self.candidate_pool = candidate_pool
+        self.distinct_questions = distinct_questions
+        self.overfetch = overfetch
+        self.faiss_index_path = faiss_index_path
+        self.faiss_map_path = faiss_map_path
+        self.mmap = mmap
+        # Defaults to the shared on-disk cache configured by EMBEDDING_CACHE_PATH
+        self.embedding_cache = embedding_cache if embedding_cache is not None else get_default_cache()
+        self.query_embedding_cache = LRUCache(query_cache_size)
+        self.result_cache = LRUCache(result_cache_size)
+        self.filter_cache = LRUCache(filter_cache_size)
+        self.index_check_interval = index_check_interval
+        self._reload_lock = threading.Lock()
+        self._lease_lock = threading.Lock()
+        self._loaded = None
+        self._load_index()
+
+    @property
+    def model(self):
+        # Loaded on the first query that needs an embedding; 'lexical' mode never loads it
+        return get_model_for_id(self.model_id)
+
+    def warm_up(self, queries=("warm up",)):
+        """
+        Loads the model and runs the queries through every stage (encode, FAISS search, chunk
+        lookup) without touching the result cache, so the first real request is not a cold one.
+        Returns the seconds spent.
+        """
+        started = time.perf_counter()
+        with self._lease() as loaded:
+            query_embeddings = encode_with_cache(get_model_for_id(loaded.model_id), list(queries), loaded.model_id, None)
+            _, indices = loaded.index.search(query_embeddings, 3)
+            loaded.chunk_store.fetch(indices[indices != -1])
+        return time.perf_counter() - started
+
+    def _load_index(self):
+        """
+        Opens the current index file and swaps it in. The previous load is closed once the requests
+        still using it finish (right away when there are none).
+        """
+        loaded = _LoadedIndex(self.faiss_index_path, self.faiss_map_path, self.mmap)
+        with self._lease_lock:
+            old, self._loaded = self._loaded, loaded
+            release_now = old is not None and self._retire(old)
+        if release_now:
+            old.close()
+        self._last_index_check = time.monotonic()
+
+    def _retire(self, loaded):
+        # Called under _lease_lock; True when nothing holds `loaded` any more
+        loaded.retired = True
+        return loaded.active_requests == 0
+
+    @contextmanager
+    def _lease(self):
+        """
+        The current load, kept open until the block exits even if a reload swaps it out meanwhile.
+        """
+        with self._lease_lock:
+            loaded = self._loaded
+            if loaded.closed:
+                raise RuntimeError("RAGRetriever is closed")
+            loaded.active_requests += 1
+        try:
+            yield loaded
+        finally:
+            with self._lease_lock:
+                loaded.active_requests -= 1
+                release_now = loaded.retired and loaded.active_requests == 0 and not loaded.closed
+            if release_now:
+                loaded.close()
+
+    # The current load's parts, for callers outside a request (requests use _lease())
+    index = property(lambda self: self._loaded.index)
+    chunk_store = property(lambda self: self._loaded.chunk_store)
+    lexical_index = property(lambda self: self._loaded.lexical_index)
+    attribute_index = property(lambda self: self._loaded.attribute_index)
+    related = property(lambda self: self._loaded.related)
+    question_clusters = property(lambda self: self._loaded.question_clusters)
+    index_version = property(lambda self: self._loaded.index_version)
+    index_params = property(lambda self: self._loaded.index_params)
+    model_id = property(lambda self: self._loaded.model_id)
+    granularity = property(lambda self: self._loaded.granularity)
+
+    def close(self):
+        """
+        Releases the index, its memory maps and the chunk store connection (after in-flight
+        requests finish). The embedding cache is left open, since it may be shared with other retrievers.
+        """
+        with self._reload_lock:
+            with self._lease_lock:
+                release_now = self._retire(self._loaded) and not self._loaded.closed
+            if release_now:
+                self._loaded.close()
+            self.query_embedding_cache.clear()
+            self.result_cache.clear()
+            self.filter_cache.clear()
+
+    def check_for_index_update(self, force=False):
+        """
+        Reloads the index if its file changed since it was loaded. Returns True when it reloaded.
+        """
+        if not force and time.monotonic() - self._last_index_check < self.index_check_interval:
+            return False
+        with self._reload_lock:
+            self._last_index_check = time.monotonic()
+            if index_file_version(self.faiss_index_path) == self.index_version:
+                return False
+            self._load_index()
+            self.result_cache.clear() # Old entries are keyed by the old version anyway; free the memory
+            self.filter_cache.clear()
+            return True
+
+    def cache_stats(self):
+        return {
+            'index_version': self.index_version,
+            'query_embeddings': self.query_embedding_cache.stats(),
+            'results': self.result_cache.stats(),
+            'filters': self.filter_cache.stats(),
+            'embedding_cache': self.embedding_cache.stats() if self.embedding_cache is not None else None
+        }
 
-    def retrieve(self, query, k=3):
+    def retrieve(self, query, k=3, mode=None, filters=None):
         """
         Retrieves top-k relevant chunks based on the query.
         """
-        query_embedding = self.model.encode([query]).astype('float32')
-        
-        # Perform search
-        distances, indices = self.index.search(query_embedding, k)
-        
-        retrieved_chunks = []
-        for i, idx in enumerate(indices[0]):
-            if idx != -1: # Check if a valid index is returned
-                chunk_info = self.faiss_map[idx]
-                retrieved_chunks.append({
-                    'original_id': chunk_info['original_id'],
-                    'chunk_text': chunk_info['chunk_text'],
-                    'distance': distances[0][i]
-                })
-        return retrieved_chunks
+        return self.retrieve_batch([query], k, mode, filters)[0]
+
+    def embed_queries(self, queries, model_id=None):
+        """
+        Query embeddings through the in-process LRU, then the on-disk embedding cache, then the model.
+        model_id defaults to the current index's model.
+        """
+        model_id = model_id or self.model_id # A reload may switch models; keys carry the model so vectors never mix
+        keys = [(model_id, normalize_text(query)) for query in queries]
+        embeddings = [self.query_embedding_cache.get(key) for key in keys]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            encoded = encode_with_cache(get_model_for_id(model_id), [queries[i] for i in missing], model_id, self.embedding_cache)
+            for i, embedding in zip(missing, encoded):
+                embeddings[i] = embedding
+                self.query_embedding_cache.put(keys[i], embedding)
+        return np.vstack(embeddings).astype('float32', copy=False)
+
+    def _require_lexical_index(self, lexical_index):
+        if lexical_index is None:
+            raise ValueError(f"No lexical index at {lexical_path_for(self.faiss_index_path)}; rebuild with faiss_indexer.py")
+
+    def _filter_selection(self, attribute_index, filter_key, index_version):
+        """
+        (sorted FAISS ids, IDSelector) admitted by a normalized filter, or None without filters.
+        """
+        if not filter_key:
+            return None
+        if attribute_index is None:
+            raise ValueError(f"No attribute index at {attribute_path_for(self.faiss_index_path)}; rebuild with faiss_indexer.py")
+        cache_key = (index_version, filter_key)
+        selection = self.filter_cache.get(cache_key)
+        if selection is None:
+            ids = attribute_index.ids_for(filter_key)
+            selection = (ids, faiss.IDSelectorBatch(ids))
+            self.filter_cache.put(cache_key, selection)
+        return selection
+
+    def _search(self, index, query_embeddings, k, selection):
+        if selection is None:
+            return index.search(query_embeddings, k)
+        ids, selector = selection
+        return filtered_search(index, query_embeddings, k, ids, selector, self.index_params.get('search_params'))
+
+    def _groups_questions(self):
+        return self.distinct_questions and self.granularity != 'question'
+
+    def _distinct_question_search(self, index, query_embeddings, k, selection):
+        """
+        Top-k distinct questions: over-fetches chunks, keeps each question's best (best_per_question)
+        and searches the rows still short of k questions again with a 4x larger pool, until the pool
+        covers every candidate vector.
+        """
+        limit = index.ntotal if selection is None else len(selection[0])
+        pool = min(k * self.overfetch, max(limit, k))
+        distances, indices, found = best_per_question(*self._search(index, query_embeddings, pool, selection), k)
+        short = np.flatnonzero(found < k)
+        while len(short) and pool < limit:
+            pool = min(pool * 4, limit)
+            more_distances, more_indices, more_found = best_per_question(
+                *self._search(index, query_embeddings[short], pool, selection), k
+            )
+            distances[short], indices[short] = more_distances, more_indices
+            short = short[more_found < k]
+        return distances, indices
+
+    def _vector_hits(self, index, query_embeddings, k, selection=None):
+        """
+        [(faiss_id, distance, score)] per query, from one batched FAISS search.
+        """
+        if self._groups_questions():
+            distances, indices = self._distinct_question_search(index, query_embeddings, k, selection)
+        else:
+            distances, indices = self._search(index, query_embeddings, k, selection)
+        return [
+            [(int(idx), distances[row][j], None) for j, idx in enumerate(indices[row]) if idx != -1]
+            for row in range(len(query_embeddings))
+        ]
+
+    def _lexical_hits(self, lexical_index, query, k, selection=None):
+        pool = k * self.overfetch if self._groups_questions() else k
+        faiss_ids, scores = lexical_index.search(query, pool, None if selection is None else selection[0])
+        hits = [(int(faiss_id), None, float(score)) for faiss_id, score in zip(faiss_ids, scores)]
+        return distinct_question_hits(hits, k) if self._groups_questions() else hits
+
+    def _hybrid_hits(self, index, lexical_index, query, query_embedding, k, selection=None):
+        pool = max(self.candidate_pool, k * self.overfetch if self._groups_questions() else k)
+        lexical_ids, lexical_scores = lexical_index.search(query, pool, None if selection is None else selection[0])
+        if self.prefilter:
+            if not len(lexical_ids):
+                return []
+            # Dense scores only for the lexical candidates
+            selector = faiss.IDSelectorBatch(np.ascontiguousarray(lexical_ids, dtype='int64'))
+            distances, indices = search_with_selector(index, query_embedding, len(lexical_ids), selector,
+                                                      self.index_params.get('search_params'))
+        else:
+            distances, indices = self._search(index, query_embedding, pool, selection)
+        valid = indices[0] != -1
+        vector_ids, vector_distances = indices[0][valid], distances[0][valid]
+
+        if self.fusion == 'rrf':
+            fused = reciprocal_rank_fusion([vector_ids, lexical_ids])
+        else:
+            fused = weighted_score_fusion(vector_ids, vector_distances, lexical_ids, lexical_scores, self.vector_weight)
+        distance_by_id = dict(zip(vector_ids.tolist(), vector_distances))
+        ranked = sorted(fused.items(), key=lambda item: -item[1])
+        hits = [(faiss_id, distance_by_id.get(faiss_id), score) for faiss_id, score in ranked]
+        return distinct_question_hits(hits, k) if self._groups_questions() else hits[:k]
+
+    def retrieve_batch(self, queries, k=3, mode=None, filters=None):
+        """
+        Retrieves top-k relevant chunks for every query with one batched encode and one multi-row
+        FAISS search. Returns one result list per query, each shaped like retrieve()'s.
+        Queries whose results are cached for the current index version skip both steps.
+
+        Results carry 'distance' (FAISS L2, None when the chunk was found lexically only) and, in
+        'lexical'/'hybrid' mode, 'score' (BM25 or fused score, higher is better).
+        filters apply to every query of the batch.
+        """
+        if not queries:
+            return []
+        mode = mode or self.mode
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode '{mode}', expected one of {RETRIEVAL_MODES}")
+        self.check_for_index_update()
+        # Lease one consistent snapshot; a concurrent reload swaps in a new one and closes this one after us
+        with self._lease() as loaded:
+            index, chunk_store, lexical_index, index_version = loaded.index, loaded.chunk_store, loaded.lexical_index, loaded.index_version
+            attribute_index = loaded.attribute_index
+            filter_key = normalize_filters(filters)
+
+            result_keys = [(normalize_text(query), k, mode, filter_key, index_version) for query in queries]
+            results = [self.result_cache.get(key) for key in result_keys]
+            pending = [i for i, result in enumerate(results) if result is None]
+            if pending:
+                pending_queries = [queries[i] for i in pending]
+                selection = self._filter_selection(attribute_index, filter_key, index_version)
+                if mode == 'vector':
+                    hits = self._vector_hits(index, self.embed_queries(pending_queries, loaded.model_id), k, selection)
+                elif mode == 'lexical':
+                    self._require_lexical_index(lexical_index)
+                    hits = [self._lexical_hits(lexical_index, query, k, selection) for query in pending_queries]
+                else:
+                    self._require_lexical_index(lexical_index)
+                    query_embeddings = self.embed_queries(pending_queries, loaded.model_id)
+                    hits = [
+                        self._hybrid_hits(index, lexical_index, query, query_embeddings[row:row + 1], k, selection)
+                        for row, query in enumerate(pending_queries)
+                    ]
+
+                for i, retrieved_chunks in zip(pending, self._resolve_hits(chunk_store, hits, mode)):
+                    results[i] = retrieved_chunks
+                    self.result_cache.put(result_keys[i], retrieved_chunks)
+
+        # Copies, so callers can modify their results without corrupting the cache
+        return [[dict(chunk) for chunk in result] for result in results]
+
+    def _resolve_hits(self, chunk_store, hits, mode):
+        """
+        Turns [(faiss_id, distance, score)] per query into result dicts with one chunk store read.
+        A chunk standing in for collapsed near-duplicates lists the questions holding them under 'duplicate_ids'.
+        Questions ingested from problem sets (problem_sets.py) come with their 'passages'; a passage
+        hit lists its questions under 'question_ids'.
+        """
+        hit_ids = {faiss_id for query_hits in hits for faiss_id, _, _ in query_hits}
+        chunk_infos = chunk_store.fetch(hit_ids)
+        duplicates = chunk_store.duplicates_of(hit_ids)
+        hit_questions = {chunk_info['original_id'] for chunk_info in chunk_infos.values()}
+        passages = chunk_store.passages_for(hit_questions)
+        passage_questions = chunk_store.questions_for_passages(hit_questions)
+        results = []
+        for query_hits in hits:
+            retrieved_chunks = []
+            for faiss_id, distance, score in query_hits:
+                if faiss_id in chunk_infos: # Skips ids whose metadata was just removed
+                    chunk_info = chunk_infos[faiss_id]
+                    retrieved_chunk = {
+                        'original_id': chunk_info['original_id'],
+                        'chunk_text': chunk_info['chunk_text'],
+                        'distance': distance
+                    }
+                    if mode != 'vector':
+                        retrieved_chunk['score'] = score
+                    if faiss_id in duplicates:
+                        retrieved_chunk['duplicate_ids'] = duplicates[faiss_id]
+                    if chunk_info['original_id'] in passages:
+                        retrieved_chunk['passages'] = passages[chunk_info['original_id']]
+                    if chunk_info['original_id'] in passage_questions:
+                        retrieved_chunk['question_ids'] = passage_questions[chunk_info['original_id']]
+                    retrieved_chunks.append(retrieved_chunk)
+            results.append(retrieved_chunks)
+        return results
+
+    def search_vectors(self, query_embeddings, k=3, filters=None):
+        """
+        Vector-mode retrieval for query embeddings computed elsewhere, e.g. by shard_search.py,
+        which embeds a query once and sends the vector to every shard. Not cached; results are
+        shaped like retrieve()'s.
+        """
+        self.check_for_index_update()
+        with self._lease() as loaded:
+            selection = self._filter_selection(loaded.attribute_index, normalize_filters(filters), loaded.index_version)
+            hits = self._vector_hits(loaded.index, np.ascontiguousarray(query_embeddings, dtype='float32'), k, selection)
+            return self._resolve_hits(loaded.chunk_store, hits, 'vector')
+
+    def related_questions(self, original_id, n=None):
+        """
+        Questions similar to original_id from the precomputed graph (related_questions.py), nearest
+        first: [{'original_id', 'distance'}]. No embedding or FAISS search at query time.
+        """
+        self.check_for_index_update()
+        related = self.related
+        if related is None:
+            raise ValueError(f"No related-questions graph at {related_path_for(self.faiss_index_path)}; build it with related_questions.py")
+        return related.lookup(original_id, n)
+
+    def sample_questions(self, m, filters=None, seed=None, central=False):
+        """
+        m questions spread over the topic clusters built by faiss_indexer.py (see
+        QuestionClusters.sample), optionally restricted by filters: [{'original_id', 'cluster'}].
+        """
+        self.check_for_index_update()
+        question_clusters, attribute_index = self.question_clusters, self.attribute_index
+        if question_clusters is None:
+            raise ValueError(f"No question clusters at {clusters_path_for(self.faiss_index_path)}; rebuild with faiss_indexer.py")
+        if filters and attribute_index is None:
+            raise ValueError(f"No attribute index at {attribute_path_for(self.faiss_index_path)}; rebuild with faiss_indexer.py")
+        allowed_keys = question_keys_for(attribute_index, filters) if filters else None
+        return question_clusters.sample(m, allowed_keys, seed, central)
+
+    def lookup_term(self, term, limit=20):
+        """
+        Chunks containing the exact term (e.g. a statute name or a passage range like "[1～3]"),
+        resolved from the n-gram posting lists and verified against the chunk text. Never runs the model.
+        """
+        with self._lease() as loaded:
+            lexical_index, chunk_store = loaded.lexical_index, loaded.chunk_store
+            self._require_lexical_index(lexical_index)
+            needle = normalize_text(term).lower()
+            matches = []
+            candidate_ids = lexical_index.candidates_containing(term)
+            for start in range(0, len(candidate_ids), 500):
+                chunk_infos = chunk_store.fetch(candidate_ids[start:start + 500])
+                for faiss_id in candidate_ids[start:start + 500]:
+                    chunk_info = chunk_infos.get(int(faiss_id))
+                    if chunk_info and needle in normalize_text(chunk_info['chunk_text']).lower():
+                        matches.append({
+                            'original_id': chunk_info['original_id'],
+                            'chunk_text': chunk_info['chunk_text'],
+                            'distance': None
+                        })
+                        if len(matches) >= limit:
+                            return matches
+            return matches
 
 if __name__ == "__main__":
     faiss_index_path = "/mnt/d/progress/munjero_rag_system/munjero_rag_system/models/faiss_index.bin"
-    faiss_map_path = "/mnt/d/progress/munjero_rag_system/munjero_rag_system/models/faiss_index.bin.map"
+    faiss_map_path = "/mnt/d/progress/munjero_rag_system/munjero_rag_system/models/faiss_index.bin.map.db"
 
     retriever = RAGRetriever(faiss_index_path, faiss_map_path)
 
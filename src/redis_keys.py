@@ -0,0 +1,8 @@
+"""
+Redis keys shared by the WebSocket server and the dashboard.
+
+Kept free of other imports so the dashboard can read them without pulling in the server.
+"""
+
+# Global extension ready status, set by scripts/websocket_server.py and read by the dashboard
+GLOBAL_EXTENSION_READY_KEY = 'global_extension_ready_status'
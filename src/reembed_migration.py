@@ -0,0 +1,450 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+import numpy as np
+from chunk_store import ChunkStore
+from data_processor import ENCODE_BATCH_SIZE
+from embedding_cache import encode_with_cache, get_default_cache
+from embedding_model import EMBEDDING_BACKENDS, embedding_model_id, get_model_for_id
+from embedding_store import EMBEDDINGS_FILE, MANIFEST_FILE, STORE_FORMAT, STORE_VERSION, EmbeddingStore
+from faiss_indexer import (CHUNK_ID_BITS, INDEX_TYPES, build_faiss_index, build_question_clusters, clusters_path_for,
+                           lexical_path_for, load_index_params, map_path_for, normalize_rows, question_chunk_ids,
+                           question_key, related_path_for, resolve_index_type, rows_for_ids, save_index_params,
+                           save_json_atomic, store_row_lookup, tune_search_params, write_attribute_index,
+                           write_faiss_index)
+from index_versions import current_version, new_version, publish_version, version_index_path
+from lexical_index import build_lexical_index
+from related_questions import RelatedQuestions, build_related_questions
+
+# Working files of the (single) migration in progress, under <index root>/migration/:
+#   state.json     checkpoint, progress and ETA (see migration_status)
+#   chunks.db      snapshot of the source version's chunk store; the chunk texts to re-embed
+#   embeddings.f32 new-model vectors, appended in chunk id order
+#   ids.i64        FAISS id of each row of embeddings.f32
+MIGRATION_DIR = "migration"
+STATE_FILE = "state.json"
+SNAPSHOT_FILE = "chunks.db"
+IDS_FILE = "ids.i64"
+COMPACTED_DIR = "compacted"
+
+def migration_path(index_root):
+    return os.path.join(index_root, MIGRATION_DIR)
+
+def migration_status(index_root):
+    """
+    The state of the current or last migration under index_root (None if there never was one):
+    status ('embedding', 'building', 'published'), embedded_chunks / total_chunks, progress,
+    chunks_per_second, eta_seconds and, once published, target_version.
+    """
+    path = os.path.join(migration_path(index_root), STATE_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, mode='r', encoding='utf-8') as f:
+        return json.load(f)
+
+def _write_vector_store(store_dir, dim, count, model_id):
+    """
+    Writes the manifest that makes a directory holding embeddings.f32 readable as an EmbeddingStore
+    (vectors only: the chunk texts and rows live in the chunk store snapshot).
+    """
+    manifest = {
+        'format': STORE_FORMAT,
+        'version': STORE_VERSION,
+        'dtype': 'float32',
+        'dim': dim,
+        'count': count,
+        'model_name': model_id
+    }
+    save_json_atomic(os.path.join(store_dir, MANIFEST_FILE), manifest, indent=4)
+    return EmbeddingStore(store_dir)
+
+class ReembedMigration:
+    """
+    Moves a versioned index root (index_versions.py) to another embedding model without a search outage.
+
+    The chunk texts of the current version are re-embedded with the new model in the background at
+    up to chunks_per_second, checkpointing after every batch, so an interrupted migration resumes
+    where it stopped. The old version keeps serving, with the old model, the whole time. Once every
+    chunk is covered, questions added, edited or removed in the meantime are caught up, a new version
+    is built (same index type and filters; the index params name the new model) and published, and
+    HotSwappingRetriever cuts over to it - queries are embedded with the new model from then on.
+    """
+
+    def __init__(self, index_root, model_name, backend='torch', quantized=None, chunks_per_second=None, batch_size=ENCODE_BATCH_SIZE,
+                 index_type=None, embedding_cache=None, target_recall=0.95, tune_k=10, **index_kwargs):
+        self.index_root = index_root
+        self.directory = migration_path(index_root)
+        self.target_model_id = embedding_model_id(model_name, backend, quantized)
+        self.chunks_per_second = chunks_per_second
+        self.batch_size = batch_size
+        self.embedding_cache = embedding_cache if embedding_cache is not None else get_default_cache()
+        self._stop = threading.Event()
+
+        self.state = migration_status(index_root)
+        if self.state is not None and self.state['status'] != 'published':
+            if self.state['target_model'] != self.target_model_id:
+                raise ValueError(f"A migration to '{self.state['target_model']}' is in progress under {index_root}; cancel it first")
+        else:
+            self.state = self._start(index_type, dict(index_kwargs, target_recall=target_recall, tune_k=tune_k))
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _save_state(self):
+        self.state['updated_at'] = time.time()
+        save_json_atomic(self._path(STATE_FILE), self.state, indent=4)
+
+    def _start(self, index_type, index_kwargs):
+        source_version = current_version(self.index_root)
+        if source_version is None:
+            raise FileNotFoundError(f"No published index version under {self.index_root}")
+        source_path = version_index_path(self.index_root, source_version)
+        source_params = load_index_params(source_path)
+        if source_params.get('model_name') == self.target_model_id:
+            raise ValueError(f"Version {source_version} is already embedded with '{self.target_model_id}'")
+
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory)
+        source = ChunkStore(map_path_for(source_path), readonly=True)
+        snapshot = source.copy_to(self._path(SNAPSHOT_FILE))
+        source.close()
+        total = snapshot.count()
+        snapshot.close()
+        open(self._path(EMBEDDINGS_FILE), mode='wb').close()
+        open(self._path(IDS_FILE), mode='wb').close()
+
+        self.state = {
+            'status': 'embedding',
+            'source_version': source_version,
+            'source_model': source_params.get('model_name'),
+            'target_model': self.target_model_id,
+            'index_type': index_type or source_params.get('index_type', 'flat'),
+            'index_kwargs': index_kwargs,
+            'lexical': source_params.get('lexical_index') is not None,
+            'dim': None,
+            'total_chunks': total,
+            'embedded_chunks': 0,
+            'last_faiss_id': None,
+            'progress': 0.0,
+            'chunks_per_second': None,
+            'eta_seconds': None,
+            'started_at': time.time(),
+            'target_version': None
+        }
+        self._save_state()
+        return self.state
+
+    def stop(self):
+        """
+        Asks run() to return after the current batch; the checkpoint lets a later run() resume.
+        """
+        self._stop.set()
+
+    def run_in_background(self):
+        thread = threading.Thread(target=self.run, name="reembed-migration", daemon=True)
+        thread.start()
+        return thread
+
+    def run(self):
+        """
+        Embeds the remaining chunks, then builds and publishes the new version.
+        Returns the final state, or the checkpointed state when stop() was called first.
+        """
+        if self.state['status'] == 'published':
+            return self.state
+        self._stop.clear()
+        model = get_model_for_id(self.target_model_id)
+        rows = self.state['embedded_chunks']
+        # Rows written after the last checkpoint are embedded again
+        os.truncate(self._path(EMBEDDINGS_FILE), rows * 4 * (self.state['dim'] or 0))
+        os.truncate(self._path(IDS_FILE), rows * 8)
+
+        snapshot = ChunkStore(self._path(SNAPSHOT_FILE))
+        try:
+            with open(self._path(EMBEDDINGS_FILE), mode='ab') as embeddings_file, open(self._path(IDS_FILE), mode='ab') as ids_file:
+                files = (embeddings_file, ids_file)
+                if self.state['status'] == 'embedding':
+                    if not self._embed_snapshot(model, snapshot, files):
+                        return self.state
+                    self.state['status'] = 'building'
+                    self._save_state()
+                while True:
+                    self._catch_up(model, snapshot, files)
+                    index_path = self._build(snapshot)
+                    if self._source_states() == snapshot.question_states():
+                        break
+                    # Updated again while building: catch up and rebuild from the same vectors
+                    shutil.rmtree(os.path.dirname(index_path))
+        finally:
+            snapshot.close()
+        self._publish(index_path)
+        return self.state
+
+    def _embed(self, model, faiss_ids, texts, files):
+        vectors = np.ascontiguousarray(
+            encode_with_cache(model, texts, self.target_model_id, self.embedding_cache, batch_size=self.batch_size), dtype='float32'
+        )
+        embeddings_file, ids_file = files
+        embeddings_file.write(vectors.tobytes())
+        ids_file.write(np.asarray(faiss_ids, dtype='int64').tobytes())
+        for f in files:
+            f.flush()
+            os.fsync(f.fileno())
+        self.state['dim'] = int(vectors.shape[1])
+        self.state['embedded_chunks'] += len(texts)
+
+    def _embed_snapshot(self, model, snapshot, files):
+        """
+        Embeds the snapshot's chunks in id order from the checkpoint on. Returns False if stopped.
+        """
+        session_started = time.monotonic()
+        session_rows = 0
+        batch_ids, batch_texts = [], []
+        chunks = snapshot.iter_chunks(self.state['last_faiss_id'])
+        while True:
+            item = next(chunks, None)
+            if item is not None:
+                batch_ids.append(item[0])
+                batch_texts.append(item[1])
+                if len(batch_texts) < self.batch_size:
+                    continue
+            if batch_texts:
+                self._embed(model, batch_ids, batch_texts, files)
+                self.state['last_faiss_id'] = batch_ids[-1]
+                session_rows += len(batch_texts)
+                batch_ids, batch_texts = [], []
+
+                if self.chunks_per_second:
+                    # Throttle: never run ahead of the configured rate
+                    delay = session_rows / self.chunks_per_second - (time.monotonic() - session_started)
+                    if delay > 0:
+                        self._stop.wait(delay)
+                rate = session_rows / max(time.monotonic() - session_started, 1e-9)
+                remaining = max(self.state['total_chunks'] - self.state['embedded_chunks'], 0)
+                self.state['progress'] = min(self.state['embedded_chunks'] / max(self.state['total_chunks'], 1), 1.0)
+                self.state['chunks_per_second'] = rate
+                self.state['eta_seconds'] = remaining / rate if rate else None
+                self._save_state()
+                if self._stop.is_set():
+                    return False
+            if item is None:
+                return True
+
+    def _source_chunk_store(self):
+        version = current_version(self.index_root)
+        return ChunkStore(map_path_for(version_index_path(self.index_root, version)), readonly=True)
+
+    def _source_states(self):
+        source = self._source_chunk_store()
+        try:
+            return source.question_states()
+        finally:
+            source.close()
+
+    def _catch_up(self, model, snapshot, files):
+        """
+        Applies the questions added, edited or removed in the serving version since the snapshot
+        was taken. New vectors are appended (the build keeps the last row of every id); the snapshot
+        is committed only after they are on disk, so a crash in between is caught up again.
+        Chunks of added or edited questions are all embedded, without near-duplicate collapsing.
+        """
+        source = self._source_chunk_store()
+        try:
+            source_states = source.question_states()
+            snapshot_states = snapshot.question_states()
+            changed = [question_id for question_id, state in source_states.items() if snapshot_states.get(question_id) != state]
+            stale = [question_id for question_id in snapshot_states if source_states.get(question_id) != snapshot_states[question_id]]
+            if not changed and not stale:
+                return 0
+
+            changed_ids = [question_chunk_ids(question_id, source_states[question_id]['chunks']) for question_id in changed]
+            chunk_infos = source.fetch(np.concatenate(changed_ids)) if changed_ids else {}
+            changed_set = set(changed)
+            attributes = {
+                question_id: question_attributes for question_id, _, question_attributes in source.iter_question_attributes()
+                if question_id in changed_set
+            }
+        finally:
+            source.close()
+
+        stale_ids = [question_chunk_ids(question_id, snapshot_states[question_id]['chunks']) for question_id in stale]
+        # Near-duplicates of removed chunks become canonical and need a vector of their own
+        promoted = snapshot.promote_duplicates(np.concatenate(stale_ids)) if stale_ids else []
+        promoted_infos = snapshot.fetch(new_id for _, new_id in promoted)
+        new_chunks = sorted((faiss_id, info['chunk_text']) for faiss_id, info in chunk_infos.items())
+        to_embed = new_chunks + [(faiss_id, info['chunk_text']) for faiss_id, info in promoted_infos.items()]
+        for start in range(0, len(to_embed), self.batch_size):
+            batch = to_embed[start:start + self.batch_size]
+            self._embed(model, [faiss_id for faiss_id, _ in batch], [text for _, text in batch], files)
+        self.state['total_chunks'] += len(to_embed)
+        self._save_state()
+
+        for chunk_ids in stale_ids:
+            snapshot.delete_chunks(chunk_ids)
+        snapshot.delete_questions(stale)
+        snapshot.put_chunks(
+            (faiss_id, chunk_infos[faiss_id]['original_id'], chunk_infos[faiss_id]['chunk_index'], text) for faiss_id, text in new_chunks
+        )
+        snapshot.put_questions((question_id, source_states[question_id]['hash'], source_states[question_id]['chunks']) for question_id in changed)
+        for question_id in changed:
+            snapshot.put_question_attributes(question_id, attributes.get(question_id, {}))
+        snapshot.commit()
+        return len(changed) + len(stale)
+
+    def _final_vectors(self, snapshot):
+        """
+        (EmbeddingStore, ids) holding exactly one vector - the newest - for every chunk in the snapshot.
+        """
+        count = self.state['embedded_chunks']
+        ids = np.fromfile(self._path(IDS_FILE), dtype='int64', count=count)
+        chunk_ids = np.fromiter((faiss_id for faiss_id, _ in snapshot.iter_chunks()), dtype='int64')
+        missing = np.setdiff1d(chunk_ids, ids)
+        if len(missing):
+            raise RuntimeError(f"{len(missing)} chunks have no '{self.target_model_id}' vector; the migration is incomplete")
+
+        # Last row of every id, and only ids still in the snapshot
+        _, last_from_end = np.unique(ids[::-1], return_index=True)
+        keep = np.sort(count - 1 - last_from_end)
+        keep = keep[np.isin(ids[keep], chunk_ids)]
+        store = _write_vector_store(self.directory, self.state['dim'], count, self.target_model_id)
+        if len(keep) == count:
+            return store, ids
+
+        compacted_dir = self._path(COMPACTED_DIR)
+        os.makedirs(compacted_dir, exist_ok=True)
+        with open(os.path.join(compacted_dir, EMBEDDINGS_FILE), mode='wb') as f:
+            for start in range(0, len(keep), 65536):
+                f.write(np.ascontiguousarray(store.embeddings[keep[start:start + 65536]]).tobytes())
+        return _write_vector_store(compacted_dir, self.state['dim'], len(keep), self.target_model_id), ids[keep]
+
+    def _question_vectors(self, store, ids, snapshot):
+        """
+        (original_ids, normalized mean chunk vector per question) from the new vectors, for re-clustering.
+        """
+        rows = np.arange(len(ids))
+        duplicates, canonicals = snapshot.duplicate_ids()
+        if len(duplicates):
+            # Near-duplicate chunks count with their canonical's vector
+            rows = np.concatenate([rows, rows_for_ids(store_row_lookup(store, ids), canonicals)])
+            ids = np.concatenate([ids, duplicates])
+        keys = ids >> CHUNK_ID_BITS
+        order = np.argsort(keys, kind='stable')
+        starts = np.flatnonzero(np.r_[True, keys[order][1:] != keys[order][:-1]])
+        sums = np.add.reduceat(np.asarray(store.embeddings)[rows[order]], starts)
+        means = sums / np.diff(np.r_[starts, len(order)])[:, None]
+        id_of_key = {question_key(question_id): question_id for question_id in snapshot.question_states()}
+        question_ids = [id_of_key[key] for key in keys[order][starts]]
+        passage_ids = snapshot.passage_ids() # Passages are not sampled as questions, see store_question_vectors
+        keep = np.array([question_id not in passage_ids for question_id in question_ids], dtype=bool)
+        return [question_id for question_id, kept in zip(question_ids, keep) if kept], normalize_rows(means[keep]).astype('float32')
+
+    def _build(self, snapshot):
+        """
+        Builds the new version's index, chunk store, attribute and lexical index. Returns the index path.
+        """
+        store, ids = self._final_vectors(snapshot)
+        index_kwargs = dict(self.state['index_kwargs'])
+        target_recall = index_kwargs.pop('target_recall')
+        tune_k = index_kwargs.pop('tune_k')
+        index_type = resolve_index_type(self.state['index_type'], store.count)
+
+        started = time.perf_counter()
+        index = build_faiss_index(store, ids, index_type, **index_kwargs)
+        build_seconds = time.perf_counter() - started
+        search_params, tuning_report = tune_search_params(index, index_type, store, ids, k=tune_k, target_recall=target_recall)
+
+        version = new_version(self.index_root)
+        index_path = version_index_path(self.index_root, version)
+        write_faiss_index(index, index_path)
+        snapshot.commit()
+        snapshot.copy_to(map_path_for(index_path)).close()
+        attribute_stats = write_attribute_index(index_path)
+        lexical_stats = build_lexical_index(snapshot.iter_chunks(), lexical_path_for(index_path)) if self.state['lexical'] else None
+        source_path = version_index_path(self.index_root, self.state['source_version'])
+        cluster_stats = None
+        if os.path.exists(clusters_path_for(source_path)):
+            with np.load(clusters_path_for(source_path)) as source_clusters:
+                num_clusters = len(source_clusters['centroids'])
+            question_ids, question_vectors = self._question_vectors(store, ids, snapshot)
+            cluster_stats = build_question_clusters(question_ids, question_vectors, clusters_path_for(index_path), num_clusters)
+
+        save_index_params(index_path, {
+            'index_type': index_type,
+            'model_name': self.target_model_id,
+            'granularity': load_index_params(source_path).get('granularity'), # Same chunks, new vectors
+            'dim': store.dim,
+            'ntotal': index.ntotal,
+            'file_bytes': os.path.getsize(index_path),
+            'search_params': search_params,
+            'build_seconds': build_seconds,
+            'lexical_index': lexical_stats,
+            'attribute_index': attribute_stats,
+            'question_clusters': cluster_stats,
+            'tuning': {'k': tune_k, 'target_recall': target_recall, 'trials': tuning_report},
+            'migrated_from': {'version': self.state['source_version'], 'model_name': self.state['source_model']}
+        })
+        source_related = related_path_for(source_path)
+        if os.path.exists(source_related):
+            # Neighbours change with the model, so the graph is recomputed rather than copied
+            build_related_questions(index_path, RelatedQuestions(source_related).n_neighbors, index=index)
+        return index_path
+
+    def _publish(self, index_path):
+        version = os.path.basename(os.path.dirname(index_path))
+        publish_version(self.index_root, version)
+        # The vectors are in the new index now; keep only the state as a record of the migration
+        for name in os.listdir(self.directory):
+            if name != STATE_FILE:
+                path = self._path(name)
+                shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+        self.state.update({'status': 'published', 'target_version': version, 'progress': 1.0, 'eta_seconds': 0.0})
+        self._save_state()
+        print(f"ReembedMigration: published {version} ({self.target_model_id}), replacing {self.state['source_version']}", flush=True, file=sys.stderr)
+
+def cancel_migration(index_root):
+    """
+    Deletes an unfinished migration's working files. The serving version is never affected.
+    """
+    shutil.rmtree(migration_path(index_root), ignore_errors=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-embed a versioned index with a new model in the background, then cut over.")
+    parser.add_argument("--root", required=True, help="Index root managed by index_versions.py")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run = subparsers.add_parser("run", help="Start, or resume, a migration and run it to completion")
+    run.add_argument("--model", required=True, help="New embedding model (SentenceTransformer name)")
+    run.add_argument("--backend", choices=EMBEDDING_BACKENDS, default='torch')
+    run.add_argument("--fp32", action="store_true", help="With --backend onnx: the unquantized export (default: int8)")
+    run.add_argument("--rate", type=float, help="Maximum chunks embedded per second (default: unthrottled)")
+    run.add_argument("--batch-size", type=int, default=ENCODE_BATCH_SIZE)
+    run.add_argument("--index-type", choices=INDEX_TYPES, help="Default: the current version's index type")
+
+    subparsers.add_parser("status", help="Show progress and ETA")
+    subparsers.add_parser("cancel", help="Discard an unfinished migration")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        migration = ReembedMigration(args.root, args.model, args.backend, quantized=not args.fp32, chunks_per_second=args.rate,
+                                     batch_size=args.batch_size, index_type=args.index_type)
+        thread = migration.run_in_background()
+        try:
+            while thread.is_alive():
+                thread.join(10.0)
+                state = migration.state
+                if state['status'] == 'embedding' and state['eta_seconds'] is not None:
+                    print(f"{state['embedded_chunks']}/{state['total_chunks']} chunks ({100 * state['progress']:.1f}%), "
+                          f"{state['chunks_per_second']:.1f}/s, ETA {state['eta_seconds'] / 60:.1f} min", flush=True)
+        except KeyboardInterrupt:
+            migration.stop()
+            thread.join()
+            print("Stopped; run again to resume from the checkpoint.")
+    elif args.command == "status":
+        print(json.dumps(migration_status(args.root), indent=4))
+    else:
+        cancel_migration(args.root)
+        print("Migration cancelled.")
@@ -0,0 +1,287 @@
+import argparse
+import json
+import os
+import shutil
+import time
+import numpy as np
+from chunk_store import ChunkStore
+from faiss_indexer import (CHUNK_ID_BITS, apply_search_params, load_index_params, map_path_for, question_chunk_ids,
+                           question_key, read_faiss_index, related_path_for)
+
+DEFAULT_NEIGHBORS = 10
+SEARCH_BATCH_SIZE = 4096 # Chunk vectors per batched FAISS search
+META_FILE = "meta.json"
+
+def _chunk_k(n_neighbors):
+    # Chunk-level hits per chunk: enough that the n nearest questions survive self hits and
+    # several hits landing on the same question
+    return 4 * n_neighbors + 8
+
+def _min_per_pair(src, dst, dist):
+    """
+    Keeps the smallest distance of every (src, dst) pair: question distance is the max-sim
+    (min L2) over all chunk pairs of the two questions.
+    """
+    order = np.lexsort((dist, dst, src))
+    src, dst, dist = src[order], dst[order], dist[order]
+    first = np.ones(len(src), dtype=bool)
+    first[1:] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1])
+    return src[first], dst[first], dist[first]
+
+def _top_n(src, dst, dist, n):
+    """
+    The n nearest dst of every src, nearest first, from (src, dst, dist) pairs with unique (src, dst).
+    """
+    order = np.lexsort((dst, dist, src))
+    src, dst, dist = src[order], dst[order], dist[order]
+    starts = np.flatnonzero(np.r_[True, src[1:] != src[:-1]]) if len(src) else np.zeros(0, dtype='int64')
+    rank = np.arange(len(src)) - np.repeat(starts, np.diff(np.r_[starts, len(src)]))
+    keep = rank < n
+    return src[keep], dst[keep], dist[keep], rank[keep]
+
+def _question_pairs(index, rows, chunk_ids, row_of_key, n_neighbors, batch_size=SEARCH_BATCH_SIZE):
+    """
+    Question-level neighbour pairs for the questions at `rows` (positions in the sorted question list).
+    Their chunk vectors are read back from the index and searched in batches of about batch_size;
+    hits are mapped to questions through the high id bits and reduced to (src, dst, min distance).
+    """
+    chunk_k = _chunk_k(n_neighbors)
+    keys = np.fromiter(row_of_key.keys(), dtype='int64', count=len(row_of_key))
+    key_rows = np.fromiter(row_of_key.values(), dtype='int64', count=len(row_of_key))
+    key_order = np.argsort(keys)
+    keys, key_rows = keys[key_order], key_rows[key_order]
+
+    parts = []
+    batch_rows, batch_ids = [], []
+    pending = 0
+    for position, row in enumerate(rows):
+        ids = chunk_ids[row]
+        if len(ids):
+            batch_rows.append(np.full(len(ids), row, dtype='int64'))
+            batch_ids.append(ids)
+            pending += len(ids)
+        if pending >= batch_size or (position == len(rows) - 1 and pending):
+            owners, ids = np.concatenate(batch_rows), np.concatenate(batch_ids)
+            distances, indices = index.search(index.reconstruct_batch(ids), chunk_k)
+            valid = indices != -1
+            src = np.broadcast_to(owners[:, None], indices.shape)[valid]
+            neighbor_keys = indices[valid] >> CHUNK_ID_BITS
+            slots = np.minimum(np.searchsorted(keys, neighbor_keys), len(keys) - 1)
+            known = keys[slots] == neighbor_keys # Ids of questions removed since are skipped
+            dst = np.where(known, key_rows[slots], -1)
+            keep = known & (dst != src)
+            parts.append(_min_per_pair(src[keep], dst[keep], distances[valid][keep]))
+            batch_rows, batch_ids, pending = [], [], 0
+    if not parts:
+        empty = np.zeros(0, dtype='int64')
+        return empty, empty, np.zeros(0, dtype='float32')
+    return _min_per_pair(*(np.concatenate(arrays) for arrays in zip(*parts)))
+
+def _fill(neighbors, distances, src, dst, dist, rank):
+    neighbors[src, rank] = dst
+    distances[src, rank] = dist
+
+def _write_related(output_dir, question_ids, hashes, neighbors, distances, meta):
+    """
+    Writes the arrays to output_dir, renaming the new directory into place (same scheme as lexical_index.py).
+    """
+    tmp_dir = output_dir.rstrip(os.sep) + ".tmp"
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    np.save(os.path.join(tmp_dir, "question_ids.npy"), np.asarray(question_ids, dtype=str))
+    np.save(os.path.join(tmp_dir, "hashes.npy"), np.asarray(hashes, dtype=str))
+    np.save(os.path.join(tmp_dir, "neighbors.npy"), neighbors)
+    np.save(os.path.join(tmp_dir, "distances.npy"), distances)
+    with open(os.path.join(tmp_dir, META_FILE), mode='w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=4)
+
+    old_dir = output_dir.rstrip(os.sep) + ".old"
+    if os.path.exists(output_dir):
+        if os.path.exists(old_dir):
+            shutil.rmtree(old_dir)
+        os.rename(output_dir, old_dir)
+    os.rename(tmp_dir, output_dir)
+    if os.path.exists(old_dir):
+        shutil.rmtree(old_dir)
+
+def _open_sources(faiss_index_path, index, chunk_store):
+    if index is None:
+        params = load_index_params(faiss_index_path)
+        index = read_faiss_index(faiss_index_path)
+        apply_search_params(index, params.get('search_params'))
+    if chunk_store is None:
+        chunk_store = ChunkStore(map_path_for(faiss_index_path), readonly=True)
+    return index, chunk_store
+
+def build_related_questions(faiss_index_path, n_neighbors=DEFAULT_NEIGHBORS, index=None, chunk_store=None):
+    """
+    Computes the top-n_neighbors related questions of every question and writes them to
+    <faiss_index_path>.related/:
+
+      question_ids.npy  sorted original_ids; row i describes question_ids[i]
+      neighbors.npy     int32 (questions, n_neighbors) rows of the related questions, nearest first, -1 padded
+      distances.npy     float32 question distances (min L2 over chunk pairs), inf padded
+      hashes.npy        content hash of every question when it was computed, for update_related_questions()
+
+    index/chunk_store default to the saved ones; index_updater.py passes its in-memory copies so the
+    graph is written before the new index file appears. Returns statistics.
+    """
+    started = time.perf_counter()
+    own_store = chunk_store is None
+    index, chunk_store = _open_sources(faiss_index_path, index, chunk_store)
+    try:
+        states = chunk_store.question_states()
+        duplicate_ids = chunk_store.duplicate_ids()
+    finally:
+        if own_store:
+            chunk_store.close()
+    question_ids = sorted(states)
+    row_of_key = {question_key(question_id): row for row, question_id in enumerate(question_ids)}
+    # Near-duplicate chunks are searched with their canonical's vector
+    chunk_ids = [chunk_store.canonical_ids(question_chunk_ids(question_id, states[question_id]['chunks']), duplicate_ids)
+                 for question_id in question_ids]
+
+    neighbors = np.full((len(question_ids), n_neighbors), -1, dtype='int32')
+    distances = np.full((len(question_ids), n_neighbors), np.inf, dtype='float32')
+    pairs = _question_pairs(index, range(len(question_ids)), chunk_ids, row_of_key, n_neighbors)
+    _fill(neighbors, distances, *_top_n(*pairs, n_neighbors))
+
+    meta = {'n_neighbors': n_neighbors, 'questions': len(question_ids), 'built_at': time.time()}
+    _write_related(related_path_for(faiss_index_path), question_ids, [states[q]['hash'] for q in question_ids], neighbors, distances, meta)
+    return {'questions': len(question_ids), 'recomputed': len(question_ids), 'seconds': time.perf_counter() - started}
+
+def update_related_questions(faiss_index_path, index=None, chunk_store=None):
+    """
+    Brings <faiss_index_path>.related/ up to date after index updates without recomputing every list:
+
+      - new and edited questions get fresh neighbour lists;
+      - questions whose list pointed at an edited or removed question are recomputed;
+      - new and edited questions are inserted into the lists of the questions they found nearby,
+        where they beat the current last entry.
+
+    The last step looks from the new question outward, so its results can differ slightly from
+    a full build_related_questions(), which the CLI's --full runs. Builds from scratch when there
+    is no graph yet. Returns statistics.
+    """
+    related_path = related_path_for(faiss_index_path)
+    if not os.path.exists(related_path):
+        return build_related_questions(faiss_index_path, index=index, chunk_store=chunk_store)
+    started = time.perf_counter()
+    existing = RelatedQuestions(related_path)
+    n_neighbors = existing.n_neighbors
+    own_store = chunk_store is None
+    index, chunk_store = _open_sources(faiss_index_path, index, chunk_store)
+    try:
+        states = chunk_store.question_states()
+        duplicate_ids = chunk_store.duplicate_ids()
+    finally:
+        if own_store:
+            chunk_store.close()
+
+    old_ids = [str(question_id) for question_id in existing.question_ids]
+    old_hashes = np.asarray(existing.hashes)
+    changed = {
+        question_id for question_id, state in states.items()
+        if question_id not in existing.row_of or old_hashes[existing.row_of[question_id]] != state['hash']
+    }
+    removed = [question_id for question_id in old_ids if question_id not in states]
+    if not changed and not removed:
+        return {'questions': len(old_ids), 'recomputed': 0, 'seconds': time.perf_counter() - started}
+
+    question_ids = sorted(states)
+    row_of = {question_id: row for row, question_id in enumerate(question_ids)}
+    row_of_key = {question_key(question_id): row for row, question_id in enumerate(question_ids)}
+    # Near-duplicate chunks are searched with their canonical's vector
+    chunk_ids = [chunk_store.canonical_ids(question_chunk_ids(question_id, states[question_id]['chunks']), duplicate_ids)
+                 for question_id in question_ids]
+
+    # Carry the unchanged lists over, re-pointing their rows; entries naming stale questions become -1
+    old_to_new = np.array([-1 if question_id in changed else row_of.get(question_id, -1) for question_id in old_ids] + [-1], dtype='int32')
+    neighbors = np.full((len(question_ids), n_neighbors), -1, dtype='int32')
+    distances = np.full((len(question_ids), n_neighbors), np.inf, dtype='float32')
+    unchanged_old = np.array([row for row, question_id in enumerate(old_ids) if question_id in states and question_id not in changed], dtype='int64')
+    unchanged_new = np.array([row_of[old_ids[row]] for row in unchanged_old], dtype='int64')
+    old_neighbors = np.asarray(existing.neighbors)[unchanged_old]
+    carried = old_to_new[old_neighbors] # -1 rows index the trailing -1
+    neighbors[unchanged_new] = carried
+    distances[unchanged_new] = np.where(carried >= 0, np.asarray(existing.distances)[unchanged_old], np.inf)
+    lost_entry = ((old_neighbors >= 0) & (carried < 0)).any(axis=1)
+
+    recompute = sorted(set(row_of[question_id] for question_id in changed) | set(unchanged_new[lost_entry].tolist()))
+    pairs = _question_pairs(index, recompute, chunk_ids, row_of_key, n_neighbors)
+    neighbors[recompute] = -1
+    distances[recompute] = np.inf
+    _fill(neighbors, distances, *_top_n(*pairs, n_neighbors))
+
+    # Insert the new/edited questions into the lists of the questions they found
+    changed_rows = np.array(sorted(row_of[question_id] for question_id in changed), dtype='int64')
+    src, dst, dist = pairs
+    from_changed = np.isin(src, changed_rows) & ~np.isin(dst, recompute)
+    targets = np.unique(dst[from_changed])
+    if len(targets):
+        current = neighbors[targets] >= 0
+        merged_src = np.concatenate([np.broadcast_to(targets[:, None], current.shape)[current], dst[from_changed]])
+        merged_dst = np.concatenate([neighbors[targets][current], src[from_changed]])
+        merged_dist = np.concatenate([distances[targets][current], dist[from_changed]])
+        neighbors[targets] = -1
+        distances[targets] = np.inf
+        _fill(neighbors, distances, *_top_n(*_min_per_pair(merged_src, merged_dst.astype('int64'), merged_dist), n_neighbors))
+
+    meta = dict(existing.meta, questions=len(question_ids), updated_at=time.time())
+    _write_related(related_path, question_ids, [states[q]['hash'] for q in question_ids], neighbors, distances, meta)
+    return {
+        'questions': len(question_ids),
+        'recomputed': len(recompute),
+        'updated_lists': len(recompute) + len(targets),
+        'removed': len(removed),
+        'seconds': time.perf_counter() - started
+    }
+
+class RelatedQuestions:
+    """
+    Read side of the related-questions graph. Arrays are memory-mapped; lookup() is a dict hit
+    plus one row read, whatever the corpus size.
+    """
+
+    def __init__(self, related_dir):
+        self.related_dir = related_dir
+        load = lambda name: np.load(os.path.join(related_dir, name), mmap_mode='r')
+        self.question_ids = load("question_ids.npy")
+        self.hashes = load("hashes.npy")
+        self.neighbors = load("neighbors.npy")
+        self.distances = load("distances.npy")
+        with open(os.path.join(related_dir, META_FILE), mode='r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.n_neighbors = self.meta['n_neighbors']
+        self.row_of = {str(question_id): row for row, question_id in enumerate(self.question_ids)}
+
+    def lookup(self, original_id, n=None):
+        """
+        [{'original_id', 'distance'}] of the questions related to original_id, nearest first
+        ([] for unknown ids).
+        """
+        row = self.row_of.get(str(original_id))
+        if row is None:
+            return []
+        n = self.n_neighbors if n is None else min(n, self.n_neighbors)
+        neighbors = self.neighbors[row, :n]
+        distances = self.distances[row, :n]
+        return [
+            {'original_id': str(self.question_ids[neighbor]), 'distance': float(distance)}
+            for neighbor, distance in zip(neighbors, distances) if neighbor >= 0
+        ]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute the related-questions kNN graph of a FAISS index.")
+    parser.add_argument("--index", required=True, help="faiss_index.bin written by faiss_indexer.py")
+    parser.add_argument("--neighbors", type=int, default=DEFAULT_NEIGHBORS)
+    parser.add_argument("--full", action="store_true", help="Recompute every list instead of updating incrementally")
+    args = parser.parse_args()
+
+    if args.full or not os.path.exists(related_path_for(args.index)):
+        stats = build_related_questions(args.index, args.neighbors)
+    else:
+        stats = update_related_questions(args.index)
+    print(f"Related questions: {stats['recomputed']} of {stats['questions']} lists computed in {stats['seconds']:.2f}s "
+          f"-> {related_path_for(args.index)}")
@@ -0,0 +1,202 @@
+import argparse
+import os
+import sys
+import threading
+import time
+from flask import Flask, jsonify, request
+from embedding_model import is_model_loaded
+from attribute_index import normalize_filters
+from faiss_indexer import map_path_for
+from micro_batcher import MicroBatcher
+from rag_retriever import RETRIEVAL_MODES, RAGRetriever
+
+# Configuration (environment, overridable on the command line)
+RAG_INDEX_PATH = os.environ.get('RAG_INDEX_PATH', "/app/models/faiss_index.bin")
+RAG_INDEX_ROOT = os.environ.get('RAG_INDEX_ROOT') # Versioned index root (index_versions.py); takes precedence over RAG_INDEX_PATH
+RAG_BATCH_MAX_SIZE = int(os.environ.get('RAG_BATCH_MAX_SIZE', '64'))
+RAG_BATCH_MAX_WAIT_MS = float(os.environ.get('RAG_BATCH_MAX_WAIT_MS', '5'))
+RAG_MMAP = os.environ.get('RAG_MMAP', '0') == '1'
+RAG_MAX_K = int(os.environ.get('RAG_MAX_K', '50'))
+RAG_REQUEST_TIMEOUT = float(os.environ.get('RAG_REQUEST_TIMEOUT', '30'))
+
+class RetrievalService:
+    """
+    One resident RAGRetriever behind a MicroBatcher: concurrent requests arriving within a few
+    milliseconds of each other are answered by a single retrieve_batch() call, i.e. one transformer
+    encode and one multi-row FAISS search instead of one of each per request.
+    """
+
+    def __init__(self, retriever, max_batch_size=RAG_BATCH_MAX_SIZE, max_wait_ms=RAG_BATCH_MAX_WAIT_MS):
+        self.retriever = retriever
+        self.started_at = time.time()
+        self.batcher = MicroBatcher(self._process_batch, max_batch_size, max_wait_ms, name="retrieval-batcher")
+
+    def _process_batch(self, requests):
+        """
+        requests: [(query, k, mode, filters)]. Requests with the same k, mode and filters share one
+        retrieve_batch call. A group that fails (e.g. lexical mode without a lexical index) gets the
+        exception in its own slots only, so requests that merely shared the batch window still succeed.
+        """
+        results = [None] * len(requests)
+        groups = {}
+        for i, (_, k, mode, filters) in enumerate(requests):
+            try:
+                group_key = (k, mode, normalize_filters(filters))
+            except ValueError as e:
+                results[i] = e
+                continue
+            groups.setdefault(group_key, []).append(i)
+        for (k, mode, _), positions in groups.items():
+            filters = requests[positions[0]][3]
+            try:
+                batch_results = self.retriever.retrieve_batch([requests[i][0] for i in positions], k, mode, filters)
+            except Exception as e:
+                batch_results = [e] * len(positions)
+            for i, result in zip(positions, batch_results):
+                results[i] = result
+        return results
+
+    def retrieve(self, query, k=3, mode=None, filters=None, timeout=RAG_REQUEST_TIMEOUT):
+        return self.batcher.submit((query, k, mode or self.retriever.mode, filters)).result(timeout)
+
+    def stats(self):
+        stats = {
+            'uptime_seconds': time.time() - self.started_at,
+            'batcher': self.batcher.stats(),
+            'caches': self.retriever.cache_stats()
+        }
+        index_root = getattr(self.retriever, 'index_root', None)
+        if index_root:
+            from reembed_migration import migration_status
+            stats['migration'] = migration_status(index_root) # Re-embedding progress and ETA, if any
+        return stats
+
+def to_json_result(chunks):
+    """
+    FAISS distances are numpy float32, which jsonify cannot serialize.
+    """
+    return [
+        {key: (float(value) if key in ('distance', 'score') and value is not None else value) for key, value in chunk.items()}
+        for chunk in chunks
+    ]
+
+def create_app(service):
+    app = Flask(__name__)
+
+    @app.route('/api/retrieve', methods=['POST'])
+    def api_retrieve():
+        """
+        Body: {"query": str, "k": int (default 3), "mode": "vector" | "lexical" | "hybrid" (optional),
+               "filters": {"subject" | "year" | "exam_type" | "difficulty": value or [values]} (optional)}.
+        """
+        data = request.get_json(silent=True) or {}
+        query = data.get('query')
+        if not query or not isinstance(query, str):
+            return jsonify({"error": "query is required"}), 400
+        try:
+            k = int(data.get('k', 3))
+        except (TypeError, ValueError):
+            return jsonify({"error": "k must be an integer"}), 400
+        if not 1 <= k <= RAG_MAX_K:
+            return jsonify({"error": f"k must be between 1 and {RAG_MAX_K}"}), 400
+        mode = data.get('mode')
+        if mode is not None and mode not in RETRIEVAL_MODES:
+            return jsonify({"error": f"mode must be one of {list(RETRIEVAL_MODES)}"}), 400
+        filters = data.get('filters')
+        if filters is not None:
+            if not isinstance(filters, dict):
+                return jsonify({"error": "filters must be an object"}), 400
+            try:
+                normalize_filters(filters)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+
+        started = time.perf_counter()
+        try:
+            results = service.retrieve(query, k, mode, filters)
+        except ValueError as e: # e.g. lexical mode without a lexical index
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            print(f"RetrievalService: retrieval failed for query '{query}': {e}", flush=True, file=sys.stderr)
+            return jsonify({"error": "Retrieval failed"}), 500
+        return jsonify({
+            "query": query,
+            "k": k,
+            "results": to_json_result(results),
+            "elapsed_ms": 1000 * (time.perf_counter() - started)
+        }), 200
+
+    @app.route('/api/related/<original_id>', methods=['GET'])
+    def api_related(original_id):
+        """
+        Precomputed related questions of one question. Query string: n (default: all stored, at most RAG_MAX_K).
+        """
+        try:
+            n = int(request.args.get('n', RAG_MAX_K))
+        except ValueError:
+            return jsonify({"error": "n must be an integer"}), 400
+        if not 1 <= n <= RAG_MAX_K:
+            return jsonify({"error": f"n must be between 1 and {RAG_MAX_K}"}), 400
+        try:
+            related = service.retriever.related_questions(original_id, n)
+        except ValueError as e: # No graph built for this index
+            return jsonify({"error": str(e)}), 404
+        return jsonify({"original_id": original_id, "related": related}), 200
+
+    @app.route('/api/sample', methods=['POST'])
+    def api_sample():
+        """
+        Body: {"m": int, "filters": {...} (optional), "seed": int (optional), "central": bool (optional)}.
+        Questions spread over distinct topic clusters, e.g. to assemble an exam.
+        """
+        data = request.get_json(silent=True) or {}
+        try:
+            m = int(data.get('m', 10))
+            seed = None if data.get('seed') is None else int(data['seed'])
+        except (TypeError, ValueError):
+            return jsonify({"error": "m and seed must be integers"}), 400
+        if m < 1:
+            return jsonify({"error": "m must be positive"}), 400
+        filters = data.get('filters')
+        if filters is not None and not isinstance(filters, dict):
+            return jsonify({"error": "filters must be an object"}), 400
+        started = time.perf_counter()
+        try:
+            questions = service.retriever.sample_questions(m, filters, seed, bool(data.get('central', False)))
+        except ValueError as e: # Unknown filter attribute, or no clusters built for this index
+            return jsonify({"error": str(e)}), 400
+        return jsonify({"m": m, "questions": questions, "elapsed_ms": 1000 * (time.perf_counter() - started)}), 200
+
+    @app.route('/api/health', methods=['GET'])
+    def api_health():
+        return jsonify({"status": "ok", "model_loaded": is_model_loaded(), "index_version": service.retriever.index_version}), 200
+
+    @app.route('/api/stats', methods=['GET'])
+    def api_stats():
+        """Batch sizes, queue depth and cache hit rates, for tuning RAG_BATCH_MAX_SIZE / RAG_BATCH_MAX_WAIT_MS."""
+        return jsonify(service.stats()), 200
+
+    return app
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP retrieval service with dynamic micro-batching.")
+    parser.add_argument("--index", default=RAG_INDEX_PATH)
+    parser.add_argument("--index-root", default=RAG_INDEX_ROOT, help="Serve the current version of a versioned index root and hot-swap on publish")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5002)
+    parser.add_argument("--max-batch-size", type=int, default=RAG_BATCH_MAX_SIZE)
+    parser.add_argument("--max-wait-ms", type=float, default=RAG_BATCH_MAX_WAIT_MS)
+    parser.add_argument("--mmap", action="store_true", default=RAG_MMAP)
+    args = parser.parse_args()
+
+    if args.index_root:
+        from index_versions import HotSwappingRetriever
+        retriever = HotSwappingRetriever(args.index_root, mmap=args.mmap)
+    else:
+        retriever = RAGRetriever(args.index, map_path_for(args.index), mmap=args.mmap)
+    service = RetrievalService(retriever, args.max_batch_size, args.max_wait_ms)
+    # Health checks answer right away; queries that arrive before the warm-up finishes wait for the model
+    threading.Thread(target=retriever.warm_up, name="retriever-warm-up", daemon=True).start()
+    print(f"RetrievalService: serving {args.index_root or args.index} (batch {args.max_batch_size}, wait {args.max_wait_ms}ms)", flush=True, file=sys.stderr)
+    # threaded: every request thread blocks on its Future while the batcher thread does the work
+    create_app(service).run(host=args.host, port=args.port, threaded=True)
@@ -0,0 +1,288 @@
+import argparse
+import json
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import AuthenticationError, get_context
+from multiprocessing.connection import Client, Listener
+import numpy as np
+from attribute_index import normalize_filters
+from embedding_cache import encode_with_cache, get_default_cache
+from embedding_model import embedding_model_id, get_model_for_id
+from faiss_indexer import load_index_params, load_shard_manifest, map_path_for
+
+# Wire format of one shard call, sent with Connection.send_bytes/recv_bytes (never pickled, so a
+# peer can send data but not code):
+#   request:  u32 header length, JSON header {"k", "filters", "rows", "dim"}, then rows * dim float32
+#             query values (little-endian, C order)
+#   response: JSON {"status": "ok", "results": [...]} or {"status": "error", "message": str}
+_HEADER_LENGTH = struct.Struct('<I')
+
+_shard_retriever = None
+
+def shard_authkey():
+    """
+    The shared secret shard servers and clients authenticate with, from SHARD_AUTHKEY. There is no
+    default: a key everyone knows would let anyone who reaches the port query the shard.
+    """
+    authkey = os.environ.get('SHARD_AUTHKEY')
+    if not authkey:
+        raise RuntimeError("SHARD_AUTHKEY is not set; set the same secret on every shard server and client")
+    return authkey.encode('utf-8')
+
+def encode_shard_request(query_embeddings, k, filters):
+    query_embeddings = np.ascontiguousarray(query_embeddings, dtype='<f4')
+    header = json.dumps({'k': int(k), 'filters': filters, 'rows': query_embeddings.shape[0],
+                         'dim': query_embeddings.shape[1]}).encode('utf-8')
+    return _HEADER_LENGTH.pack(len(header)) + header + query_embeddings.tobytes()
+
+def decode_shard_request(message):
+    """
+    (query_embeddings, k, filters) of an encoded request; raises ValueError when it is malformed.
+    """
+    if len(message) < _HEADER_LENGTH.size:
+        raise ValueError("Truncated shard request")
+    (header_length,) = _HEADER_LENGTH.unpack_from(message)
+    header = json.loads(message[_HEADER_LENGTH.size:_HEADER_LENGTH.size + header_length].decode('utf-8'))
+    rows, dim, k = int(header['rows']), int(header['dim']), int(header['k'])
+    data = message[_HEADER_LENGTH.size + header_length:]
+    if len(data) != rows * dim * 4:
+        raise ValueError(f"Shard request holds {len(data)} bytes of vectors, expected {rows} x {dim} float32")
+    filters = header.get('filters')
+    if filters is not None and not isinstance(filters, dict):
+        raise ValueError("filters must be an object")
+    return np.frombuffer(data, dtype='<f4').reshape(rows, dim), k, filters
+
+def encode_shard_results(results):
+    # FAISS distances are numpy float32, which json cannot serialize
+    return json.dumps({'status': 'ok', 'results': [
+        [dict(chunk, distance=None if chunk.get('distance') is None else float(chunk['distance'])) for chunk in chunks]
+        for chunks in results
+    ]}).encode('utf-8')
+
+def encode_shard_error(message):
+    return json.dumps({'status': 'error', 'message': message}).encode('utf-8')
+
+def _open_shard_retriever(faiss_index_path, mmap):
+    from rag_retriever import RAGRetriever
+    # Shards only ever see query vectors, so the query/result caches would never hit
+    return RAGRetriever(faiss_index_path, map_path_for(faiss_index_path), mmap=mmap, query_cache_size=0, result_cache_size=0)
+
+def _init_shard_process(faiss_index_path, mmap):
+    global _shard_retriever
+    _shard_retriever = _open_shard_retriever(faiss_index_path, mmap)
+
+def _search_shard_process(query_embeddings, k, filters):
+    return _shard_retriever.search_vectors(query_embeddings, k, filters)
+
+class ProcessShard:
+    """
+    One shard served by `replicas` local worker processes, each holding the shard's index
+    (with mmap=True the replicas share one copy through the page cache).
+    """
+
+    def __init__(self, faiss_index_path, mmap=False, replicas=1):
+        self.faiss_index_path = faiss_index_path
+        self.executor = ProcessPoolExecutor(max_workers=replicas, mp_context=get_context('spawn'),
+                                            initializer=_init_shard_process, initargs=(faiss_index_path, mmap))
+
+    def search(self, query_embeddings, k, filters=None):
+        return self.executor.submit(_search_shard_process, query_embeddings, k, filters)
+
+    def close(self):
+        self.executor.shutdown()
+
+class RemoteShard:
+    """
+    One shard on another host, reached through serve_shard() over an authenticated
+    multiprocessing connection (authkey defaults to shard_authkey()). Keeps a small pool of open
+    connections.
+    """
+
+    def __init__(self, address, authkey=None, connections=4):
+        self.address = address
+        self.authkey = authkey or shard_authkey()
+        self._connections = queue.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=connections, thread_name_prefix=f"shard-{address[0]}:{address[1]}")
+
+    def _call(self, query_embeddings, k, filters):
+        try:
+            connection = self._connections.get_nowait()
+        except queue.Empty:
+            connection = Client(self.address, authkey=self.authkey)
+        try:
+            connection.send_bytes(encode_shard_request(query_embeddings, k, filters))
+            response = json.loads(connection.recv_bytes().decode('utf-8'))
+        except (EOFError, OSError):
+            connection.close()
+            raise
+        self._connections.put(connection)
+        if response['status'] != 'ok':
+            raise RuntimeError(f"Shard {self.address[0]}:{self.address[1]} failed: {response['message']}")
+        return response['results']
+
+    def search(self, query_embeddings, k, filters=None):
+        return self.executor.submit(self._call, query_embeddings, k, filters)
+
+    def close(self):
+        self.executor.shutdown()
+        while not self._connections.empty():
+            self._connections.get_nowait().close()
+
+def serve_shard(faiss_index_path, address, authkey=None, mmap=False):
+    """
+    Serves one shard's search_vectors() to RemoteShard clients, one thread per connection.
+    authkey defaults to shard_authkey(), so a server never starts without an explicit secret.
+    """
+    authkey = authkey or shard_authkey()
+    retriever = _open_shard_retriever(faiss_index_path, mmap)
+
+    def handle(connection):
+        with connection:
+            while True:
+                try:
+                    message = connection.recv_bytes()
+                except (EOFError, OSError):
+                    return
+                try:
+                    connection.send_bytes(encode_shard_results(retriever.search_vectors(*decode_shard_request(message))))
+                except Exception as e:
+                    connection.send_bytes(encode_shard_error(str(e)))
+
+    with Listener(address, authkey=authkey) as listener:
+        print(f"ShardServer: serving {faiss_index_path} on {address[0]}:{address[1]}", flush=True, file=sys.stderr)
+        while True:
+            try:
+                connection = listener.accept()
+            except (AuthenticationError, OSError) as e: # A client with the wrong key must not stop the server
+                print(f"ShardServer: refused a connection: {e}", flush=True, file=sys.stderr)
+                continue
+            threading.Thread(target=handle, args=(connection,), daemon=True).start()
+
+def start_local_shard_servers(sharded_index_dir, authkey=None, host='127.0.0.1', base_port=6100, mmap=False, timeout=120.0):
+    """
+    Stand-in for shards on separate hosts: one serve_shard() process per shard on localhost
+    ports base_port, base_port + 1, ... Returns (processes, addresses) once every shard accepts connections.
+    """
+    authkey = authkey or shard_authkey()
+    manifest = load_shard_manifest(sharded_index_dir)
+    context = get_context('spawn')
+    processes, addresses = [], []
+    for position, shard in enumerate(manifest['shards']):
+        address = (host, base_port + position)
+        process = context.Process(target=serve_shard, args=(os.path.join(sharded_index_dir, shard['path']), address, authkey, mmap), daemon=True)
+        process.start()
+        processes.append(process)
+        addresses.append(address)
+    deadline = time.monotonic() + timeout
+    for address in addresses:
+        while True:
+            try:
+                Client(address, authkey=authkey).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Shard server at {address[0]}:{address[1]} did not start")
+                time.sleep(0.1)
+    return processes, addresses
+
+class ShardedRetriever:
+    """
+    Scatter-gather front end over an index built with faiss_indexer.py --shards N.
+
+    Queries are embedded once here, the vectors are sent to every shard in parallel (local worker
+    processes, or remote shard servers when remote_addresses is given, one per manifest shard in
+    order), and the per-shard top-k lists are merged by distance. With a subject-sharded index,
+    a subject filter only visits the shards holding those subjects. Vector mode only. Remote shards
+    authenticate with authkey (default: shard_authkey()).
+    """
+
+    def __init__(self, sharded_index_dir, remote_addresses=None, mmap=False, replicas=1, embedding_cache=None,
+                 authkey=None):
+        self.sharded_index_dir = sharded_index_dir
+        self.manifest = load_shard_manifest(sharded_index_dir)
+        if remote_addresses is not None:
+            if len(remote_addresses) != len(self.manifest['shards']):
+                raise ValueError(f"{len(remote_addresses)} remote addresses for {len(self.manifest['shards'])} shards")
+            authkey = authkey or shard_authkey()
+            self.shards = [RemoteShard(address, authkey) for address in remote_addresses]
+        else:
+            self.shards = [
+                ProcessShard(os.path.join(sharded_index_dir, shard['path']), mmap=mmap, replicas=replicas)
+                for shard in self.manifest['shards']
+            ]
+        self.embedding_cache = embedding_cache if embedding_cache is not None else get_default_cache()
+        # All shards are built from one embedding store, so the first shard's params name the model
+        first_shard = os.path.join(sharded_index_dir, self.manifest['shards'][0]['path'])
+        self.model_id = load_index_params(first_shard).get('model_name') or embedding_model_id()
+
+    def _shards_for(self, filters):
+        subjects = dict(normalize_filters(filters)).get('subject')
+        if self.manifest['shard_by'] != 'subject' or not subjects:
+            return self.shards
+        return [
+            shard for shard, info in zip(self.shards, self.manifest['shards'])
+            if set(info['subjects']) & set(subjects)
+        ]
+
+    def embed_queries(self, queries):
+        return encode_with_cache(get_model_for_id(self.model_id), list(queries), self.model_id, self.embedding_cache)
+
+    def search_vectors(self, query_embeddings, k=3, filters=None):
+        futures = [shard.search(query_embeddings, k, filters) for shard in self._shards_for(filters)]
+        merged = [[] for _ in range(len(query_embeddings))]
+        for future in futures:
+            for row, shard_results in enumerate(future.result()):
+                merged[row].extend(shard_results)
+        return [sorted(results, key=lambda chunk: chunk['distance'])[:k] for results in merged]
+
+    def retrieve_batch(self, queries, k=3, filters=None):
+        if not queries:
+            return []
+        return self.search_vectors(self.embed_queries(queries), k, filters)
+
+    def retrieve(self, query, k=3, filters=None):
+        return self.retrieve_batch([query], k, filters)[0]
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def parse_address(text):
+    host, port = text.rsplit(':', 1)
+    return host, int(port)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scatter-gather search over a sharded FAISS index.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve = subparsers.add_parser("serve", help="Serve one shard to remote ShardedRetrievers")
+    serve.add_argument("--index", required=True, help="A shard's faiss_index.bin")
+    serve.add_argument("--listen", default="127.0.0.1:6100",
+                       help="host:port (the shard answers anyone holding SHARD_AUTHKEY; bind other interfaces deliberately)")
+    serve.add_argument("--mmap", action="store_true")
+
+    query = subparsers.add_parser("query", help="Run one query through the shards")
+    query.add_argument("--index-dir", required=True, help="Directory written by faiss_indexer.py --shards N")
+    query.add_argument("--remote", nargs="+", help="host:port of each shard server, in manifest order")
+    query.add_argument("--k", type=int, default=3)
+    query.add_argument("query")
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        serve_shard(args.index, parse_address(args.listen), mmap=args.mmap)
+    else:
+        remote = [parse_address(address) for address in args.remote] if args.remote else None
+        with ShardedRetriever(args.index_dir, remote_addresses=remote) as retriever:
+            for i, result in enumerate(retriever.retrieve(args.query, args.k)):
+                print(f"Result {i+1}: {result['original_id']} (distance {result['distance']:.4f}) {result['chunk_text']}")
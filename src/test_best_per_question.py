@@ -0,0 +1,90 @@
+import numpy as np
+from conftest import question_row
+from faiss_indexer import (CHUNK_ID_BITS, chunk_faiss_id, map_path_for, question_key, question_keys_of,
+                           read_faiss_index)
+from rag_retriever import RAGRetriever, best_per_question, distinct_question_hits
+
+
+def naive_best_per_question(distances, indices, k):
+    best_distances = np.full((len(indices), k), np.inf, dtype='float32')
+    best_indices = np.full((len(indices), k), -1, dtype='int64')
+    found = []
+    for row in range(len(indices)):
+        seen = set()
+        kept = []
+        for distance, idx in zip(distances[row], indices[row]):
+            if idx != -1 and idx >> CHUNK_ID_BITS not in seen:
+                seen.add(idx >> CHUNK_ID_BITS)
+                kept.append((distance, idx))
+        found.append(len(kept))
+        for j, (distance, idx) in enumerate(kept[:k]):
+            best_distances[row, j], best_indices[row, j] = distance, idx
+    return best_distances, best_indices, np.asarray(found)
+
+
+def random_search_result(num_queries, pool, num_questions, seed=0):
+    rng = np.random.default_rng(seed)
+    distances = np.sort(rng.random((num_queries, pool)).astype('float32'), axis=1)
+    questions = rng.integers(0, num_questions, size=(num_queries, pool))
+    chunks = rng.integers(0, 4, size=(num_queries, pool))
+    indices = np.array([[chunk_faiss_id(f"q{q}", c) for q, c in zip(*pair)] for pair in zip(questions, chunks)],
+                       dtype='int64')
+    return distances, indices
+
+
+def test_matches_a_per_row_loop():
+    distances, indices = random_search_result(50, 40, 12)
+    indices[3, 10:] = -1  # A row FAISS could not fill
+    indices[7] = -1
+    for k in (1, 5, 12, 20):
+        expected = naive_best_per_question(distances, indices, k)
+        for got, want in zip(best_per_question(distances, indices, k), expected):
+            assert np.array_equal(got, want)
+
+
+def test_keeps_the_closest_chunk_of_each_question():
+    q1, q1b, q2, q3 = chunk_faiss_id('q1', 1), chunk_faiss_id('q1', 0), chunk_faiss_id('q2', 0), chunk_faiss_id('q3', 2)
+    distances = np.array([[0.1, 0.2, 0.3, 0.4]], dtype='float32')
+    indices = np.array([[q1, q1b, q2, q3]], dtype='int64')
+    best_distances, best_indices, found = best_per_question(distances, indices, 2)
+    assert best_indices.tolist() == [[q1, q2]]  # The closer chunk of q1 wins, whatever its chunk number
+    assert np.allclose(best_distances, [[0.1, 0.3]])
+    assert found.tolist() == [3]  # Counted before truncating to k
+
+
+def test_short_rows_are_padded_like_faiss():
+    indices = np.array([[chunk_faiss_id('q1', 0), chunk_faiss_id('q1', 1), -1],
+                        [-1, -1, -1]], dtype='int64')
+    distances = np.array([[0.1, 0.2, np.inf], [np.inf] * 3], dtype='float32')
+    best_distances, best_indices, found = best_per_question(distances, indices, 3)
+    assert best_indices.tolist() == [[chunk_faiss_id('q1', 0), -1, -1], [-1, -1, -1]]
+    assert np.isinf(best_distances[best_indices == -1]).all()
+    assert found.tolist() == [1, 0]
+
+
+def test_distinct_question_hits_keeps_first_hit_per_question():
+    hits = [(chunk_faiss_id('q1', 1), 0.1, None), (chunk_faiss_id('q2', 0), 0.2, None),
+            (chunk_faiss_id('q1', 0), 0.3, None), (chunk_faiss_id('q3', 0), 0.4, None)]
+    assert distinct_question_hits(hits, 5) == [hits[0], hits[1], hits[3]]
+    assert distinct_question_hits(hits, 2) == hits[:2]
+
+
+def test_retriever_searches_further_until_k_distinct_questions(build_index):
+    # Every question is two near-identical chunks, so a pool of k chunks holds about k / 2 questions
+    rows = [question_row(f"q{i}", f"경제 지문 {i} 수요 공급\n\n경제 지문 {i} 수요 공급?")
+            for i in range(30)]
+    index_path = build_index(rows)
+    retriever = RAGRetriever(index_path, map_path_for(index_path), overfetch=1)
+    index = read_faiss_index(index_path)
+    query = index.reconstruct(chunk_faiss_id('q7', 0))[None, :]
+
+    results = retriever.search_vectors(query, k=8)[0]
+    assert len({result['original_id'] for result in results}) == 8
+    assert results[0]['original_id'] == 'q7'
+
+    exact_distances, exact_ids = index.search(query, index.ntotal)
+    _, expected, _ = best_per_question(exact_distances, exact_ids, 8)
+    id_of_key = {question_key(row['id']): row['id'] for row in rows}
+    expected_ids = [id_of_key[key] for key in question_keys_of(expected[0]).tolist()]
+    assert [result['original_id'] for result in results] == expected_ids
+    retriever.close()
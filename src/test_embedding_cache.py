@@ -0,0 +1,145 @@
+import csv
+import os
+import sqlite3
+import threading
+import unicodedata
+import numpy as np
+import pytest
+import data_processor
+import embedding_cache
+from embedding_cache import (DEFAULT_CACHE_PATH, REPO_ROOT, EmbeddingCache, encode_with_cache, get_default_cache,
+                             merge_cache_stats, normalize_text, text_key)
+
+MODEL = 'test-model'
+
+
+def last_used(cache, text):
+    return cache._conn.execute("SELECT last_used FROM embeddings WHERE model = ? AND text_hash = ?",
+                               (MODEL, text_key(text))).fetchone()[0]
+
+
+def test_keys_ignore_whitespace_and_unicode_normalization():
+    assert normalize_text("  수요와\n\t공급  ") == "수요와 공급"
+    assert text_key(unicodedata.normalize('NFD', "수요와 공급")) == text_key("수요와 공급")
+    assert text_key("수요와 공급") != text_key("수요와 공급!")
+
+
+def test_only_missing_texts_are_encoded(tmp_path, fake_model):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+    first = encode_with_cache(fake_model, ["가격", "수요", "가격"], MODEL, cache)
+    assert fake_model.encoded == 2  # The repeat is encoded once
+    second = encode_with_cache(fake_model, ["수요 ", "공급", "가격"], MODEL, cache)
+    assert fake_model.encoded == 3
+    assert np.array_equal(second[0], first[1]) and np.array_equal(second[2], first[0])
+    assert np.allclose(second[1], fake_model.encode(["공급"])[0])
+    assert (cache.stats()['hits'], cache.stats()['misses']) == (2, 4)
+    # Vectors of another model are never returned
+    encode_with_cache(fake_model, ["가격"], 'other-model', cache)
+    assert fake_model.encoded == 5
+    cache.close()
+
+
+def test_entries_survive_reopening(tmp_path, fake_model):
+    path = str(tmp_path / "cache.sqlite")
+    cache = EmbeddingCache(path)
+    encode_with_cache(fake_model, ["가격", "수요"], MODEL, cache)
+    cache.close()
+    reopened = EmbeddingCache(path)
+    assert reopened.stats()['entries'] == 2
+    encode_with_cache(fake_model, ["가격"], MODEL, reopened)
+    assert reopened.stats()['hits'] == 1 and fake_model.encoded == 2
+    reopened.close()
+
+
+def test_hits_only_write_when_the_stamp_is_stale(tmp_path, fake_model, monkeypatch):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"), touch_interval=60)
+    clock = [1000.0]
+    monkeypatch.setattr(embedding_cache.time, 'time', lambda: clock[0])
+    encode_with_cache(fake_model, ["가격"], MODEL, cache)
+    clock[0] += 30
+    encode_with_cache(fake_model, ["가격"], MODEL, cache)
+    assert last_used(cache, "가격") == 1000.0  # Fresh enough: the lookup stayed read-only
+    assert not cache._conn.in_transaction
+    clock[0] += 60
+    encode_with_cache(fake_model, ["가격"], MODEL, cache)
+    assert last_used(cache, "가격") == 1090.0
+    cache.close()
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, fake_model, monkeypatch):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"), max_entries=4, touch_interval=0)
+    clock = [1000.0]
+
+    def tick():
+        clock[0] += 1
+        return clock[0]
+
+    monkeypatch.setattr(embedding_cache.time, 'time', tick)
+    for text in ("a", "b", "c", "d"):
+        encode_with_cache(fake_model, [text], MODEL, cache)
+    encode_with_cache(fake_model, ["a"], MODEL, cache)  # 'b' is now the least recently used
+    encode_with_cache(fake_model, ["e"], MODEL, cache)  # 5 > 4 entries: trimmed to 90%, i.e. 3
+    assert cache.stats()['entries'] == 3 and cache.stats()['evictions'] == 2
+    assert set(cache.get_many(MODEL, [text_key(text) for text in "abcde"])) == {text_key(text) for text in "ade"}
+    cache.close()
+
+
+def test_counters_are_exact_under_concurrency(tmp_path, fake_model):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+    encode_with_cache(fake_model, [f"text {i}" for i in range(10)], MODEL, cache)
+
+    def worker():
+        for _ in range(50):
+            encode_with_cache(fake_model, [f"text {i}" for i in range(10)], MODEL, cache)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert cache.stats()['hits'] == 8 * 50 * 10
+    assert cache.stats()['misses'] == 10
+    cache.close()
+
+
+def test_merged_worker_stats_add_up(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+    merged = merge_cache_stats([
+        {'path': cache.path, 'entries': 3, 'hits': 1, 'misses': 3, 'evictions': 0, 'hit_rate': 0.25},
+        {'path': cache.path, 'entries': 5, 'hits': 3, 'misses': 1, 'evictions': 2, 'hit_rate': 0.75},
+    ], cache)
+    assert (merged['hits'], merged['misses'], merged['evictions'], merged['hit_rate']) == (4, 4, 2, 0.5)
+    assert merged['entries'] == 0  # Read from the file, not summed
+    cache.close()
+
+
+def test_default_path_does_not_depend_on_the_working_directory(monkeypatch, tmp_path):
+    assert os.path.isabs(DEFAULT_CACHE_PATH)
+    assert DEFAULT_CACHE_PATH == os.path.join(REPO_ROOT, "data", "embedding_cache.sqlite")
+    assert os.path.isdir(os.path.join(REPO_ROOT, "src"))
+    assert get_default_cache() is None  # EMBEDDING_CACHE_PATH='' disables it (see conftest)
+    monkeypatch.setenv('EMBEDDING_CACHE_PATH', str(tmp_path / "custom.sqlite"))
+    cache = get_default_cache()
+    assert cache.path == str(tmp_path / "custom.sqlite")
+    cache.close()
+
+
+def test_ingestion_closes_the_cache_it_opened(monkeypatch, tmp_path, fake_model):
+    opened = []
+
+    def tracking_cache():
+        opened.append(EmbeddingCache(str(tmp_path / "cache.sqlite")))
+        return opened[-1]
+
+    monkeypatch.setattr(data_processor, 'get_default_cache', tracking_cache)
+    monkeypatch.setattr(data_processor, 'get_model', lambda: fake_model)
+    csv_path = tmp_path / "data.csv"
+    with open(csv_path, mode='w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['id', 'question_text'])
+        writer.writeheader()
+        writer.writerow({'id': 'q1', 'question_text': "지문\n\n문항"})
+    stats = data_processor.process_data_for_rag(str(csv_path), str(tmp_path / "store"), granularity='passage_stem')
+    assert stats['cache']['misses'] == 2
+    assert len(opened) == 1
+    with pytest.raises(sqlite3.ProgrammingError):
+        opened[0]._conn.execute("SELECT 1")
@@ -0,0 +1,118 @@
+import socket
+import threading
+import time
+import numpy as np
+import pytest
+import embedding_model
+from conftest import HashingModel
+from embedding_model import get_model_for_id, model_id_of
+from embedding_server import (EmbeddingClient, EmbeddingServer, encode_error, encode_request, encode_response,
+                              read_request, read_response)
+
+MODEL_ID = 'fake-model'
+
+
+@pytest.fixture
+def loaded_models(monkeypatch):
+    # Models are looked up by model id in embedding_model._models, so nothing real is ever loaded
+    models = {MODEL_ID: HashingModel(dim=16)}
+    monkeypatch.setattr(embedding_model, '_models', models)
+    return models
+
+
+@pytest.fixture
+def running_server(tmp_path, loaded_models):
+    socket_path = str(tmp_path / "embedding.sock")
+    server = EmbeddingServer(MODEL_ID, socket_path, max_wait_ms=1.0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    for _ in range(200):  # The socket is bound once _server is set
+        if server._server is not None:
+            break
+        time.sleep(0.01)
+    yield server
+    server.shutdown()
+    thread.join(timeout=5)
+
+
+def test_request_round_trips_over_a_socket():
+    left, right = socket.socketpair()
+    texts = ["수요와 공급", "", "a" * 70000]
+    left.sendall(encode_request('name+onnx-int8', texts))
+    assert read_request(right) == ('name+onnx-int8', texts)
+    left.close()
+    right.close()
+
+
+def test_response_round_trips_vectors_and_the_served_id():
+    left, right = socket.socketpair()
+    vectors = np.arange(12, dtype='float32').reshape(3, 4)
+    left.sendall(encode_response('name+onnx-fp32', vectors))
+    served_model_id, received = read_response(right)
+    assert served_model_id == 'name+onnx-fp32'
+    assert received.dtype == np.float32 and np.array_equal(received, vectors)
+
+    left.sendall(encode_response('name', np.zeros((0, 4), dtype='float32')))
+    assert read_response(right)[1].shape == (0, 4)
+    left.close()
+    right.close()
+
+
+def test_error_response_raises_the_server_message():
+    left, right = socket.socketpair()
+    left.sendall(encode_error("모델을 찾을 수 없음"))
+    with pytest.raises(RuntimeError, match="모델을 찾을 수 없음"):
+        read_response(right)
+    left.close()
+    right.close()
+
+
+def test_client_rejects_vectors_encoded_with_another_model():
+    client = EmbeddingClient("/nonexistent.sock", MODEL_ID)
+    left, right = socket.socketpair()
+    client._local.sock = left
+
+    def reply(model_id):
+        read_request(right)
+        right.sendall(encode_response(model_id, np.ones((1, 4), dtype='float32')))
+
+    replier = threading.Thread(target=reply, args=('other-model',))
+    replier.start()
+    with pytest.raises(RuntimeError, match="other-model"):
+        client.encode(["text"])
+    replier.join()
+    assert client._served_model_id is None
+
+    replier = threading.Thread(target=reply, args=(MODEL_ID,))
+    replier.start()
+    assert client.encode("text").shape == (4,)
+    replier.join()
+    assert client.served_model_id() == MODEL_ID
+    left.close()
+    right.close()
+
+
+def test_server_encodes_with_the_requested_model(running_server, loaded_models, monkeypatch):
+    monkeypatch.setenv('EMBEDDING_SERVER_SOCKET', running_server.socket_path)
+    client = get_model_for_id(MODEL_ID)
+    assert isinstance(client, EmbeddingClient)
+    texts = ["수요와 공급의 법칙", "헌법상 기본권"]
+    assert np.allclose(client.encode(texts), HashingModel(dim=16).encode(texts))
+    assert client.get_sentence_embedding_dimension() == 16
+    assert model_id_of(client) == MODEL_ID
+
+    # A second model id is loaded on first use and served side by side
+    loaded_models['fake-model+onnx-fp32'] = HashingModel(dim=8)
+    other = EmbeddingClient(running_server.socket_path, 'fake-model+onnx-fp32')
+    assert other.encode(texts).shape == (2, 8)
+    assert client.encode(texts).shape == (2, 16)
+
+
+def test_server_refuses_a_model_it_cannot_load(running_server, monkeypatch, tmp_path):
+    monkeypatch.setenv('ONNX_MODEL_DIR', str(tmp_path / "no-exports"))
+    client = EmbeddingClient(running_server.socket_path, 'missing-model+onnx-int8')
+    with pytest.raises(RuntimeError, match="Cannot encode with 'missing-model\\+onnx-int8'"):
+        client.encode(["text"])
+    # The connection stays usable after an error
+    client.model_id = MODEL_ID
+    assert client.encode(["text"]).shape == (1, 16)
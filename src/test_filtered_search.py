@@ -0,0 +1,116 @@
+import faiss
+import numpy as np
+import pytest
+import faiss_indexer
+from attribute_index import AttributeIndex, build_attribute_index, normalize_filters
+from conftest import question_row
+from faiss_indexer import (build_empty_index, exact_subset_search, filtered_search, map_path_for, question_chunk_ids,
+                           wrap_with_ids)
+from rag_retriever import RAGRetriever
+
+DIM = 8
+
+
+def clustered_ivf_index(index_type='ivf', nlist=16, per_cluster=50, seed=0):
+    """
+    IVF/HNSW index over well separated clusters, so a filter admitting only far-away clusters leaves
+    a narrow search (nprobe=1 / small efSearch) with no admitted vector in reach.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(nlist, DIM)).astype('float32') * 20
+    vectors = np.vstack([center + rng.normal(size=(per_cluster, DIM)).astype('float32') for center in centers])
+    ids = np.arange(len(vectors), dtype='int64') * 7 + 3
+    index = build_empty_index(DIM, index_type, len(vectors), nlist=nlist, hnsw_m=8)
+    if index_type == 'ivf':
+        index.train(vectors)
+    index = wrap_with_ids(index, index_type)
+    index.add_with_ids(vectors, ids)
+    return index, vectors, ids
+
+
+@pytest.fixture
+def small_exact_threshold(monkeypatch):
+    # Force the selector path on test-sized id sets
+    monkeypatch.setattr(faiss_indexer, 'EXACT_FILTER_MAX_IDS', 10)
+
+
+def test_normalize_filters_is_canonical_and_validated():
+    assert normalize_filters({'year': [2023, '2022', 2023], 'subject': '경제'}) == \
+        (('subject', ('경제',)), ('year', ('2022', '2023')))
+    assert normalize_filters(None) == ()
+    with pytest.raises(ValueError):
+        normalize_filters({'colour': 'red'})
+
+
+def test_attribute_index_ors_values_and_ands_attributes(tmp_path):
+    path = str(tmp_path / "attrs.npz")
+    build_attribute_index([
+        ([1, 2], {'subject': '경제', 'year': '2022'}),
+        ([3], {'subject': '경제', 'year': '2023'}),
+        ([4, 5], {'subject': '법', 'year': '2023'}),
+        ([6], {'year': '2023'}),
+    ], path)
+    attribute_index = AttributeIndex(path)
+    assert attribute_index.ids_for(normalize_filters({'subject': '경제'})).tolist() == [1, 2, 3]
+    assert attribute_index.ids_for(normalize_filters({'subject': ['경제', '법']})).tolist() == [1, 2, 3, 4, 5]
+    assert attribute_index.ids_for(normalize_filters({'subject': '경제', 'year': '2023'})).tolist() == [3]
+    assert attribute_index.ids_for(normalize_filters({'subject': '국어'})).tolist() == []
+    assert attribute_index.values('year') == {'2022': 2, '2023': 4}
+
+
+def test_small_id_sets_are_searched_exactly():
+    index, vectors, ids = clustered_ivf_index()
+    admitted = np.sort(ids[::97])
+    _, found = filtered_search(index, vectors[:3], 5, admitted, faiss.IDSelectorBatch(admitted))
+    _, expected = exact_subset_search(index, vectors[:3], 5, admitted)
+    assert np.array_equal(found, expected)
+    assert set(found[found != -1].tolist()) <= set(admitted.tolist())
+    assert (found[:, :len(admitted)] != -1).all()
+
+
+@pytest.mark.parametrize('index_type, narrow_params', [('ivf', {'nprobe': 1}), ('hnsw', {'efSearch': 1})])
+def test_selective_filters_are_widened_until_k_hits(small_exact_threshold, index_type, narrow_params):
+    index, vectors, ids = clustered_ivf_index(index_type)
+    # Only the last two clusters are admitted; the queries come from the first one
+    admitted = np.sort(ids[-100:])
+    queries = vectors[:4]
+    k = 10
+    _, found = filtered_search(index, queries, k, admitted, faiss.IDSelectorBatch(admitted), narrow_params)
+    assert (found != -1).all()
+    assert set(found.ravel().tolist()) <= set(admitted.tolist())
+    _, exact = exact_subset_search(index, queries, k, admitted)
+    recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(found.tolist(), exact.tolist())])
+    assert recall >= 0.9
+
+
+def test_fewer_matches_than_k_are_padded(small_exact_threshold):
+    index, vectors, ids = clustered_ivf_index()
+    admitted = np.sort(ids[-12:])
+    _, found = filtered_search(index, vectors[:2], 20, admitted, faiss.IDSelectorBatch(admitted), {'nprobe': 1})
+    assert ((found != -1).sum(axis=1) == 12).all()
+    assert (found[:, 12:] == -1).all()  # The hits come first, then the padding
+    assert set(found[:, :12].ravel().tolist()) == set(admitted.tolist())
+
+
+def test_retriever_filters_return_k_matching_questions(build_index):
+    rows = [
+        question_row(f"q{i}", f"지문 {i} 경제 수요 공급\n\n문항 {i} 설명으로 옳은 것은?",
+                     subject='경제' if i % 4 == 0 else '법', year=str(2020 + i % 3))
+        for i in range(40)
+    ]
+    index_path = build_index(rows)
+    retriever = RAGRetriever(index_path, map_path_for(index_path))
+    index = retriever.index
+    query = index.reconstruct(int(question_chunk_ids('q1', 1)[0]))[None, :]  # A '법' question
+
+    results = retriever.search_vectors(query, k=5, filters={'subject': '경제'})[0]
+    assert len(results) == 5
+    assert len({result['original_id'] for result in results}) == 5  # Distinct questions
+    assert all(int(result['original_id'][1:]) % 4 == 0 for result in results)
+
+    results = retriever.search_vectors(query, k=20, filters={'subject': '경제', 'year': ['2020']})[0]
+    expected = {f"q{i}" for i in range(40) if i % 4 == 0 and i % 3 == 0}
+    assert {result['original_id'] for result in results} == expected
+
+    assert retriever.search_vectors(query, k=5, filters={'subject': '국어'})[0] == []
+    retriever.close()
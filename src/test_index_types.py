@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from conftest import TEST_DIM, question_row
+from faiss_indexer import (build_empty_index, chunk_faiss_id, load_index_params, read_faiss_index,
+                           resolve_index_type)
+
+
+def rows(count):
+    return [question_row(f"q{i}", f"경제 지문 {i} 수요와 공급\n\n문항 {i} 균형 가격은?") for i in range(count)]
+
+
+def test_ivfpq_needs_one_training_vector_per_centroid():
+    assert resolve_index_type('ivfpq', 255) == 'ivf'
+    assert resolve_index_type('ivfpq', 256) == 'ivfpq'
+    assert resolve_index_type('ivfpq', 16, pq_nbits=4) == 'ivfpq'
+    assert resolve_index_type('flat', 1) == 'flat'
+    with pytest.raises(ValueError, match="at least 256 training vectors"):
+        build_empty_index(TEST_DIM, 'ivfpq', 255)
+
+
+def test_small_corpus_falls_back_to_ivf_flat(build_index, capsys):
+    index_path = build_index(rows(20), index_type='ivfpq')  # 40 chunks
+    assert "building an 'ivf' index instead of 'ivfpq'" in capsys.readouterr().err
+    params = load_index_params(index_path)
+    assert params['index_type'] == 'ivf' and params['ntotal'] == 40
+    index = read_faiss_index(index_path)
+    query = index.reconstruct(chunk_faiss_id('q3', 1))[None, :]
+    assert index.search(query, 1)[1][0, 0] == chunk_faiss_id('q3', 1)
+
+
+def test_large_enough_corpus_builds_ivfpq(build_index):
+    index_path = build_index(rows(130), index_type='ivfpq')  # 260 chunks
+    params = load_index_params(index_path)
+    assert params['index_type'] == 'ivfpq' and params['ntotal'] == 260
+    assert np.isfinite(read_faiss_index(index_path).search(np.ones((1, TEST_DIM), dtype='float32'), 5)[0]).all()
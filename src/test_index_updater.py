@@ -0,0 +1,113 @@
+import csv
+import numpy as np
+import pytest
+import faiss_indexer
+from chunk_store import ChunkStore
+from conftest import question_row
+from faiss_indexer import load_index_params, map_path_for, question_chunk_ids, read_faiss_index
+from index_updater import IndexUpdater, update_faiss_index_from_csv
+
+ROWS = [
+    question_row('q1', "수요와 공급의 법칙에 관한 지문\n\n균형 가격에 대한 설명으로 옳은 것은?", subject='경제'),
+    question_row('q2', "헌법상 기본권에 관한 지문\n\n기본권의 제한에 대한 설명으로 옳지 않은 것은?", subject='법'),
+    question_row('q3', "시의 화자와 정서에 관한 지문\n\n화자의 태도로 가장 적절한 것은?", subject='국어'),
+]
+
+
+def indexed_ids(index_path):
+    index = read_faiss_index(index_path)
+    return set(np.asarray([index.id_map.at(i) for i in range(index.ntotal)]).tolist())
+
+
+def chunk_store_ids(index_path):
+    chunk_store = ChunkStore(map_path_for(index_path), readonly=True)
+    try:
+        return {faiss_id for faiss_id, _ in chunk_store.iter_chunks()}
+    finally:
+        chunk_store.close()
+
+
+def test_build_keys_every_chunk_by_its_stable_id(build_index):
+    index_path = build_index(ROWS)
+    expected = {faiss_id for row in ROWS for faiss_id in question_chunk_ids(row['id'], 2).tolist()}
+    assert indexed_ids(index_path) == expected
+    assert chunk_store_ids(index_path) == expected
+
+
+def test_upsert_adds_new_and_replaces_edited_questions(build_index, fake_model):
+    index_path = build_index(ROWS)
+    updater = IndexUpdater(index_path, model=fake_model)
+    edited = dict(ROWS[0], question_text="수요와 공급의 법칙에 관한 지문")  # Now a single chunk
+    added = question_row('q4', "물리 에너지 보존에 관한 지문\n\n역학적 에너지에 대한 설명으로 옳은 것은?", subject='과학')
+    assert updater.upsert([edited, added]) == 3
+    updater.save()
+
+    expected = ({question_chunk_ids('q1', 1)[0]} | set(question_chunk_ids('q2', 2).tolist())
+                | set(question_chunk_ids('q3', 2).tolist()) | set(question_chunk_ids('q4', 2).tolist()))
+    assert indexed_ids(index_path) == expected
+    assert chunk_store_ids(index_path) == expected
+    assert load_index_params(index_path)['ntotal'] == len(expected)
+
+    chunk_store = ChunkStore(map_path_for(index_path), readonly=True)
+    assert chunk_store.question_states()['q1']['chunks'] == 1
+    assert chunk_store.fetch([question_chunk_ids('q4', 1)[0]])[question_chunk_ids('q4', 1)[0]]['original_id'] == 'q4'
+    chunk_store.close()
+
+
+def test_upsert_rejects_an_id_colliding_with_an_indexed_question(build_index, fake_model, monkeypatch):
+    index_path = build_index(ROWS)
+    before = indexed_ids(index_path)
+    real_question_key = faiss_indexer.question_key
+    monkeypatch.setattr(faiss_indexer, 'question_key',
+                        lambda original_id: real_question_key('q2' if original_id == 'q9' else original_id))
+    updater = IndexUpdater(index_path, model=fake_model)
+    with pytest.raises(ValueError, match="'q2' and 'q9'"):
+        updater.upsert([dict(ROWS[0], question_text="수정된 지문"), question_row('q9', "새 지문\n\n새 문항?")])
+    assert updater.index.ntotal == len(before)  # Nothing was removed or added
+    updater.remove(['q2'])
+    assert updater.upsert([question_row('q9', "새 지문\n\n새 문항?")]) == 2  # Free once q2 is gone
+
+
+def test_remove_drops_every_chunk_and_ignores_unknown_ids(build_index, fake_model):
+    index_path = build_index(ROWS)
+    updater = IndexUpdater(index_path, model=fake_model)
+    assert updater.remove(['q2', 'missing']) == 2
+    assert updater.remove(['q2']) == 0
+    updater.save()
+
+    remaining = set(question_chunk_ids('q1', 2).tolist()) | set(question_chunk_ids('q3', 2).tolist())
+    assert indexed_ids(index_path) == remaining
+    assert chunk_store_ids(index_path) == remaining
+    assert 'q2' not in IndexUpdater(index_path, model=fake_model).row_states
+
+
+def test_nothing_is_written_before_save(build_index, fake_model):
+    index_path = build_index(ROWS)
+    before = indexed_ids(index_path)
+    updater = IndexUpdater(index_path, model=fake_model)
+    updater.remove(['q1'])
+    updater.upsert([question_row('q9', "새 문항\n\n옳은 것은?")])
+    assert indexed_ids(index_path) == before
+    updater.chunk_store.close()
+
+
+def test_update_from_csv_applies_only_the_differences(build_index, fake_model, tmp_path):
+    index_path = build_index(ROWS)
+    csv_path = tmp_path / "data.csv"
+    rows = [ROWS[0], dict(ROWS[2], question_text=ROWS[2]['question_text'] + " (수정)"),
+            question_row('q5', "새 지문\n\n새 문항", subject='국어')]
+    with open(csv_path, mode='w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['id', 'question_text', 'subject'])
+        writer.writeheader()
+        writer.writerows(rows)
+
+    fake_model.encoded = 0
+    summary = update_faiss_index_from_csv(str(csv_path), index_path, model=fake_model)
+    assert summary['added'] == ['q5']
+    assert summary['updated'] == ['q3']
+    assert summary['removed'] == ['q2']
+    assert fake_model.encoded == 4  # Only the edited and new questions are embedded
+    assert summary['ntotal'] == 6
+
+    summary = update_faiss_index_from_csv(str(csv_path), index_path, model=fake_model)
+    assert (summary['added'], summary['updated'], summary['removed']) == ([], [], [])
@@ -0,0 +1,119 @@
+import os
+import sqlite3
+import pytest
+from conftest import question_row
+from faiss_indexer import map_path_for
+from index_versions import (HotSwappingRetriever, build_index_version, current_version, list_versions, new_version,
+                            prune_versions, publish_version, version_index_path, versions_path)
+from rag_retriever import RAGRetriever
+
+ROWS_V1 = [
+    question_row('q1', "수요와 공급의 법칙에 관한 지문\n\n균형 가격에 대한 설명으로 옳은 것은?", subject='경제'),
+    question_row('q2', "헌법상 기본권에 관한 지문\n\n기본권의 제한에 대한 설명으로 옳지 않은 것은?", subject='법'),
+]
+ROWS_V2 = ROWS_V1 + [question_row('q3', "시의 화자와 정서에 관한 지문\n\n화자의 태도로 가장 적절한 것은?", subject='국어')]
+
+
+def make_versions(index_root, names):
+    for name in names:
+        os.makedirs(os.path.dirname(version_index_path(index_root, name)))
+        open(version_index_path(index_root, name), 'w').close()
+
+
+def build_store(build_index, tmp_path, rows, name):
+    build_index(rows, name=name)
+    return str(tmp_path / f"{name}-store")
+
+
+def is_closed(chunk_store):
+    try:
+        chunk_store._conn.execute("SELECT 1")
+    except sqlite3.ProgrammingError:
+        return True
+    return False
+
+
+def test_prune_orders_by_creation_time_not_by_suffix(tmp_path):
+    root = str(tmp_path)
+    # The random suffixes sort the other way round from the timestamps
+    names = ['20240101-000000-zzzzzz', '20240102-000000-mmmmmm', '20240103-000000-aaaaaa', '20240104-000000-bbbbbb']
+    make_versions(root, names)
+    assert prune_versions(root, keep=1) == []  # Nothing is pruned before the first publish
+
+    publish_version(root, names[3])
+    assert prune_versions(root, keep=2) == names[:2]
+    assert list_versions(root) == names[2:]
+    assert current_version(root) == names[3]
+
+
+def test_versions_created_within_one_second_prune_in_order(tmp_path):
+    root = str(tmp_path)
+    created = [new_version(root) for _ in range(4)]
+    for version in created:
+        open(version_index_path(root, version), 'w').close()
+    assert list_versions(root) == created
+    publish_version(root, created[2])
+    assert prune_versions(root, keep=2) == created[:1]
+    assert list_versions(root) == created[1:]
+
+
+def test_prune_never_touches_versions_after_current(tmp_path):
+    root = str(tmp_path)
+    names = ['20240101-000000-aaaaaa', '20240102-000000-aaaaaa', '20240103-000000-aaaaaa', '20240104-000000-aaaaaa']
+    make_versions(root, names)
+    publish_version(root, names[3])
+    publish_version(root, names[1])  # Roll back; the newer versions, one being built, must survive
+    assert prune_versions(root, keep=1) == [names[0]]
+    assert list_versions(root) == names[1:]
+
+
+def test_publish_requires_a_built_index(tmp_path):
+    os.makedirs(os.path.join(versions_path(str(tmp_path)), '20240101-000000-aaaaaa'))
+    with pytest.raises(FileNotFoundError):
+        publish_version(str(tmp_path), '20240101-000000-aaaaaa')
+
+
+def test_reload_closes_the_previous_chunk_store(build_index):
+    index_path = build_index(ROWS_V1)
+    retriever = RAGRetriever(index_path, map_path_for(index_path))
+    old_chunk_store = retriever.chunk_store
+    build_index(ROWS_V2)  # Rebuilds the same path
+    assert retriever.check_for_index_update(force=True)
+    assert is_closed(old_chunk_store)
+    assert not is_closed(retriever.chunk_store)
+    assert retriever.chunk_store.count() == 6
+    retriever.close()
+    assert is_closed(retriever.chunk_store)
+
+
+def test_reload_waits_for_requests_on_the_old_index(build_index):
+    index_path = build_index(ROWS_V1)
+    retriever = RAGRetriever(index_path, map_path_for(index_path))
+    with retriever._lease() as loaded:
+        build_index(ROWS_V2)
+        assert retriever.check_for_index_update(force=True)
+        assert loaded.chunk_store.count() == 4  # Still readable mid-request
+        assert retriever.chunk_store.count() == 6
+    assert loaded.closed and is_closed(loaded.chunk_store)
+    retriever.close()
+
+
+def test_hot_swap_serves_the_new_version_and_releases_the_old(build_index, resident_fake_model, tmp_path):
+    root = str(tmp_path / "root")
+    first, _ = build_index_version(build_store(build_index, tmp_path, ROWS_V1, 'v1'), root, lexical=False)
+    retriever = HotSwappingRetriever(root, poll_interval=3600)
+    assert retriever.version == first
+    assert {r['original_id'] for r in retriever.retrieve("화자의 태도", k=5)} == {'q1', 'q2'}
+
+    with retriever._lease() as old:
+        second, _ = build_index_version(build_store(build_index, tmp_path, ROWS_V2, 'v2'), root, lexical=False, keep=1)
+        assert list_versions(root) == [second]  # The old version is pruned right away, even within the same second
+        assert retriever.check_for_new_version()
+        assert not is_closed(old.chunk_store)  # In-flight requests finish on the old version
+    assert is_closed(old.chunk_store)
+
+    assert retriever.version == second
+    assert retriever.retrieve("화자의 태도로 가장 적절한 것은?", k=1)[0]['original_id'] == 'q3'
+    assert not retriever.check_for_new_version()
+    assert retriever.swaps[-1]['from'] == first and retriever.swaps[-1]['to'] == second
+    retriever.close()
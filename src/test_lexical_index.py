@@ -0,0 +1,125 @@
+import math
+import unicodedata
+from collections import Counter
+import numpy as np
+import pytest
+import rag_retriever
+from chunk_store import ChunkStore
+from conftest import question_row
+from faiss_indexer import lexical_path_for, map_path_for
+from lexical_index import (BM25_B, BM25_K1, LexicalIndex, build_lexical_index, char_ngrams, reciprocal_rank_fusion,
+                           weighted_score_fusion)
+from rag_retriever import RAGRetriever
+
+DOCS = [
+    (10, "민법 제750조 불법행위의 성립 요건"),
+    (20, "수요와 공급의 법칙, 균형 가격의 결정"),
+    (30, "수요 곡선의 이동과 수요의 가격 탄력성"),
+    (40, "헌법 제37조 제2항 기본권 제한의 한계"),
+    (50, "공급 곡선 A와 B"),
+]
+ROWS = [
+    question_row('q1', "민법 제750조에 관한 지문\n\n불법행위 책임의 성립 요건으로 옳은 것은?", subject='법'),
+    question_row('q2', "수요와 공급의 법칙에 관한 지문\n\n균형 가격에 대한 설명으로 옳은 것은?", subject='경제'),
+    question_row('q3', "헌법 제37조 제2항에 관한 지문\n\n기본권 제한의 한계로 옳지 않은 것은?", subject='법'),
+    question_row('q4', "시의 화자와 정서에 관한 지문\n\n화자의 태도로 가장 적절한 것은?", subject='국어'),
+]
+
+
+def naive_bm25(docs, query):
+    grams = {faiss_id: Counter(char_ngrams(text)) for faiss_id, text in docs}
+    lengths = {faiss_id: sum(counts.values()) for faiss_id, counts in grams.items()}
+    avg_len = sum(lengths.values()) / len(docs)
+    scores = {}
+    for gram, query_tf in Counter(char_ngrams(query)).items():
+        df = sum(1 for counts in grams.values() if gram in counts)
+        idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+        for faiss_id, counts in grams.items():
+            tf = counts.get(gram, 0)
+            if tf:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[faiss_id] / avg_len)
+                scores[faiss_id] = scores.get(faiss_id, 0.0) + query_tf * idf * tf * (BM25_K1 + 1) / (tf + norm)
+    return scores
+
+
+@pytest.fixture
+def lexical_index(tmp_path):
+    build_lexical_index(DOCS, str(tmp_path / "lex"))
+    return LexicalIndex(str(tmp_path / "lex"))
+
+
+def test_char_ngrams_split_words_into_bigrams():
+    assert char_ngrams("수요와 공급 A") == ['수요', '요와', '공급', 'a']
+    assert char_ngrams(unicodedata.normalize('NFD', "수요")) == ['수요']
+    assert char_ngrams("제750조, (가)") == ['제7', '75', '50', '0조', '가']
+
+
+def test_search_matches_bm25_computed_by_hand(lexical_index):
+    for query in ("수요 곡선", "공급의 가격", "제37조 기본권", "수요 수요 탄력성"):
+        expected = naive_bm25(DOCS, query)
+        ids, scores = lexical_index.search(query, k=10)
+        assert sorted(ids.tolist()) == sorted(expected)
+        assert np.allclose(scores, [expected[faiss_id] for faiss_id in ids.tolist()], rtol=1e-5)
+        assert (np.diff(scores) <= 0).all()
+
+
+def test_search_limits_and_filters(lexical_index):
+    assert len(lexical_index.search("수요 공급 곡선", k=2)[0]) == 2
+    ids, _ = lexical_index.search("수요 공급 곡선", k=10, allowed_ids=np.array([20, 50], dtype='int64'))
+    assert sorted(ids.tolist()) == [20, 50]
+    assert len(lexical_index.search("존재하지않는말", k=10)[0]) == 0
+    assert len(lexical_index.search("", k=10)[0]) == 0
+
+
+def test_candidates_contain_every_gram_of_the_term(lexical_index):
+    assert lexical_index.candidates_containing("제750조").tolist() == [10]
+    assert sorted(lexical_index.candidates_containing("수요").tolist()) == [20, 30]
+    assert len(lexical_index.candidates_containing("수요 헌법")) == 0
+    assert len(lexical_index.candidates_containing("")) == 0
+
+
+def test_reciprocal_rank_fusion_sums_inverse_ranks():
+    fused = reciprocal_rank_fusion([[1, 2, 3], [3, 4]], rrf_k=60)
+    assert fused[1] == pytest.approx(1 / 61)
+    assert fused[3] == pytest.approx(1 / 63 + 1 / 61)
+    assert fused[4] == pytest.approx(1 / 62)
+    assert max(fused, key=fused.get) == 3  # Found by both beats first in one
+
+
+def test_weighted_fusion_normalizes_each_source():
+    fused = weighted_score_fusion([1, 2, 3], [0.1, 0.3, 0.5], [3, 4], [8.0, 2.0], vector_weight=0.25)
+    assert fused[1] == pytest.approx(0.25)  # Closest vector, no lexical hit
+    assert fused[2] == pytest.approx(0.125)
+    assert fused[3] == pytest.approx(0.75)  # Farthest vector, best lexical
+    assert fused[4] == pytest.approx(0.0)
+    # A single (or tied) score counts fully on either side
+    assert weighted_score_fusion([1], [0.7], [2], [3.0], vector_weight=0.5) == {1: pytest.approx(0.5), 2: pytest.approx(0.5)}
+
+
+@pytest.fixture
+def lexical_retriever(build_index):
+    index_path = build_index(ROWS)
+    chunk_store = ChunkStore(map_path_for(index_path), readonly=True)
+    build_lexical_index(chunk_store.iter_chunks(), lexical_path_for(index_path))
+    chunk_store.close()
+    retriever = RAGRetriever(index_path, map_path_for(index_path))
+    yield retriever
+    retriever.close()
+
+
+def test_lexical_mode_never_loads_the_model(lexical_retriever, monkeypatch):
+    monkeypatch.setattr(rag_retriever, 'get_model_for_id', None)  # Any call would fail
+    results = lexical_retriever.retrieve("제37조 제2항", k=2, mode='lexical')
+    assert results[0]['original_id'] == 'q3' and results[0]['distance'] is None and results[0]['score'] > 0
+    assert len({result['original_id'] for result in results}) == len(results)
+    filtered = lexical_retriever.retrieve("제37조 제750조", k=3, mode='lexical', filters={'subject': '법'})
+    assert {result['original_id'] for result in filtered} == {'q1', 'q3'}
+
+
+@pytest.mark.parametrize('fusion', ['rrf', 'weighted'])
+def test_hybrid_mode_fuses_both_rankings(lexical_retriever, resident_fake_model, fusion):
+    lexical_retriever.fusion = fusion
+    results = lexical_retriever.retrieve("민법 제750조 불법행위 책임", k=3, mode='hybrid')
+    assert results[0]['original_id'] == 'q1'
+    assert [result['score'] for result in results] == sorted((result['score'] for result in results), reverse=True)
+    assert results[0]['distance'] is not None  # Found by both sides
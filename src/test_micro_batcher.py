@@ -0,0 +1,74 @@
+import threading
+import pytest
+from micro_batcher import MicroBatcher
+
+
+def test_concurrent_items_share_one_batch():
+    batches = []
+    batcher = MicroBatcher(lambda items: batches.append(list(items)) or [item * 2 for item in items],
+                           max_batch_size=4, max_wait_ms=500)
+    futures = [batcher.submit(i) for i in range(4)]
+    assert [future.result(timeout=5) for future in futures] == [0, 2, 4, 6]
+    assert batches == [[0, 1, 2, 3]]  # Dispatched as soon as it was full, not after the wait
+    assert batcher.stats()['batches'] == 1
+    batcher.close()
+
+
+def test_batches_never_exceed_max_batch_size():
+    sizes = []
+    batcher = MicroBatcher(lambda items: sizes.append(len(items)) or items, max_batch_size=3, max_wait_ms=50)
+    futures = [batcher.submit(i) for i in range(10)]
+    assert [future.result(timeout=5) for future in futures] == list(range(10))
+    assert max(sizes) <= 3 and sum(sizes) == 10
+    batcher.close()
+
+
+def test_an_exception_result_fails_only_its_item():
+    def process(items):
+        return [ValueError(f"bad {item}") if item < 0 else item for item in items]
+
+    batcher = MicroBatcher(process, max_batch_size=3, max_wait_ms=500)
+    futures = [batcher.submit(item) for item in (1, -1, 2)]
+    assert futures[0].result(timeout=5) == 1
+    with pytest.raises(ValueError, match="bad -1"):
+        futures[1].result(timeout=5)
+    assert futures[2].result(timeout=5) == 2
+    batcher.close()
+
+
+def test_a_raising_process_batch_fails_the_whole_batch():
+    def process(items):
+        raise RuntimeError("encoder crashed")
+
+    batcher = MicroBatcher(process, max_batch_size=2, max_wait_ms=500)
+    futures = [batcher.submit(item) for item in (1, 2)]
+    for future in futures:
+        with pytest.raises(RuntimeError, match="encoder crashed"):
+            future.result(timeout=5)
+    batcher.close()
+
+
+def test_a_wrong_result_count_is_an_error():
+    batcher = MicroBatcher(lambda items: items[:1], max_batch_size=2, max_wait_ms=500)
+    futures = [batcher.submit(item) for item in (1, 2)]
+    with pytest.raises(RuntimeError, match="1 results for 2 items"):
+        futures[1].result(timeout=5)
+    batcher.close()
+
+
+def test_close_drains_queued_items_and_refuses_new_ones():
+    release = threading.Event()
+
+    def process(items):
+        release.wait(5)
+        return items
+
+    batcher = MicroBatcher(process, max_batch_size=1, max_wait_ms=0)
+    futures = [batcher.submit(i) for i in range(3)]
+    closer = threading.Thread(target=batcher.close)
+    closer.start()
+    release.set()
+    closer.join(5)
+    assert [future.result(timeout=5) for future in futures] == [0, 1, 2]
+    with pytest.raises(RuntimeError, match="closed"):
+        batcher.submit(4)
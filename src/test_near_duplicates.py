@@ -0,0 +1,111 @@
+import numpy as np
+from chunk_store import ChunkStore
+from conftest import question_row
+from faiss_indexer import chunk_faiss_id, load_index_params, map_path_for, read_faiss_index
+from index_updater import IndexUpdater
+from near_duplicates import NearDuplicateDetector, merge_dedup_reports
+from rag_retriever import RAGRetriever
+
+PASSAGE = "다음 글을 읽고 물음에 답하시오. 수요와 공급의 법칙에 따르면 가격이 오르면 수요량은 줄고 공급량은 늘어난다."
+ROWS = [
+    question_row('q1', f"{PASSAGE}\n\n균형 가격에 대한 설명으로 옳은 것은?", subject='경제'),
+    question_row('q2', f"{PASSAGE}\n\n초과 수요가 발생하는 조건으로 옳은 것은?", subject='경제'),
+    question_row('q3', f"{PASSAGE}  \n\n소비자 잉여에 대한 설명으로 옳지 않은 것은?", subject='경제'),
+    question_row('q4', "헌법상 기본권의 제한에 관한 지문\n\n과잉금지 원칙에 대한 설명으로 옳은 것은?", subject='법'),
+]
+
+
+def test_detector_collapses_near_identical_text_onto_the_first():
+    detector = NearDuplicateDetector()
+    assert detector.add('a', PASSAGE) is None
+    assert detector.add('b', PASSAGE + " ") == 'a'  # Whitespace is normalized away
+    assert detector.add('c', PASSAGE.replace("늘어난다", "늘어난다!")) == 'a'
+    assert detector.add('d', "헌법상 기본권의 제한에 관한 전혀 다른 지문입니다.") is None
+    report = detector.report(seconds_per_chunk=0.5, bytes_per_vector=128)
+    assert (report['chunks'], report['canonical_chunks'], report['duplicates']) == (4, 2, 2)
+    assert report['embed_seconds_saved'] == 1.0
+    assert report['vector_bytes_saved'] == 256
+
+
+def test_detector_keeps_texts_that_differ_in_a_number():
+    detector = NearDuplicateDetector()
+    first = "2023학년도 수능 경제 17번: 균형 가격이 1200원일 때"
+    assert detector.add(1, first) is None
+    assert detector.add(2, first.replace("1200", "1500")) is None
+
+
+def test_groups_never_chain_away_from_their_canonical():
+    # Each text is a near-duplicate of the previous one, but the drift adds up
+    words = [f"단어{i}" for i in range(60)]
+    detector = NearDuplicateDetector(threshold=0.8)
+    canonicals = set()
+    for step in range(0, 20, 2):
+        canonical = detector.add(step, " ".join(words[step:step + 40]))
+        if canonical is None:
+            canonicals.add(step)
+        else:
+            assert canonical in canonicals  # Always a group's first member, never another duplicate
+    assert detector.add('last', " ".join(words[18:58])) != 0
+    assert len(canonicals) > 1
+
+
+def test_merged_reports_recompute_the_ratio():
+    merged = merge_dedup_reports([
+        {'chunks': 10, 'canonical_chunks': 8, 'duplicates': 2, 'dedup_ratio': 0.2, 'detect_seconds': 1.0},
+        {'chunks': 30, 'canonical_chunks': 12, 'duplicates': 18, 'dedup_ratio': 0.6, 'detect_seconds': 2.0},
+    ])
+    assert merged['duplicates'] == 20
+    assert merged['dedup_ratio'] == 0.5
+    assert merged['detect_seconds'] == 3.0
+
+
+def test_duplicates_are_not_indexed_but_resolve_to_their_canonical(build_index):
+    index_path = build_index(ROWS, dedup=True)
+    canonical = chunk_faiss_id('q1', 0)
+    duplicates = {chunk_faiss_id('q2', 0), chunk_faiss_id('q3', 0)}
+    assert load_index_params(index_path)['duplicate_chunks'] == 2
+    index = read_faiss_index(index_path)
+    assert index.ntotal == 6
+    for duplicate in duplicates:
+        assert duplicate not in {index.id_map.at(i) for i in range(index.ntotal)}
+
+    chunk_store = ChunkStore(map_path_for(index_path), readonly=True)
+    assert chunk_store.canonical_ids(sorted(duplicates)).tolist() == [canonical, canonical]
+    assert chunk_store.fetch(duplicates)[chunk_faiss_id('q2', 0)]['original_id'] == 'q2'  # Text is kept
+    chunk_store.close()
+
+    retriever = RAGRetriever(index_path, map_path_for(index_path), distinct_questions=False)
+    query = read_faiss_index(index_path).reconstruct(canonical)[None, :]
+    top = retriever.search_vectors(query, k=1)[0][0]
+    assert top['original_id'] == 'q1'
+    assert sorted(top['duplicate_ids']) == ['q2', 'q3']
+    retriever.close()
+
+
+def test_removing_a_canonical_promotes_a_duplicate(build_index, fake_model):
+    index_path = build_index(ROWS, dedup=True)
+    canonical_vector = read_faiss_index(index_path).reconstruct(chunk_faiss_id('q1', 0))
+
+    updater = IndexUpdater(index_path, model=fake_model)
+    assert updater.remove(['q1']) == 2 - 1  # One of the two vectors lives on under the promoted duplicate
+    updater.save()
+
+    index = read_faiss_index(index_path)
+    ids = {index.id_map.at(i) for i in range(index.ntotal)}
+    promoted = min(chunk_faiss_id('q2', 0), chunk_faiss_id('q3', 0))  # The lowest surviving duplicate id
+    other = max(chunk_faiss_id('q2', 0), chunk_faiss_id('q3', 0))
+    assert chunk_faiss_id('q1', 0) not in ids and chunk_faiss_id('q1', 1) not in ids
+    assert promoted in ids
+    assert np.allclose(index.reconstruct(promoted), canonical_vector)
+
+    chunk_store = ChunkStore(map_path_for(index_path), readonly=True)
+    assert chunk_store.canonical_ids([other]).tolist() == [promoted]
+    assert chunk_store.count() == index.ntotal
+    chunk_store.close()
+
+    # Removing the last holder of the vector leaves nothing dangling
+    updater = IndexUpdater(index_path, model=fake_model)
+    updater.remove(['q2', 'q3'])
+    updater.save()
+    index = read_faiss_index(index_path)
+    assert {index.id_map.at(i) for i in range(index.ntotal)} == {chunk_faiss_id('q4', 0), chunk_faiss_id('q4', 1)}
@@ -0,0 +1,109 @@
+import sys
+import numpy as np
+import pytest
+from embedding_model import MODEL_NAME, embedding_model_id, parse_model_id
+from onnx_embedder import OnnxEmbedder, import_onnxruntime
+
+DIM = 8
+SENTENCES = ["수요와 공급", "헌법상 기본권의 제한", "시", "균형 가격에 대한 설명으로 옳은 것은?", "화자의 태도"]
+
+
+def token_vector(token_id):
+    rng = np.random.default_rng(token_id)
+    return rng.standard_normal(DIM).astype('float32')
+
+
+class CharTokenizer:
+    """
+    One token per character, padded with 0 to the longest sentence of the batch, like a HF tokenizer with padding=True.
+    """
+
+    def __call__(self, sentences, padding, truncation, max_length, return_tensors):
+        lengths = [min(len(sentence), max_length) for sentence in sentences]
+        input_ids = np.zeros((len(sentences), max(lengths)), dtype='int64')
+        attention_mask = np.zeros_like(input_ids)
+        for row, sentence in enumerate(sentences):
+            input_ids[row, :lengths[row]] = [ord(char) for char in sentence[:lengths[row]]]
+            attention_mask[row, :lengths[row]] = 1
+        return {'input_ids': input_ids, 'attention_mask': attention_mask}
+
+
+class TokenEmbeddingSession:
+    """
+    Stands in for the onnxruntime session: token embeddings that depend only on the token id, so
+    padding positions get vectors of their own that pooling must ignore.
+    """
+
+    def __init__(self):
+        self.batch_shapes = []
+
+    def run(self, output_names, feed):
+        self.batch_shapes.append(feed['input_ids'].shape)
+        return [np.stack([np.stack([token_vector(int(token)) for token in row]) for row in feed['input_ids']])]
+
+
+def stub_embedder(normalize=True, max_seq_length=128):
+    embedder = OnnxEmbedder.__new__(OnnxEmbedder)
+    embedder.config = {'model_name': MODEL_NAME, 'dim': DIM, 'max_seq_length': max_seq_length, 'normalize': normalize, 'quantized': True}
+    embedder.session = TokenEmbeddingSession()
+    embedder.input_names = ['input_ids', 'attention_mask']
+    embedder.tokenizer = CharTokenizer()
+    return embedder
+
+
+def mean_pooled(sentence, normalize=True):
+    vector = np.mean([token_vector(ord(char)) for char in sentence], axis=0)
+    return vector / np.linalg.norm(vector) if normalize else vector
+
+
+@pytest.mark.parametrize('normalize', [True, False])
+def test_pooling_matches_per_sentence_mean_pooling(normalize):
+    embedder = stub_embedder(normalize)
+    embeddings = embedder.encode(SENTENCES, batch_size=2)
+    expected = np.stack([mean_pooled(sentence, normalize) for sentence in SENTENCES])
+    assert embeddings.shape == (len(SENTENCES), DIM) and embeddings.dtype == np.float32
+    assert np.allclose(embeddings, expected, atol=1e-5)  # Padding ignored, input order restored
+    assert np.allclose(embedder.encode(SENTENCES[1]), expected[1], atol=1e-5)
+
+
+def test_batches_are_sorted_by_length():
+    embedder = stub_embedder()
+    embedder.encode(SENTENCES, batch_size=2)
+    # Longest first, so each batch pads only to a similar length
+    lengths = sorted((len(sentence) for sentence in SENTENCES), reverse=True)
+    assert [shape[1] for shape in embedder.session.batch_shapes] == lengths[::2]
+
+
+def test_missing_onnxruntime_names_the_optional_requirements(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'onnxruntime', None)
+    with pytest.raises(ImportError, match="requirements-onnx.txt"):
+        import_onnxruntime()
+
+
+def test_model_ids_keep_every_onnx_variant_apart():
+    assert embedding_model_id('m', 'torch') == 'm'
+    assert embedding_model_id('m', 'onnx', True) == 'm+onnx-int8'
+    assert embedding_model_id('m', 'onnx', False) == 'm+onnx-fp32'
+    for model_id in ('m', 'm+onnx-int8', 'm+onnx-fp32', 'org/m'):
+        assert embedding_model_id(*parse_model_id(model_id)) == model_id
+    assert parse_model_id('m+onnx') == ('m', 'onnx', True)  # Recorded before the variants were split
+
+
+@pytest.mark.parametrize('quantized, min_cosine', [(False, 0.9999), (True, 0.98)])
+def test_onnx_export_matches_sentence_transformers(tmp_path, monkeypatch, quantized, min_cosine):
+    # Needs the optional ONNX requirements, torch and the model itself; skipped otherwise
+    pytest.importorskip('onnxruntime')
+    sentence_transformers = pytest.importorskip('sentence_transformers')
+    from onnx_embedder import load_onnx_embedder
+
+    monkeypatch.setenv('ONNX_MODEL_DIR', str(tmp_path))
+    try:
+        reference = sentence_transformers.SentenceTransformer(MODEL_NAME, device='cpu')
+    except OSError as e:
+        pytest.skip(f"{MODEL_NAME} is not available: {e}")
+    expected = reference.encode(SENTENCES, normalize_embeddings=True)
+    embeddings = load_onnx_embedder(MODEL_NAME, quantized).encode(SENTENCES)
+    embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    assert (np.sum(embeddings * expected, axis=1) >= min_cosine).all()
+    # Nearest neighbours do not change
+    assert ((embeddings @ embeddings.T).argsort(axis=1)[:, -2] == (expected @ expected.T).argsort(axis=1)[:, -2]).all()
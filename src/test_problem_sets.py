@@ -0,0 +1,62 @@
+import pytest
+import data_processor
+from embedding_store import EmbeddingStore
+from problem_sets import PASSAGE_KIND, QUESTION_KIND, passage_entry, problem_set_rows
+
+PROBLEM_SETS = [
+    {
+        'problem_set_title': "[1～3] 다음 글을 읽고 물음에 답하시오.",
+        'passages': [{'label': '(가)', 'content': "수요와 공급의 법칙에 관한 지문"}, {'content': "균형 가격에 관한 지문"}],
+        'questions': [
+            {'number': '1.', 'question_text': "윗글의 내용과 일치하는 것은?", 'points': '2',
+             'options': [{'label': '①', 'content': "수요가 늘면 가격이 오른다."}, {'label': '②', 'content': "공급은 일정하다."}]},
+            {'number': '2', 'question_text': "(가)에 대한 설명으로 옳은 것은?"},
+            {'question_text': "번호가 없는 문항"},
+        ]
+    },
+    {'problem_set_title': "단독 문항", 'questions': [{'number': '4', 'question_text': "헌법상 기본권으로 옳은 것은?"}]},
+]
+
+
+def questions(numbers):
+    return [{'problem_set_title': "세트", 'questions': [{'number': number, 'question_text': f"문항 {i}"}
+                                                       for i, number in enumerate(numbers)]}]
+
+
+def test_rows_flatten_passages_once_and_link_questions_to_them():
+    rows = list(problem_set_rows(PROBLEM_SETS, 'exam', {'subject': '경제'}))
+    assert [row['id'] for row in rows] == ['exam-0-p0', 'exam-0-p1', 'exam-0-q1', 'exam-0-q2', 'exam-0-q3', 'exam-1-q4']
+    assert [row['kind'] for row in rows] == [PASSAGE_KIND] * 2 + [QUESTION_KIND] * 4
+    assert all(row['subject'] == '경제' for row in rows)
+    assert rows[0]['label'] == '(가)' and rows[1]['label'] == ''
+    assert rows[0]['question_text'] == "수요와 공급의 법칙에 관한 지문"
+    assert rows[2]['passage_ids'] == ['exam-0-p0', 'exam-0-p1'] and rows[5]['passage_ids'] == []
+    assert rows[2]['question_text'] == "윗글의 내용과 일치하는 것은?\n① 수요가 늘면 가격이 오른다.\n② 공급은 일정하다."
+    assert (rows[2]['number'], rows[2]['points'], rows[4]['number']) == ('1', '2', '3')  # Missing number: its position
+    assert rows[5]['problem_set_id'] == 'exam-1' and rows[5]['problem_set_title'] == "단독 문항"
+    assert [row['id'] for row in problem_set_rows(PROBLEM_SETS, 'exam')] == [row['id'] for row in rows]  # Stable
+
+
+def test_duplicate_numbers_are_renamed_not_overwritten():
+    ids = [row['id'] for row in problem_set_rows(questions(['1', '2', '2.', '2']), 'exam')]
+    assert ids == ['exam-0-q1', 'exam-0-q2', 'exam-0-q2.2', 'exam-0-q2.3']
+
+
+@pytest.mark.parametrize('numbers', [['1.2', '1', '1'], ['1', '1', '1.1'], ['1', '1', '1', '1.1', '1.2']])
+def test_renamed_numbers_never_collide_with_real_ones(numbers):
+    ids = [row['id'] for row in problem_set_rows(questions(numbers), 'exam')]
+    assert len(set(ids)) == len(ids)
+
+
+def test_passage_entry_only_for_passage_rows():
+    rows = list(problem_set_rows(PROBLEM_SETS, 'exam'))
+    assert passage_entry(rows[0]) == ('exam-0-p0', 'exam-0', '(가)', "수요와 공급의 법칙에 관한 지문")
+    assert passage_entry(rows[2]) is None
+
+
+@pytest.mark.parametrize('granularity, vectors', [('passage_stem', 6), ('question', 4)])
+def test_shared_passages_are_embedded_once(monkeypatch, tmp_path, fake_model, granularity, vectors):
+    monkeypatch.setattr(data_processor, 'get_model', lambda: fake_model)
+    stats = data_processor.process_problem_sets_for_rag(PROBLEM_SETS, str(tmp_path / "store"), 'exam', granularity=granularity)
+    assert (stats['passages'], stats['questions']) == (2, 4)
+    assert EmbeddingStore(str(tmp_path / "store")).count == vectors == fake_model.encoded
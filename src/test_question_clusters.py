@@ -0,0 +1,89 @@
+from collections import Counter
+import numpy as np
+import pytest
+from conftest import question_row
+from faiss_indexer import (clusters_path_for, map_path_for, normalize_rows, question_chunk_ids, question_key,
+                           read_faiss_index, save_question_clusters)
+from index_updater import IndexUpdater
+from question_clusters import QuestionClusters
+from rag_retriever import RAGRetriever
+
+SUBJECTS = ['경제', '법', '국어']
+ROWS = [question_row(f"q{i}", f"{SUBJECTS[i % 3]} 지문 {i}\n\n{SUBJECTS[i % 3]} 문항 {i}에 대한 설명으로 옳은 것은?",
+                     subject=SUBJECTS[i % 3]) for i in range(12)]
+
+
+@pytest.fixture
+def clusters(tmp_path):
+    # Cluster sizes 4, 2 and 1; the distance encodes the rank within the cluster
+    question_ids = ['a0', 'a1', 'a2', 'a3', 'b0', 'b1', 'c0']
+    assignments = [0, 0, 0, 0, 1, 1, 2]
+    distances = [0.0, 1.0, 2.0, 3.0, 0.0, 1.0, 0.0]
+    path = str(tmp_path / "clusters.npz")
+    save_question_clusters(path, question_ids, np.zeros((3, 4), dtype='float32'), assignments, distances)
+    return QuestionClusters(path)
+
+
+def cluster_counts(sample):
+    return sorted(Counter(question['cluster'] for question in sample).values(), reverse=True)
+
+
+def test_sample_spreads_over_as_many_clusters_as_possible(clusters):
+    assert clusters.cluster_sizes().tolist() == [4, 2, 1]
+    for seed in range(10):
+        assert cluster_counts(clusters.sample(2, seed=seed)) == [1, 1]
+        assert cluster_counts(clusters.sample(3, seed=seed)) == [1, 1, 1]
+        assert cluster_counts(clusters.sample(5, seed=seed)) == [2, 2, 1]
+        sample = clusters.sample(10, seed=seed)
+        assert sorted(question['original_id'] for question in sample) == sorted(clusters.question_ids.tolist())
+    assert clusters.sample(0) == []
+
+
+def test_sample_is_reproducible_and_central_prefers_typical_questions(clusters):
+    assert clusters.sample(5, seed=3) == clusters.sample(5, seed=3)
+    central = clusters.sample(5, seed=1, central=True)
+    assert {question['original_id'] for question in central} == {'a0', 'a1', 'b0', 'b1', 'c0'}
+
+
+def test_allowed_keys_restrict_the_candidates(clusters):
+    allowed = np.array([question_key('a2'), question_key('b1')], dtype='int64')
+    assert {question['original_id'] for question in clusters.sample(5, allowed)} == {'a2', 'b1'}
+    assert clusters.sample(5, np.zeros(0, dtype='int64')) == []
+
+
+def test_index_build_clusters_every_question(build_index):
+    index_path = build_index(ROWS, num_clusters=3)
+    question_clusters = QuestionClusters(clusters_path_for(index_path))
+    assert question_clusters.num_clusters == 3
+    assert sorted(question_clusters.question_ids.tolist()) == sorted(row['id'] for row in ROWS)
+    assert question_clusters.question_keys.tolist() == sorted(question_key(row['id']) for row in ROWS)
+
+
+def test_retriever_samples_with_filters(build_index):
+    index_path = build_index(ROWS, num_clusters=3)
+    retriever = RAGRetriever(index_path, map_path_for(index_path))
+    sample = retriever.sample_questions(4, filters={'subject': '법'}, seed=0)
+    assert len(sample) == 4 and {question['original_id'] for question in sample} == {'q1', 'q4', 'q7', 'q10'}
+    assert len(retriever.sample_questions(20, seed=0)) == 12
+    with pytest.raises(ValueError):
+        retriever.sample_questions(4, filters={'colour': 'red'})
+    retriever.close()
+
+
+def test_index_updates_reassign_touched_questions(build_index, fake_model):
+    index_path = build_index(ROWS, num_clusters=3)
+    updater = IndexUpdater(index_path, model=fake_model)
+    updater.remove(['q0'])
+    updater.upsert([question_row('q12', "경제 지문 12\n\n경제 문항 12에 대한 설명으로 옳은 것은?", subject='경제')])
+    updater.save()
+    updater.chunk_store.close()
+
+    question_clusters = QuestionClusters(clusters_path_for(index_path))
+    ids = question_clusters.question_ids.tolist()
+    assert 'q0' not in ids and 'q12' in ids and len(ids) == 12
+    row = ids.index('q12')
+    chunks = read_faiss_index(index_path).reconstruct_batch(question_chunk_ids('q12', 2))
+    vector = normalize_rows(chunks.mean(axis=0)[None, :])[0]
+    squared = ((question_clusters.centroids - vector) ** 2).sum(axis=1)
+    assert question_clusters.assignments[row] == squared.argmin()  # Nearest of the trained centroids
+    assert np.isclose(question_clusters.distances[row], squared.min(), atol=1e-5)
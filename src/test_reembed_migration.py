@@ -0,0 +1,134 @@
+import os
+import numpy as np
+import pytest
+import embedding_model
+from chunk_store import ChunkStore
+from conftest import HashingModel, question_row
+from embedding_store import EMBEDDINGS_FILE
+from faiss_indexer import load_index_params, map_path_for
+from index_updater import IndexUpdater
+from index_versions import build_index_version, current_version, version_index_path
+from rag_retriever import RAGRetriever
+from reembed_migration import IDS_FILE, ReembedMigration, cancel_migration, migration_path, migration_status
+
+NEW_MODEL = 'new-model'
+ROWS = [
+    question_row('q1', "수요와 공급의 법칙에 관한 지문\n\n균형 가격에 대한 설명으로 옳은 것은?", subject='경제'),
+    question_row('q2', "헌법상 기본권에 관한 지문\n\n기본권의 제한에 대한 설명으로 옳지 않은 것은?", subject='법'),
+    question_row('q3', "시의 화자와 정서에 관한 지문\n\n화자의 태도로 가장 적절한 것은?", subject='국어'),
+    question_row('q4', "물리 에너지 보존에 관한 지문\n\n역학적 에너지에 대한 설명으로 옳은 것은?", subject='과학'),
+]
+
+
+class StoppingModel(HashingModel):
+    """
+    Asks the migration to stop once it has encoded stop_after batches, like Ctrl-C mid-run.
+    """
+
+    def __init__(self, dim, stop_after):
+        super().__init__(dim)
+        self.stop_after = stop_after
+        self.batches = 0
+        self.migration = None
+
+    def encode(self, sentences, batch_size=None, **kwargs):
+        self.batches += 1
+        if self.migration is not None and self.batches == self.stop_after:
+            self.migration.stop()
+        return super().encode(sentences, batch_size, **kwargs)
+
+
+@pytest.fixture
+def index_root(build_index, resident_fake_model, tmp_path):
+    build_index(ROWS, name='source')
+    root = str(tmp_path / "root")
+    build_index_version(str(tmp_path / "source-store"), root, lexical=False)
+    return root
+
+
+@pytest.fixture
+def new_model(monkeypatch):
+    model = StoppingModel(dim=16, stop_after=1)
+    monkeypatch.setitem(embedding_model._models, NEW_MODEL, model)
+    return model
+
+
+def current_index_path(root):
+    return version_index_path(root, current_version(root))
+
+
+def test_migration_publishes_a_version_embedded_with_the_new_model(index_root, new_model):
+    source_version = current_version(index_root)
+    state = ReembedMigration(index_root, NEW_MODEL, batch_size=3).run()
+    assert state['status'] == 'published' and state['embedded_chunks'] == 8
+    assert current_version(index_root) == state['target_version'] != source_version
+    params = load_index_params(current_index_path(index_root))
+    assert (params['model_name'], params['dim'], params['ntotal']) == (NEW_MODEL, 16, 8)
+    assert params['migrated_from']['version'] == source_version
+    assert os.listdir(migration_path(index_root)) == ['state.json']  # Working files are removed
+
+    retriever = RAGRetriever(current_index_path(index_root), map_path_for(current_index_path(index_root)))
+    assert retriever.model_id == NEW_MODEL
+    assert retriever.retrieve("화자의 태도로 가장 적절한 것은?", k=1)[0]['original_id'] == 'q3'
+    retriever.close()
+
+
+def test_stopped_migration_resumes_from_its_checkpoint(index_root, new_model):
+    source_version = current_version(index_root)
+    migration = ReembedMigration(index_root, NEW_MODEL, batch_size=3)
+    new_model.migration = migration
+    state = migration.run()
+    assert (state['status'], state['embedded_chunks'], state['progress']) == ('embedding', 3, 3 / 8)
+    assert current_version(index_root) == source_version  # Still serving the old model
+    assert migration_status(index_root)['embedded_chunks'] == 3
+
+    # A crash after writing rows but before the checkpoint: those rows are dropped and embedded again
+    with open(os.path.join(migration_path(index_root), EMBEDDINGS_FILE), mode='ab') as f:
+        f.write(np.ones((2, 16), dtype='float32').tobytes())
+    with open(os.path.join(migration_path(index_root), IDS_FILE), mode='ab') as f:
+        f.write(np.array([1, 2], dtype='int64').tobytes())
+
+    new_model.migration = None
+    resumed = ReembedMigration(index_root, NEW_MODEL, batch_size=3)  # As a new process would
+    assert resumed.state['embedded_chunks'] == 3
+    state = resumed.run()
+    assert state['status'] == 'published' and state['embedded_chunks'] == 8
+    assert new_model.encoded == 8  # No chunk was embedded twice
+    assert load_index_params(current_index_path(index_root))['ntotal'] == 8
+
+
+def test_cancel_discards_the_migration_but_not_the_serving_version(index_root, new_model):
+    source_version = current_version(index_root)
+    migration = ReembedMigration(index_root, NEW_MODEL, batch_size=3)
+    new_model.migration = migration
+    migration.run()
+    with pytest.raises(ValueError, match="in progress"):
+        ReembedMigration(index_root, 'other-model')
+
+    cancel_migration(index_root)
+    assert migration_status(index_root) is None
+    assert current_version(index_root) == source_version
+    assert load_index_params(current_index_path(index_root))['ntotal'] == 8
+    restarted = ReembedMigration(index_root, 'other-model')
+    assert restarted.state['embedded_chunks'] == 0 and restarted.state['target_model'] == 'other-model'
+
+
+def test_updates_made_while_migrating_are_caught_up(index_root, new_model, fake_model):
+    migration = ReembedMigration(index_root, NEW_MODEL, batch_size=3)
+    new_model.migration = migration
+    migration.run()
+
+    # The serving version keeps taking updates with the old model
+    updater = IndexUpdater(current_index_path(index_root), model=fake_model)
+    updater.remove(['q2'])
+    updater.upsert([question_row('q5', "세포 분열에 관한 지문\n\n감수 분열의 특징으로 옳은 것은?", subject='과학')])
+    updater.save()
+    updater.chunk_store.close()
+
+    new_model.migration = None
+    state = migration.run()
+    assert state['status'] == 'published'
+    chunk_store = ChunkStore(map_path_for(current_index_path(index_root)), readonly=True)
+    assert set(chunk_store.question_states()) == {'q1', 'q3', 'q4', 'q5'}
+    chunk_store.close()
+    assert load_index_params(current_index_path(index_root))['ntotal'] == 8
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+from chunk_store import ChunkStore
+from conftest import question_row
+from faiss_indexer import map_path_for, question_chunk_ids, read_faiss_index, related_path_for
+from index_updater import IndexUpdater
+from rag_retriever import RAGRetriever
+from related_questions import RelatedQuestions, build_related_questions
+
+TOPICS = ["수요와 공급", "헌법상 기본권", "시의 화자", "에너지 보존", "세포 분열", "조선 후기 실학", "산성비와 대기",
+          "확률과 통계", "민법상 계약", "소설의 시점"]
+ROWS = [question_row(f"q{i}", f"{topic}에 관한 지문 {i}\n\n{topic}에 대한 설명으로 옳은 것은?")
+        for i, topic in enumerate(TOPICS)]
+
+
+def brute_force_related(index_path, n):
+    """
+    Question distance = min squared L2 over all chunk pairs, from the vectors in the index.
+    """
+    index = read_faiss_index(index_path)
+    chunk_store = ChunkStore(map_path_for(index_path), readonly=True)
+    states = chunk_store.question_states()
+    chunk_store.close()
+    vectors = {question_id: index.reconstruct_batch(question_chunk_ids(question_id, state['chunks']))
+               for question_id, state in states.items()}
+    related = {}
+    for question_id, mine in vectors.items():
+        scored = sorted(
+            (float(((mine[:, None, :] - theirs[None, :, :]) ** 2).sum(axis=2).min()), other)
+            for other, theirs in vectors.items() if other != question_id
+        )
+        related[question_id] = [(other, distance) for distance, other in scored[:n]]
+    return related
+
+
+def assert_graph_matches(index_path, n):
+    graph = RelatedQuestions(related_path_for(index_path))
+    for question_id, expected in brute_force_related(index_path, n).items():
+        found = graph.lookup(question_id)
+        assert [r['original_id'] for r in found] == [other for other, _ in expected]
+        assert np.allclose([r['distance'] for r in found], [distance for _, distance in expected], atol=1e-5)
+
+
+def test_graph_matches_brute_force_over_chunk_pairs(build_index):
+    index_path = build_index(ROWS)
+    stats = build_related_questions(index_path, n_neighbors=3)
+    assert stats['questions'] == stats['recomputed'] == 10
+    assert_graph_matches(index_path, 3)
+
+
+def test_lookup_truncates_and_ignores_unknown_ids(build_index):
+    index_path = build_index(ROWS)
+    build_related_questions(index_path, n_neighbors=3)
+    graph = RelatedQuestions(related_path_for(index_path))
+    assert len(graph.lookup('q0', n=2)) == 2
+    assert graph.lookup('q0', n=50) == graph.lookup('q0')
+    assert graph.lookup('missing') == []
+    assert all(r['original_id'] != 'q0' for r in graph.lookup('q0'))
+
+
+def test_index_updates_keep_the_graph_exact(build_index, fake_model):
+    index_path = build_index(ROWS)
+    build_related_questions(index_path, n_neighbors=3)
+    updater = IndexUpdater(index_path, model=fake_model)
+    updater.remove(['q3'])
+    updater.upsert([
+        dict(ROWS[5], question_text="수요와 공급에 관한 지문 5\n\n수요와 공급에 대한 설명으로 옳은 것은?"),  # Edited
+        question_row('q10', "헌법상 기본권에 관한 새 지문\n\n헌법상 기본권에 대한 설명으로 옳지 않은 것은?"),
+    ])
+    updater.save()
+    updater.chunk_store.close()
+
+    graph = RelatedQuestions(related_path_for(index_path))
+    assert 'q3' not in graph.row_of and 'q10' in graph.row_of
+    assert all(r['original_id'] != 'q3' for question_id in graph.row_of for r in graph.lookup(question_id))
+    assert_graph_matches(index_path, 3)
+
+
+def test_retriever_serves_the_graph_without_embedding(build_index, monkeypatch):
+    index_path = build_index(ROWS)
+    retriever = RAGRetriever(index_path, map_path_for(index_path))
+    with pytest.raises(ValueError, match="No related-questions graph"):
+        retriever.related_questions('q0')
+    retriever.close()
+
+    build_related_questions(index_path, n_neighbors=3)
+    retriever = RAGRetriever(index_path, map_path_for(index_path))
+    monkeypatch.setattr(retriever, 'embed_queries', None)  # Any call would fail
+    assert retriever.related_questions('q1', n=2) == RelatedQuestions(related_path_for(index_path)).lookup('q1', n=2)
+    retriever.close()
@@ -0,0 +1,58 @@
+import pytest
+from conftest import question_row
+from faiss_indexer import map_path_for
+from rag_retriever import RAGRetriever
+
+pytest.importorskip('flask')
+from retrieval_service import RetrievalService, create_app
+
+ROWS = [
+    question_row('q1', "수요와 공급의 법칙에 관한 지문\n\n균형 가격에 대한 설명으로 옳은 것은?", subject='경제'),
+    question_row('q2', "헌법상 기본권에 관한 지문\n\n기본권의 제한에 대한 설명으로 옳지 않은 것은?", subject='법'),
+    question_row('q3', "시의 화자와 정서에 관한 지문\n\n화자의 태도로 가장 적절한 것은?", subject='국어'),
+]
+
+
+@pytest.fixture
+def service(build_index, resident_fake_model):
+    # build_index writes no lexical index, so 'lexical' requests fail while 'vector' ones work
+    index_path = build_index(ROWS)
+    retriever = RAGRetriever(index_path, map_path_for(index_path))
+    service = RetrievalService(retriever, max_batch_size=2, max_wait_ms=1000)
+    yield service
+    service.batcher.close()
+    retriever.close()
+
+
+def test_requests_with_the_same_parameters_share_one_retrieve_batch(service, resident_fake_model):
+    futures = [service.batcher.submit((query, 2, 'vector', None)) for query in ("수요와 공급", "기본권의 제한")]
+    assert [future.result(timeout=10)[0]['original_id'] for future in futures] == ['q1', 'q2']
+    assert service.batcher.stats()['batches'] == 1
+    assert resident_fake_model.encoded == len(ROWS) * 2 + 2  # Both queries in one encode after the build
+
+
+def test_a_failing_request_does_not_fail_its_batch_neighbours(service):
+    failing = service.batcher.submit(("수요와 공급", 2, 'lexical', None))
+    working = service.batcher.submit(("기본권의 제한", 2, 'vector', None))
+    with pytest.raises(ValueError, match="No lexical index"):
+        failing.result(timeout=10)
+    assert working.result(timeout=10)[0]['original_id'] == 'q2'
+    assert service.batcher.stats()['batches'] == 1  # They really were co-batched
+
+    bad_filter = service.batcher.submit(("수요와 공급", 2, 'vector', {'colour': 'red'}))
+    filtered = service.batcher.submit(("수요와 공급", 3, 'vector', {'subject': '법'}))
+    with pytest.raises(ValueError):
+        bad_filter.result(timeout=10)
+    assert [chunk['original_id'] for chunk in filtered.result(timeout=10)] == ['q2']
+
+
+def test_http_errors_map_to_status_codes(service):
+    client = create_app(service).test_client()
+    response = client.post('/api/retrieve', json={'query': "수요와 공급", 'k': 1})
+    assert response.status_code == 200
+    assert response.get_json()['results'][0]['original_id'] == 'q1'
+    assert isinstance(response.get_json()['results'][0]['distance'], float)
+    assert client.post('/api/retrieve', json={'query': "수요와 공급", 'mode': 'lexical'}).status_code == 400
+    assert client.post('/api/retrieve', json={'query': "수요와 공급", 'k': 0}).status_code == 400
+    assert client.post('/api/retrieve', json={'k': 1}).status_code == 400
+    assert client.post('/api/retrieve', json={'query': "x", 'filters': {'colour': 'red'}}).status_code == 400
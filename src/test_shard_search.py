@@ -0,0 +1,90 @@
+import json
+import socket
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+import numpy as np
+import pytest
+from conftest import question_row
+from faiss_indexer import chunk_faiss_id, read_faiss_index
+from shard_search import RemoteShard, decode_shard_request, encode_shard_request, serve_shard, shard_authkey
+
+AUTHKEY = b'test-shard-secret'
+ROWS = [
+    question_row('q1', "수요와 공급의 법칙에 관한 지문\n\n균형 가격에 대한 설명으로 옳은 것은?", subject='경제'),
+    question_row('q2', "헌법상 기본권에 관한 지문\n\n기본권의 제한에 대한 설명으로 옳지 않은 것은?", subject='법'),
+]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def shard_server(build_index):
+    index_path = build_index(ROWS)
+    address = ('127.0.0.1', free_port())
+    threading.Thread(target=serve_shard, args=(index_path, address, AUTHKEY), daemon=True).start()
+    for _ in range(200):
+        try:
+            Client(address, authkey=AUTHKEY).close()
+            break
+        except OSError:
+            time.sleep(0.01)
+    return index_path, address
+
+
+def test_request_round_trips_as_plain_bytes():
+    queries = np.arange(6, dtype='float32').reshape(2, 3)
+    message = encode_shard_request(queries, 5, {'subject': ['경제']})
+    decoded, k, filters = decode_shard_request(message)
+    assert np.array_equal(decoded, queries) and decoded.dtype == np.float32
+    assert (k, filters) == (5, {'subject': ['경제']})
+
+
+def test_malformed_requests_are_rejected():
+    message = encode_shard_request(np.zeros((2, 3), dtype='float32'), 5, None)
+    with pytest.raises(ValueError):
+        decode_shard_request(message[:-4])
+    with pytest.raises(ValueError):
+        decode_shard_request(b'\x01')
+
+
+def test_no_default_authkey(monkeypatch, build_index):
+    monkeypatch.delenv('SHARD_AUTHKEY', raising=False)
+    with pytest.raises(RuntimeError, match="SHARD_AUTHKEY"):
+        shard_authkey()
+    with pytest.raises(RuntimeError, match="SHARD_AUTHKEY"):
+        serve_shard(build_index(ROWS), ('127.0.0.1', free_port()))
+    with pytest.raises(RuntimeError, match="SHARD_AUTHKEY"):
+        RemoteShard(('127.0.0.1', 6100))
+    monkeypatch.setenv('SHARD_AUTHKEY', 'secret')
+    assert shard_authkey() == b'secret'
+
+
+def test_remote_shard_searches_over_the_framed_format(shard_server):
+    index_path, address = shard_server
+    query = read_faiss_index(index_path).reconstruct(chunk_faiss_id('q2', 0))[None, :]
+    shard = RemoteShard(address, AUTHKEY)
+    results = shard.search(query, 2).result(timeout=10)
+    assert results[0][0]['original_id'] == 'q2'
+    assert isinstance(results[0][0]['distance'], float)
+    assert [chunk['original_id'] for chunk in shard.search(query, 2, {'subject': '경제'}).result(timeout=10)[0]] == ['q1']
+    with pytest.raises(RuntimeError, match="failed"):
+        shard.search(query, 2, {'colour': 'red'}).result(timeout=10)
+    assert shard.search(query, 1).result(timeout=10)[0][0]['original_id'] == 'q2'  # Connection survives errors
+    shard.close()
+
+
+def test_server_never_unpickles_and_refuses_other_keys(shard_server):
+    _, address = shard_server
+    with pytest.raises(AuthenticationError):
+        Client(address, authkey=b'wrong-key')
+    connection = Client(address, authkey=AUTHKEY)
+    connection.send(('a pickled', 'object'))  # Arrives as opaque bytes, not as an object
+    response = json.loads(connection.recv_bytes().decode('utf-8'))
+    assert response['status'] == 'error'
+    connection.close()
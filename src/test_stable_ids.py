@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+import faiss_indexer
+from conftest import question_row
+from faiss_indexer import (CHUNK_ID_BITS, MAX_CHUNKS_PER_QUESTION, check_question_keys, chunk_faiss_id,
+                           question_chunk_ids, question_key, question_keys_of, row_content_hash)
+
+
+def colliding_keys(monkeypatch, *question_ids):
+    """
+    Makes question_ids share one question key, since real 47-bit collisions cannot be found for a test.
+    """
+    real_question_key = faiss_indexer.question_key
+    monkeypatch.setattr(faiss_indexer, 'question_key',
+                        lambda original_id: 12345 if original_id in question_ids else real_question_key(original_id))
+
+
+def test_question_key_is_stable_and_fits_the_id_space():
+    # Pinned: changing the hashing would orphan the ids of every saved index
+    assert question_key('q1') == 57451378856637
+    assert question_key('수능-2023-q17') == 15157031934405
+    assert question_key(1) == question_key('1')
+    assert question_key('q1') != question_key('q2')
+    for original_id in ('q1', '수능-2023-q17', 'x' * 500, ''):
+        key = question_key(original_id)
+        assert 0 <= key < 1 << (63 - CHUNK_ID_BITS)
+        assert (key << CHUNK_ID_BITS) + MAX_CHUNKS_PER_QUESTION - 1 < 1 << 63
+
+
+def test_question_keys_do_not_collide_on_a_realistic_corpus():
+    keys = {question_key(f"set{s}-q{n}") for s in range(200) for n in range(50)}
+    assert len(keys) == 200 * 50
+
+
+def test_chunk_ids_share_the_question_key():
+    ids = question_chunk_ids('q7', 3)
+    assert ids.dtype == np.int64
+    assert ids.tolist() == [chunk_faiss_id('q7', i) for i in range(3)]
+    assert set(question_keys_of(ids).tolist()) == {question_key('q7')}
+    assert (ids & (MAX_CHUNKS_PER_QUESTION - 1)).tolist() == [0, 1, 2]
+    assert len(question_chunk_ids('q7', 0)) == 0
+
+
+def test_too_many_chunks_are_rejected():
+    with pytest.raises(ValueError):
+        question_chunk_ids('q1', MAX_CHUNKS_PER_QUESTION + 1)
+
+
+def test_row_content_hash_tracks_content_changes():
+    row = {'id': 'q1', 'question_text': '다음 중 옳은 것은?', 'subject': '경제'}
+    assert row_content_hash(row) == row_content_hash(dict(row))
+    assert row_content_hash(row) != row_content_hash(dict(row, question_text='다음 중 옳지 않은 것은?'))
+    assert row_content_hash(row) != row_content_hash(dict(row, subject='법'))
+
+
+def test_colliding_question_ids_are_rejected(monkeypatch):
+    colliding_keys(monkeypatch, 'q1', 'q9')
+    owners = check_question_keys(['q1', 'q2', 'q1', 1])
+    assert owners[12345] == 'q1'
+    assert check_question_keys(['1'], owners) == owners  # Same id, however it is typed
+    with pytest.raises(ValueError, match="'q1' and 'q9'"):
+        check_question_keys(['q9'], owners)
+    assert 'q9' not in owners.values()  # The known owners are left as they were
+
+
+def test_build_fails_on_a_question_key_collision(build_index, monkeypatch):
+    colliding_keys(monkeypatch, 'q1', 'q2')
+    rows = [question_row('q1', "수요와 공급\n\n균형 가격은?"), question_row('q2', "헌법상 기본권\n\n제한은?")]
+    with pytest.raises(ValueError, match="same question key"):
+        build_index(rows)